@@ -1,11 +1,32 @@
 """
 Flask API server for text-to-image generation
 """
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
-from inference_hf_model import generate_image
+from inference_hf_model import candidate_seeds, generate_image, generate_images_batch, get_device_and_dtype, get_pipeline, is_sdxl_model, resolve_model
+from batching import MicroBatcher
+from jobs import JobManager, QueueFullError
+from pipeline_registry import default_registry
+from cpu_profile import default_cpu_profile
+from prompt_cache import default_prompt_cache
+from previews import latents_to_preview, preview_base64
+from result_cache import ResultCache, result_key, model_revision
+from image_io import FORMATS, BackgroundWriter, encode_image, negotiate_format
+from warmup import Readiness, parse_resolutions
+from metrics import (
+    IN_FLIGHT, QUEUE_DEPTH, QUEUE_WAIT_SECONDS, REQUEST_SECONDS, REQUESTS, StageTimer, default_metrics, timed
+)
+from schedulers import QUALITY_PRESETS, SCHEDULERS, lcm_available, quality_preset, resolve_scheduler
+from refine import resolve_refine
+from single_flight import SingleFlight, flight_key
+from vae_decode import resolve_vae_mode
 import os
 import io
+import json
+import queue
+import threading
+import time
+import functools
 from PIL import Image
 import uuid
 
@@ -18,13 +39,677 @@ MODEL_PATH = os.getenv("MODEL_PATH", None)  # Local model path (optional, overri
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", "./outputs")
 DEFAULT_STEPS = int(os.getenv("DEFAULT_STEPS", "30"))  # Reduced for faster generation
 DEFAULT_GUIDANCE = float(os.getenv("DEFAULT_GUIDANCE", "7.5"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "4"))  # 1 disables micro-batching
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "50"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))  # Concurrent generations for /jobs
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "16"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+PREVIEW_EVERY_N_STEPS = int(os.getenv("PREVIEW_EVERY_N_STEPS", "5"))  # 0 disables streamed previews
+PREVIEW_MAX_SIZE = int(os.getenv("PREVIEW_MAX_SIZE", "128"))
+PREVIEW_DECODER = os.getenv("PREVIEW_DECODER", "approx")  # "approx" (linear projection) or "tiny" (TAESD)
+DEFAULT_VAE_MODE = os.getenv("DEFAULT_VAE_MODE", "auto")  # full / tiled / tiny / auto (tiled for large outputs)
+RESULT_CACHE_MEMORY_MB = float(os.getenv("RESULT_CACHE_MEMORY_MB", "256"))  # 0 disables the tier
+RESULT_CACHE_DISK_MB = float(os.getenv("RESULT_CACHE_DISK_MB", "2048"))  # 0 disables the tier
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "90"))  # Default quality for lossy WebP/JPEG responses
+DEFAULT_SCHEDULER = os.getenv("DEFAULT_SCHEDULER", "default")  # "default" keeps the model's own sampler
+DEFAULT_PRESET = os.getenv("DEFAULT_PRESET", None)  # draft / standard / final for requests without a preset
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "True").lower() == "true"  # Load weights at startup, not on the first request
+WARMUP_RESOLUTIONS = os.getenv("WARMUP_RESOLUTIONS", "512x512")  # HEIGHTxWIDTH list; empty skips warm-up runs
+WARMUP_STEPS = int(os.getenv("WARMUP_STEPS", "2"))
+GENERATOR_BACKEND = os.getenv("GENERATOR_BACKEND", "diffusers")  # "stub" fakes generation for load tests
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))  # 0 generates in the API process
+WORKER_CORES = int(os.getenv("WORKER_CORES", "0"))  # Physical cores per worker (0 = split the host evenly)
+WORKER_LOAD_CONCURRENCY = int(os.getenv("WORKER_LOAD_CONCURRENCY", "1"))  # Workers loading weights at once
+MAX_NUM_IMAGES = int(os.getenv("MAX_NUM_IMAGES", "8"))  # Candidates one request may ask for
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "True").lower() == "true"  # Identical concurrent requests share one generation
+SINGLE_FLIGHT_UNSEEDED = os.getenv("SINGLE_FLIGHT_UNSEEDED", "False").lower() == "true"  # Also share unseeded ones (same random image)
+
+if GENERATOR_BACKEND == "stub":
+    # Same signatures as inference_hf_model; cost set by the STUB_* variables
+    from stub_generator import StubGenerator
+    stub_generator = StubGenerator.from_env()
+    generate_image = stub_generator.generate_image
+    generate_images_batch = stub_generator.generate_images_batch
+    print(f"Using stub generator backend ({stub_generator.step_ms} ms/step)")
+elif GENERATOR_BACKEND != "diffusers":
+    raise ValueError(f"Unknown GENERATOR_BACKEND: {GENERATOR_BACKEND}")
+
+worker_pool = None
+if GENERATOR_BACKEND == "diffusers" and WORKER_PROCESSES > 0:
+    # Each batch runs in an idle worker process; workers share one mapped copy of the weights
+    from worker_pool import WorkerPool
+    worker_pool = WorkerPool(
+        resolve_model(MODEL_ID if not MODEL_PATH else None, MODEL_PATH),
+        WORKER_PROCESSES,
+        cores_per_worker=WORKER_CORES or None,
+        load_concurrency=WORKER_LOAD_CONCURRENCY,
+    )
+    generate_image = worker_pool.generate_image
+    generate_images_batch = worker_pool.generate_images_batch
+
+# Generated images are persisted off the request thread
+writer = BackgroundWriter(OUTPUT_DIR)
+
+# Seeded generations are a pure function of their parameters and the weights
+SERVED_MODEL = resolve_model(MODEL_ID if not MODEL_PATH else None, MODEL_PATH)
+SERVED_MODEL_REVISION = model_revision(SERVED_MODEL)
+if default_cpu_profile.active(get_device_and_dtype()[0]):
+    # bf16 outputs differ slightly from fp32 ones
+    SERVED_MODEL_REVISION = f"{SERVED_MODEL_REVISION}+{default_cpu_profile.tag()}"
+result_cache = ResultCache(
+    os.path.join(OUTPUT_DIR, "cache"),
+    max_memory_bytes=int(RESULT_CACHE_MEMORY_MB * 1024 ** 2),
+    max_disk_bytes=int(RESULT_CACHE_DISK_MB * 1024 ** 2),
+    ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+    writer=writer,
+)
+
+def _parse_generation_params(data):
+    """
+    Read generation parameters from a request body, applying defaults
+    
+    A quality "preset" (draft / standard / final) supplies the scheduler and
+    step count; explicit "scheduler", "steps" and "guidance_scale" win over it.
+    """
+    tier = data.get("preset", DEFAULT_PRESET)
+    preset = quality_preset(tier, lcm=lcm_available(SERVED_MODEL)) if tier else {}
+    scheduler = resolve_scheduler(data.get("scheduler", preset.get("scheduler", DEFAULT_SCHEDULER)))
+    if scheduler == "lcm" and not lcm_available(SERVED_MODEL):
+        raise ValueError("Scheduler 'lcm' needs an LCM-distilled model or LCM_LORA")
+    return {
+        "prompt": data["prompt"],
+        "negative_prompt": data.get("negative_prompt", None),
+        "steps": int(data.get("steps", preset.get("steps", DEFAULT_STEPS))),
+        "guidance_scale": float(data.get("guidance_scale", preset.get("guidance_scale", DEFAULT_GUIDANCE))),
+        "height": int(data.get("height", 512)),
+        "width": int(data.get("width", 512)),
+        "seed": data.get("seed", None),
+        "scheduler": scheduler,
+        "vae_mode": resolve_vae_mode(data.get("vae_mode", DEFAULT_VAE_MODE)),
+        "refine": resolve_refine(data.get("refine")),
+        "num_images": _parse_num_images(data.get("num_images", 1)),
+    }
+
+def _parse_num_images(value):
+    num_images = int(value)
+    if not 1 <= num_images <= MAX_NUM_IMAGES:
+        raise ValueError(f"num_images must be between 1 and {MAX_NUM_IMAGES}")
+    return num_images
+
+def _run_batch(key, requests):
+    """Run requests collected by the micro-batcher as one pipeline call"""
+    _, steps, height, width, scheduler, vae_mode, refine = key
+    now = time.perf_counter()
+    for r in requests:
+        wait = now - r["submitted_at"]
+        QUEUE_WAIT_SECONDS.observe(wait, queue="batch")
+        if r.get("timer") is not None:
+            r["timer"].add("queue_wait", wait)
+    return generate_images_batch(
+        requests,
+        model_id=MODEL_ID if not MODEL_PATH else None,
+        model_path=MODEL_PATH,
+        output_path=None,
+        num_inference_steps=steps,
+        height=height,
+        width=width,
+        scheduler=scheduler,
+        vae_mode=vae_mode,
+        refine=refine,
+    )
+
+# Concurrent identical requests (double clicks, client retries) share one generation
+single_flight = SingleFlight()
+
+batcher = MicroBatcher(
+    _run_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, max_concurrent_batches=max(1, WORKER_PROCESSES)
+) if BATCH_MAX_SIZE > 1 else None
+
+def _generate(params, step_callback=None, timer=None):
+    """
+    Generate one image, batching it with concurrent requests when enabled
+    
+    Args:
+        params: Parsed generation parameters
+        step_callback: Optional callable(step, total_steps, latents) run after
+            each denoising step
+        timer: Optional StageTimer receiving per-stage durations
+    """
+    if batcher is None:
+        return generate_image(
+            prompt=params["prompt"],
+            model_id=MODEL_ID if not MODEL_PATH else None,
+            model_path=MODEL_PATH,
+            output_path=None,
+            num_inference_steps=params["steps"],
+            guidance_scale=params["guidance_scale"],
+            height=params["height"],
+            width=params["width"],
+            seed=params["seed"],
+            negative_prompt=params["negative_prompt"],
+            step_callback=step_callback,
+            scheduler=params["scheduler"],
+            timer=timer,
+            vae_mode=params["vae_mode"],
+            refine=params["refine"],
+        )
+    
+    # Requests with the same model, step count, size, scheduler, decoder and refine settings can share a UNet batch
+    key = (
+        MODEL_PATH or MODEL_ID, params["steps"], params["height"], params["width"], params["scheduler"],
+        params["vae_mode"], params["refine"],
+    )
+    return batcher.submit(key, {
+        "prompt": params["prompt"],
+        "negative_prompt": params["negative_prompt"],
+        "guidance_scale": params["guidance_scale"],
+        "seed": params["seed"],
+        "step_callback": step_callback,
+        "timer": timer,
+        "submitted_at": time.perf_counter(),
+    }).result()
+
+class GeneratedImage:
+    """A generated or cached image, encoded lazily per output format"""
+    
+    def __init__(self, image=None, png=None, cache_key=None):
+        self.image = image
+        self.png = png
+        self.cache_key = cache_key
+    
+    def encode(self, fmt="png", quality=IMAGE_QUALITY):
+        if fmt == "png":
+            if self.png is None:
+                self.png = encode_image(self.image, "png")
+            return self.png
+        if self.image is None:
+            self.image = Image.open(io.BytesIO(self.png))
+            self.image.load()
+        return encode_image(self.image, fmt, quality)
+
+def _coalesced(params, run, callbacks, timer=None):
+    """
+    Call run(callbacks), or wait for an identical request already in flight
+    
+    Args:
+        params: Parsed generation parameters
+        run: Callable taking a list of step callbacks, one per output image
+        callbacks: This request's step callbacks (or None entries)
+        timer: Optional StageTimer; a joining request records the wait
+    """
+    key = flight_key(params, SERVED_MODEL, SERVED_MODEL_REVISION, SINGLE_FLIGHT_UNSEEDED) if SINGLE_FLIGHT else None
+    if key is None:
+        return run(callbacks)
+    start = time.perf_counter()
+    result, leader = single_flight.do(key, run, callbacks)
+    if not leader and timer is not None:
+        timer.add("single_flight_wait", time.perf_counter() - start)
+    return result
+
+def _generate_result(params, step_callback=None, timer=None):
+    """
+    Generate an image, serving seeded requests from the result cache and
+    joining an identical request that is already running
+    """
+    return _coalesced(
+        params, lambda callbacks: _generate_uncoalesced(params, callbacks[0], timer), [step_callback], timer
+    )
+
+def _generate_uncoalesced(params, step_callback=None, timer=None):
+    key = result_key(params, SERVED_MODEL, SERVED_MODEL_REVISION)
+    if key is not None:
+        with timed("result_cache_lookup", [timer]):
+            cached = result_cache.get(key)
+        if cached is not None:
+            return GeneratedImage(png=cached, cache_key=key)
+    
+    result = GeneratedImage(image=_generate(params, step_callback=step_callback, timer=timer), cache_key=key)
+    if key is not None:
+        with timed("encode", [timer]):
+            png = result.encode("png")
+        result_cache.put(key, png)
+    return result
+
+def _generate_results(params, step_callbacks=None, timer=None):
+    """
+    Generate params["num_images"] candidates in one batched pass
+    
+    An identical request that is already running is joined instead (see
+    _coalesced).
+    
+    Candidate i uses seed + i (a random base seed when none is given), so each
+    is cached and reproducible on its own. Candidates already in the result
+    cache are not generated again; the rest share one prompt encoding and as
+    few UNet batches as the memory budget allows. They bypass the
+    micro-batcher, which would only split them up again.
+    
+    Args:
+        params: Parsed generation parameters
+        step_callbacks: Optional list with a callable(step, total_steps,
+            latents) per candidate
+        timer: Optional StageTimer receiving per-stage durations
+    
+    Returns:
+        List of (GeneratedImage, seed) in candidate order
+    """
+    return _coalesced(
+        params,
+        lambda callbacks: _generate_candidates(params, callbacks, timer),
+        step_callbacks or [None] * params["num_images"],
+        timer,
+    )
+
+def _generate_candidates(params, step_callbacks=None, timer=None):
+    seeds = candidate_seeds(params["seed"], params["num_images"])
+    results = [None] * len(seeds)
+    missing = []
+    for index, seed in enumerate(seeds):
+        key = result_key(dict(params, seed=seed), SERVED_MODEL, SERVED_MODEL_REVISION)
+        with timed("result_cache_lookup", [timer]):
+            cached = result_cache.get(key)
+        if cached is not None:
+            results[index] = GeneratedImage(png=cached, cache_key=key)
+        else:
+            missing.append((index, key))
+    
+    if missing:
+        images = generate_images_batch(
+            [{
+                "prompt": params["prompt"],
+                "negative_prompt": params["negative_prompt"],
+                "guidance_scale": params["guidance_scale"],
+                "seed": seeds[index],
+                "step_callback": step_callbacks[index] if step_callbacks else None,
+                # Stages are shared by the batch, so they are timed once
+                "timer": timer if position == 0 else None,
+            } for position, (index, _) in enumerate(missing)],
+            model_id=MODEL_ID if not MODEL_PATH else None,
+            model_path=MODEL_PATH,
+            output_path=None,
+            num_inference_steps=params["steps"],
+            height=params["height"],
+            width=params["width"],
+            scheduler=params["scheduler"],
+            vae_mode=params["vae_mode"],
+            refine=params["refine"],
+        )
+        for image in images:
+            if isinstance(image, BaseException):
+                raise image
+        for (index, key), image in zip(missing, images):
+            results[index] = GeneratedImage(image=image, cache_key=key)
+            with timed("encode", [timer]):
+                png = results[index].encode("png")
+            result_cache.put(key, png)
+    return list(zip(results, seeds))
+
+def _persist(result, data=None, fmt="png", filename=None):
+    """
+    Queue an image for disk and return (image_url, filename)
+    
+    Seeded results are written too: the result cache may not keep them on
+    disk (disabled tier, TTL or size eviction), and the URL must stay valid.
+    """
+    filename = writer.submit(data if data is not None else result.encode(fmt), FORMATS[fmt][1], filename)
+    return f"/generated/{filename}", filename
+
+def _image_response(data, fmt, image_url, filename):
+    """Raw image bytes with the persisted location in headers"""
+    return Response(data, mimetype=FORMATS[fmt][0], headers={
+        "X-Image-Url": image_url,
+        "X-Image-Filename": filename,
+        "Access-Control-Expose-Headers": "X-Image-Url, X-Image-Filename",
+    })
+
+def _multipart_response(parts, fmt):
+    """
+    Several images as one multipart/mixed response
+    
+    Args:
+        parts: List of (image bytes, image_url, filename, seed)
+        fmt: Image format of every part
+    """
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for data, image_url, filename, seed in parts:
+        body.write(f"--{boundary}\r\n".encode("ascii"))
+        body.write(f"Content-Type: {FORMATS[fmt][0]}\r\n".encode("ascii"))
+        body.write(f"Content-Length: {len(data)}\r\n".encode("ascii"))
+        body.write(f"X-Image-Url: {image_url}\r\n".encode("ascii"))
+        body.write(f"X-Image-Filename: {filename}\r\n".encode("ascii"))
+        body.write(f"X-Seed: {seed}\r\n\r\n".encode("ascii"))
+        body.write(data)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode("ascii"))
+    return Response(body.getvalue(), mimetype=f"multipart/mixed; boundary={boundary}")
+
+def _candidates_payload(candidates, timer, with_base64=False):
+    """JSON entries for generated candidates, persisting each as PNG"""
+    import base64
+    images = []
+    for result, seed in candidates:
+        with timed("encode", [timer]):
+            png = result.encode("png")
+        image_url, filename = _persist(result)
+        entry = {"image_url": image_url, "filename": filename, "seed": seed}
+        if with_base64:
+            with timed("base64", [timer]):
+                entry["image_base64"] = base64.b64encode(png).decode("utf-8")
+        images.append(entry)
+    return images
+
+def _candidates_response(candidates, fmt, quality, timer, want_timings):
+    """Raw-image response for several candidates: multipart/mixed, one part each"""
+    parts = []
+    for result, seed in candidates:
+        with timed("encode", [timer]):
+            image_bytes = result.encode(fmt, quality)
+        image_url, filename = _persist(result, image_bytes, fmt)
+        parts.append((image_bytes, image_url, filename, seed))
+    response = _multipart_response(parts, fmt)
+    if want_timings:
+        response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+def _response_format(data):
+    """
+    Negotiate the response format from the Accept header, or "format" and
+    "quality" in the query string or request body
+    
+    Returns:
+        (format name or None for JSON, quality)
+    """
+    quality = request.args.get("quality", data.get("quality"))
+    quality = int(quality) if quality is not None else None
+    fmt = negotiate_format(
+        request.headers.get("Accept", ""),
+        requested=request.args.get("format", data.get("format")),
+        quality=quality,
+    )
+    return fmt, quality if quality is not None else IMAGE_QUALITY
+
+def _run_job(job):
+    """Worker-side body of a /jobs request"""
+    timer = StageTimer()
+    wait = job.started_at - job.created_at
+    QUEUE_WAIT_SECONDS.observe(wait, queue="jobs")
+    timer.add("queue_wait", wait)
+    if job.params["num_images"] > 1:
+        candidates = _generate_results(
+            job.params, step_callbacks=[job.report_progress] * job.params["num_images"], timer=timer
+        )
+        return {"images": _candidates_payload(candidates, timer), "timings": timer.to_dict()}
+    result = _generate_result(job.params, step_callback=job.report_progress, timer=timer)
+    with timed("encode", [timer]):
+        result.encode("png")
+    image_url, filename = _persist(result, filename=f"generated_{job.id}.png")
+    return {"image_url": image_url, "filename": filename, "timings": timer.to_dict()}
+
+job_manager = JobManager(_run_job, JOB_WORKERS, JOB_QUEUE_SIZE, JOB_TTL_SECONDS)
+
+def _preload():
+    """Make the served pipeline resident"""
+    if GENERATOR_BACKEND == "stub":
+        return
+    if worker_pool is not None:
+        worker_pool.start()
+        return
+    device, dtype = get_device_and_dtype()
+    with get_pipeline(SERVED_MODEL, device=device, dtype=dtype):
+        pass
+
+def _warm_up(height, width, steps):
+    """One throwaway generation through the normal request path"""
+    if worker_pool is not None:
+        # Every worker has its own caches and allocator to warm
+        worker_pool.warm_up(height, width, steps)
+        return
+    _generate(_parse_generation_params({
+        "prompt": "warm-up",
+        "height": height,
+        "width": width,
+        "steps": steps,
+    }))
+
+# Load and warm up in the background; /ready reports progress
+readiness = Readiness()
+if PRELOAD_MODEL:
+    readiness.start(_preload, _warm_up, parse_resolutions(WARMUP_RESOLUTIONS), WARMUP_STEPS)
+else:
+    readiness.mark_ready()
+
+class StreamClosed(Exception):
+    """Raised from the step callback once the streaming client has gone away"""
+
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def _stream_events(params, preview_every, timer=None):
+    """
+    Server-Sent Events for one generation: progress and preview events while
+    denoising, then a result (or error) event
+    
+    Generation runs on a separate thread. If the client disconnects, the next
+    denoising step raises StreamClosed so the pipeline is released early.
+    """
+    events = queue.Queue()
+    closed = threading.Event()
+    sdxl = is_sdxl_model(MODEL_PATH or MODEL_ID)
+    
+    def on_step(step, total_steps, latents, index=None):
+        if closed.is_set():
+            raise StreamClosed()
+        # Several candidates step together; "index" tells their events apart
+        tag = {} if index is None else {"index": index}
+        events.put(_sse("progress", {"step": step, "total_steps": total_steps, **tag}))
+        if preview_every and latents is not None and (step % preview_every == 0) and step < total_steps:
+            preview = latents_to_preview(latents, sdxl=sdxl, max_size=PREVIEW_MAX_SIZE, decoder=PREVIEW_DECODER)
+            events.put(_sse("preview", {
+                "step": step,
+                "total_steps": total_steps,
+                "image_base64": preview_base64(preview),
+                "format": "jpeg",
+                **tag,
+            }))
+    
+    def run():
+        try:
+            if params["num_images"] > 1:
+                step_callbacks = [functools.partial(on_step, index=index) for index in range(params["num_images"])]
+                candidates = _generate_results(params, step_callbacks=step_callbacks, timer=timer)
+                payload = {
+                    "success": True,
+                    "images": _candidates_payload(candidates, timer, with_base64=True),
+                    "prompt": params["prompt"],
+                }
+                if timer is not None:
+                    payload["timings"] = timer.to_dict()
+                events.put(_sse("result", payload))
+                return
+            result = _generate_result(params, step_callback=on_step, timer=timer)
+            with timed("encode", [timer]):
+                png = result.encode("png")
+            image_url, filename = _persist(result)
+            import base64
+            with timed("base64", [timer]):
+                image_base64 = base64.b64encode(png).decode("utf-8")
+            payload = {
+                "success": True,
+                "image_base64": image_base64,
+                "image_url": image_url,
+                "prompt": params["prompt"],
+            }
+            if timer is not None:
+                payload["timings"] = timer.to_dict()
+            events.put(_sse("result", payload))
+        except StreamClosed:
+            pass
+        except Exception as e:
+            events.put(_sse("error", {"success": False, "error": str(e)}))
+        finally:
+            events.put(None)
+    
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            yield event
+    finally:
+        # Runs on normal completion and when the client disconnects
+        closed.set()
+
+def instrumented(endpoint):
+    """Count requests, in-flight requests and response latency for a view"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            IN_FLIGHT.inc(endpoint=endpoint)
+            start = time.perf_counter()
+            status = 500
+            try:
+                response = app.make_response(view(*args, **kwargs))
+                status = response.status_code
+                return response
+            finally:
+                IN_FLIGHT.dec(endpoint=endpoint)
+                REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+                REQUESTS.inc(endpoint=endpoint, status=status)
+        return wrapper
+    return decorator
+
+def _wants_timings(data):
+    """Whether the caller asked for a per-request timing breakdown"""
+    value = request.args.get("timings", data.get("timings", False))
+    return str(value).lower() in ("1", "true", "yes")
 
 @app.route("/health", methods=["GET"])
 def health():
-    """Health check endpoint"""
+    """Health check endpoint (liveness; use /ready for traffic)"""
     return jsonify({"status": "healthy"})
 
+@app.route("/ready", methods=["GET"])
+def ready():
+    """
+    Readiness: 200 once the model is loaded and warmed up, 503 while
+    loading, warming or after a failed load or warm-up
+    """
+    state = readiness.to_dict()
+    state["model"] = SERVED_MODEL
+    state["preload"] = PRELOAD_MODEL
+    return jsonify(state), 200 if state["status"] == "ready" else 503
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus metrics: per-stage and per-step latency, queue wait, in-flight requests"""
+    QUEUE_DEPTH.set(job_manager.stats()["queued"], queue="jobs")
+    QUEUE_DEPTH.set(batcher.stats()["queued"] if batcher is not None else 0, queue="batch")
+    return Response(default_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/pipelines", methods=["GET"])
+def pipelines():
+    """Resident pipelines, cache hit/miss counts and cold-vs-warm load times"""
+    return jsonify(default_registry.stats())
+
+@app.route("/cache", methods=["GET"])
+def cache_stats():
+    """Result cache hit rate and tier sizes"""
+    return jsonify({**result_cache.stats(), "writer": writer.stats()})
+
+@app.route("/cache/prompts", methods=["GET"])
+def prompt_cache_stats():
+    """Text-encoder cache hit rate and estimated text-encoder time saved"""
+    return jsonify(default_prompt_cache.stats())
+
+@app.route("/batching", methods=["GET"])
+def batching_stats():
+    """Micro-batching counters (batches run, average batch size, queued requests)"""
+    if batcher is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **batcher.stats()})
+
+@app.route("/single-flight", methods=["GET"])
+def single_flight_stats():
+    """In-flight generations and how many requests (and images) joined one instead of generating"""
+    return jsonify({"enabled": SINGLE_FLIGHT, "unseeded": SINGLE_FLIGHT_UNSEEDED, **single_flight.stats()})
+
+@app.route("/workers", methods=["GET"])
+def workers_stats():
+    """Worker processes: CPU sets, tasks run, busy time and RSS/PSS memory"""
+    if worker_pool is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **worker_pool.stats()})
+
+@app.route("/schedulers", methods=["GET"])
+def schedulers():
+    """Available samplers and the quality presets that map to them"""
+    lcm = lcm_available(SERVED_MODEL)
+    return jsonify({
+        "default": DEFAULT_SCHEDULER,
+        "schedulers": ["default"] + [name for name in SCHEDULERS if name != "lcm" or lcm],
+        "presets": {quality: quality_preset(quality, lcm=lcm) for quality in QUALITY_PRESETS},
+        "lcm_available": lcm,
+    })
+
+@app.route("/jobs", methods=["POST"])
+@instrumented("jobs")
+def create_job():
+    """
+    Queue a generation and return immediately
+    
+    Request body: Same as /generate
+    
+    Returns (202):
+    {
+        "success": true,
+        "job_id": "...",
+        "status_url": "/jobs/{job_id}",
+        "status": "queued"
+    }
+    """
+    data = request.get_json()
+    if not data or "prompt" not in data:
+        return jsonify({"success": False, "error": "Missing 'prompt' in request body"}), 400
+    
+    try:
+        job = job_manager.submit(_parse_generation_params(data))
+    except QueueFullError as e:
+        return jsonify({"success": False, "error": str(e)}), 429
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    return jsonify({
+        "success": True,
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}",
+        "status": job.status,
+    }), 202
+
+@app.route("/jobs", methods=["GET"])
+def job_stats():
+    """Queue depth, worker count and jobs per status"""
+    return jsonify(job_manager.stats())
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Job status, progress (0-1) and, once succeeded, the image URL"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    return jsonify({"success": True, **job.to_dict()})
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    return jsonify({"success": True, **job.to_dict()})
+
 @app.route("/generate", methods=["POST"])
+@instrumented("generate")
 def generate():
     """
     Generate image from text prompt
@@ -36,14 +721,29 @@ def generate():
         "guidance_scale": 7.5 (optional),
         "height": 512 (optional),
         "width": 512 (optional),
-        "seed": null (optional)
+        "seed": null (optional),
+        "negative_prompt": null (optional),
+        "scheduler": "dpmpp-karras" (optional, see /schedulers),
+        "preset": "draft" (optional: draft, standard or final),
+        "num_images": 1 (optional, candidates with seeds seed, seed + 1, ...)
     }
     
-    Returns:
+    With "Accept: image/png", "image/webp" or "image/jpeg" (or a "format"
+    query/body field) the raw image bytes are returned, with the persisted
+    location in the X-Image-Url header. Otherwise returns:
     {
         "success": true,
         "image_url": "/generated/{filename}",
-        "filename": "generated_{timestamp}.png"
+        "filename": "generated_{id}.png"
+    }
+    
+    With "num_images" above 1 the candidates come back together: as a
+    multipart/mixed response (one part per image, with X-Image-Url,
+    X-Image-Filename and X-Seed part headers) for an image Accept type, or as
+    {
+        "success": true,
+        "images": [{"image_url": "...", "filename": "...", "seed": 42}, ...],
+        "prompt": "user prompt"
     }
     """
     try:
@@ -52,37 +752,48 @@ def generate():
         if not data or "prompt" not in data:
             return jsonify({"success": False, "error": "Missing 'prompt' in request body"}), 400
         
-        prompt = data["prompt"]
-        steps = data.get("steps", DEFAULT_STEPS)
-        guidance_scale = data.get("guidance_scale", DEFAULT_GUIDANCE)
-        height = data.get("height", 512)
-        width = data.get("width", 512)
-        seed = data.get("seed", None)
+        params = _parse_generation_params(data)
+        prompt = params["prompt"]
+        fmt, quality = _response_format(data)
+        want_timings = _wants_timings(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    try:
+        timer = StageTimer()
+        if params["num_images"] > 1:
+            candidates = _generate_results(params, timer=timer)
+            if fmt is not None:
+                return _candidates_response(candidates, fmt, quality, timer, want_timings)
+            payload = {"success": True, "images": _candidates_payload(candidates, timer), "prompt": prompt}
+            if want_timings:
+                payload["timings"] = timer.to_dict()
+            return jsonify(payload)
         
-        # Generate image using inference_hf_model
-        image = generate_image(
-            prompt=prompt,
-            model_id=MODEL_ID if not MODEL_PATH else None,
-            model_path=MODEL_PATH,
-            output_path=OUTPUT_DIR,
-            num_inference_steps=steps,
-            guidance_scale=guidance_scale,
-            height=height,
-            width=width,
-            seed=seed,
-        )
+        # Seeded requests are served from (and stored in) the result cache
+        result = _generate_result(params, timer=timer)
         
-        # Get the filename from the generated image
-        import time
-        timestamp = int(time.time())
-        filename = f"generated_{timestamp}.png"
+        if fmt is not None:
+            with timed("encode", [timer]):
+                image_bytes = result.encode(fmt, quality)
+            image_url, filename = _persist(result, image_bytes, fmt)
+            response = _image_response(image_bytes, fmt, image_url, filename)
+            if want_timings:
+                response.headers["Server-Timing"] = timer.server_timing()
+            return response
         
-        return jsonify({
+        with timed("encode", [timer]):
+            result.encode("png")
+        image_url, filename = _persist(result)
+        payload = {
             "success": True,
-            "image_url": f"/generated/{filename}",
+            "image_url": image_url,
             "filename": filename,
             "prompt": prompt
-        })
+        }
+        if want_timings:
+            payload["timings"] = timer.to_dict()
+        return jsonify(payload)
     
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -91,28 +802,54 @@ def generate():
 def get_image(filename):
     """Serve generated images"""
     try:
+        filename = os.path.basename(filename)
+        mimetype = _mimetype_for(filename)
+        
+        # Images still queued for the background writer are served from memory
+        pending = writer.get_pending(filename)
+        if pending is not None:
+            return Response(pending, mimetype=mimetype)
+        
         filepath = os.path.join(OUTPUT_DIR, filename)
         if not os.path.exists(filepath):
             return jsonify({"error": "Image not found"}), 404
         
-        return send_file(filepath, mimetype="image/png")
+        return send_file(filepath, mimetype=mimetype)
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _mimetype_for(filename):
+    extension = os.path.splitext(filename)[1].lstrip(".").lower()
+    for mimetype, format_extension in FORMATS.values():
+        if format_extension == extension:
+            return mimetype
+    return "image/png"
+
 @app.route("/generate/stream", methods=["POST"])
+@instrumented("generate_stream")
 def generate_stream():
     """
     Generate image and return as base64 encoded string
     
-    Request body: Same as /generate
+    Request body: Same as /generate, plus "preview_every" (optional, steps
+    between previews when streaming)
     
-    Returns:
+    With "Accept: text/event-stream" the response is a Server-Sent Events
+    stream of "progress" and "preview" events (low-resolution JPEG previews
+    projected from the latents) followed by a "result" event with the same
+    payload as below. With an image Accept type (or "format") the raw image
+    bytes are returned as for /generate. Otherwise returns:
     {
         "success": true,
         "image_base64": "base64_encoded_string",
+        "image_url": "/generated/{filename}",
         "prompt": "user prompt"
     }
+    
+    With "num_images" above 1 the payload has an "images" list of
+    {"image_base64", "image_url", "filename", "seed"} instead, and streamed
+    progress and preview events carry the candidate's "index".
     """
     try:
         data = request.get_json()
@@ -120,37 +857,65 @@ def generate_stream():
         if not data or "prompt" not in data:
             return jsonify({"success": False, "error": "Missing 'prompt' in request body"}), 400
         
-        prompt = data["prompt"]
-        steps = data.get("steps", DEFAULT_STEPS)
-        guidance_scale = data.get("guidance_scale", DEFAULT_GUIDANCE)
-        height = data.get("height", 512)
-        width = data.get("width", 512)
-        seed = data.get("seed", None)
+        params = _parse_generation_params(data)
+        prompt = params["prompt"]
+        fmt, quality = _response_format(data)
+        want_timings = _wants_timings(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    try:
+        timer = StageTimer()
+        if "text/event-stream" in request.headers.get("Accept", ""):
+            preview_every = int(data.get("preview_every", PREVIEW_EVERY_N_STEPS))
+            return Response(
+                _stream_events(params, preview_every, timer if want_timings else None),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
         
-        # Generate image using inference_hf_model
-        image = generate_image(
-            prompt=prompt,
-            model_id=MODEL_ID if not MODEL_PATH else None,
-            model_path=MODEL_PATH,
-            output_path=OUTPUT_DIR,
-            num_inference_steps=steps,
-            guidance_scale=guidance_scale,
-            height=height,
-            width=width,
-            seed=seed,
-        )
+        if params["num_images"] > 1:
+            candidates = _generate_results(params, timer=timer)
+            if fmt is not None:
+                return _candidates_response(candidates, fmt, quality, timer, want_timings)
+            payload = {
+                "success": True,
+                "images": _candidates_payload(candidates, timer, with_base64=True),
+                "prompt": prompt,
+            }
+            if want_timings:
+                payload["timings"] = timer.to_dict()
+            return jsonify(payload)
+        
+        # Generate image using inference_hf_model (or the result cache)
+        result = _generate_result(params, timer=timer)
+        
+        if fmt is not None:
+            with timed("encode", [timer]):
+                image_bytes = result.encode(fmt, quality)
+            image_url, filename = _persist(result, image_bytes, fmt)
+            response = _image_response(image_bytes, fmt, image_url, filename)
+            if want_timings:
+                response.headers["Server-Timing"] = timer.server_timing()
+            return response
         
         # Convert to base64
         import base64
-        buffer = io.BytesIO()
-        image.save(buffer, format="PNG")
-        image_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+        with timed("encode", [timer]):
+            png = result.encode("png")
+        with timed("base64", [timer]):
+            image_base64 = base64.b64encode(png).decode("utf-8")
+        image_url, _ = _persist(result)
         
-        return jsonify({
+        payload = {
             "success": True,
             "image_base64": image_base64,
+            "image_url": image_url,
             "prompt": prompt
-        })
+        }
+        if want_timings:
+            payload["timings"] = timer.to_dict()
+        return jsonify(payload)
     
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
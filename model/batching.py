@@ -0,0 +1,181 @@
+"""
+Dynamic micro-batching for concurrent generation requests
+Requests that arrive within a short window and share a batch key (model, size,
+steps, scheduler) are run as one batched pipeline call
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class BatchItem:
+    """One caller's request waiting in the batcher"""
+
+    def __init__(self, key, params):
+        self.key = key
+        self.params = params
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Collects requests per batch key and runs them together
+
+    A single dispatcher thread waits until either max_batch_size requests with
+    the same key are queued or the oldest one has waited max_wait_ms, then
+    calls run_batch(key, [params, ...]) and hands each result back to its caller.
+    With max_concurrent_batches > 1 (one per worker process), up to that many
+    batches run at once; the next batch is only formed once a slot is free, so
+    requests keep accumulating while every worker is busy.
+    """
+
+    def __init__(self, run_batch, max_batch_size=4, max_wait_ms=50, max_concurrent_batches=1):
+        """
+        Args:
+            run_batch: Callable(key, list of params) returning a list of results
+                in the same order; an exception instance in the list is raised
+                to that caller only
+            max_batch_size: Largest number of requests run in one call
+            max_wait_ms: Longest time the oldest request waits for company
+            max_concurrent_batches: Batches allowed to run at the same time
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self.batches = 0
+        self.requests = 0
+        self.max_batch_seen = 0
+        self.max_concurrent_batches = max(1, int(max_concurrent_batches))
+        self._slots = threading.Semaphore(self.max_concurrent_batches)
+        self._thread = threading.Thread(target=self._dispatch_loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, params):
+        """
+        Queue a request and return a Future for its result
+
+        Args:
+            key: Hashable batch key; only requests with equal keys are batched
+            params: Per-request parameters passed through to run_batch
+        """
+        item = BatchItem(key, params)
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Batcher is stopped")
+            self._pending.setdefault(key, []).append(item)
+            self._cond.notify()
+        return item.future
+
+    def stop(self, drain=True, timeout=None):
+        """
+        Stop the dispatcher without leaving any caller waiting
+
+        Args:
+            drain: Run the requests already queued before stopping; False
+                fails them at once
+            timeout: Longest wait for the dispatcher to drain (None = no
+                limit); requests still queued after it are failed
+        """
+        with self._cond:
+            self._stopped = True
+            if not drain:
+                self._fail_pending()
+            self._cond.notify()
+        self._thread.join(timeout)
+        with self._cond:
+            self._fail_pending()
+
+    def _fail_pending(self):
+        # Caller holds self._cond
+        for items in self._pending.values():
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(RuntimeError("Batcher is stopped"))
+        self._pending.clear()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "max_batch_size_seen": self.max_batch_seen,
+                "queued": sum(len(items) for items in self._pending.values()),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "max_concurrent_batches": self.max_concurrent_batches,
+            }
+
+    def _next_batch(self):
+        # Block until a batch is ready; returns (key, items) or None when stopped
+        with self._cond:
+            while True:
+                if self._stopped and not self._pending:
+                    return None
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+
+                # Serve the key whose oldest request has waited longest
+                key, items = min(self._pending.items(), key=lambda kv: kv[1][0].enqueued_at)
+                deadline = items[0].enqueued_at + self.max_wait
+                remaining = deadline - time.perf_counter()
+                if len(items) < self.max_batch_size and remaining > 0 and not self._stopped:
+                    self._cond.wait(remaining)
+                    continue
+
+                batch = items[:self.max_batch_size]
+                if len(items) > len(batch):
+                    self._pending[key] = items[len(batch):]
+                else:
+                    del self._pending[key]
+                return key, batch
+
+    def _dispatch_loop(self):
+        try:
+            while True:
+                self._slots.acquire()
+                next_batch = self._next_batch()
+                if next_batch is None:
+                    return
+                key, batch = next_batch
+                with self._cond:
+                    self.batches += 1
+                    self.requests += len(batch)
+                    self.max_batch_seen = max(self.max_batch_seen, len(batch))
+
+                if self.max_concurrent_batches == 1:
+                    self._run(key, batch)
+                else:
+                    threading.Thread(target=self._run, args=(key, batch), name="micro-batch", daemon=True).start()
+        finally:
+            # However the dispatcher exits, nothing queued is left unanswered
+            with self._cond:
+                self._stopped = True
+                self._fail_pending()
+
+    def _run(self, key, batch):
+        try:
+            live = [item for item in batch if item.future.set_running_or_notify_cancel()]
+            if not live:
+                return
+            try:
+                results = self.run_batch(key, [item.params for item in live])
+            except BaseException as e:
+                for item in live:
+                    item.future.set_exception(e)
+                if not isinstance(e, Exception):
+                    raise
+                return
+            for item, result in zip(live, results):
+                if isinstance(result, BaseException):
+                    item.future.set_exception(result)
+                else:
+                    item.future.set_result(result)
+        finally:
+            self._slots.release()
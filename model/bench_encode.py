@@ -0,0 +1,103 @@
+"""
+Benchmark response encodings: size and encode time per format at 512 and 768 px
+Compares the old PNG + base64 JSON payload with raw PNG / WebP / JPEG bytes
+"""
+import argparse
+import base64
+import json
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from image_io import encode_image
+import image_io
+
+# (label, format, quality, png compress level)
+CASES = [
+    ("png (level 6)", "png", None, 6),
+    ("png (level 1)", "png", None, 1),
+    ("webp lossless", "webp-lossless", 90, None),
+    ("webp q90", "webp", 90, None),
+    ("webp q75", "webp", 75, None),
+    ("jpeg q90", "jpeg", 90, None),
+    ("jpeg q75", "jpeg", 75, None),
+]
+
+
+def synthetic_image(size, seed=0):
+    """
+    A stand-in for a generated texture: smooth colour fields plus fine detail
+
+    Pure noise compresses unrealistically badly and flat colour unrealistically
+    well, so mix low-frequency waves with a little grain.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    channels = []
+    for _ in range(3):
+        field = np.zeros((size, size))
+        for _ in range(6):
+            fx, fy, phase = rng.uniform(1, 12), rng.uniform(1, 12), rng.uniform(0, 2 * np.pi)
+            field += np.sin(2 * np.pi * (fx * x + fy * y) + phase)
+        channels.append(field)
+    image = np.stack(channels, axis=-1)
+    image = (image - image.min()) / (image.max() - image.min())
+    image = image * 220 + rng.normal(0, 6, image.shape)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+
+
+def benchmark(image, repeats=5):
+    """
+    Encode an image in every format
+
+    Returns:
+        List of dicts with format, bytes, base64 bytes and median encode time
+    """
+    results = []
+    for label, fmt, quality, compress_level in CASES:
+        if compress_level is not None:
+            image_io.PNG_COMPRESS_LEVEL = compress_level
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            data = encode_image(image, fmt, quality or 90)
+            timings.append(time.perf_counter() - start)
+        results.append({
+            "format": label,
+            "bytes": len(data),
+            "base64_bytes": len(base64.b64encode(data)),
+            "encode_ms": round(statistics.median(timings) * 1000, 2),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark image encodings for API responses")
+    parser.add_argument("--image", type=str, default=None,
+                        help="Generated image to benchmark (default: synthetic texture)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 768])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", type=str, default=None, help="Write results to this JSON file")
+
+    args = parser.parse_args()
+
+    report = {}
+    for size in args.sizes:
+        if args.image:
+            image = Image.open(args.image).convert("RGB").resize((size, size), Image.LANCZOS)
+        else:
+            image = synthetic_image(size)
+        results = benchmark(image, args.repeats)
+        report[str(size)] = results
+
+        print(f"\n{size}x{size}")
+        print(f"  {'format':16s} {'bytes':>10s} {'as base64':>10s} {'encode ms':>10s}")
+        for row in results:
+            print(f"  {row['format']:16s} {row['bytes']:10d} {row['base64_bytes']:10d} {row['encode_ms']:10.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.json}")
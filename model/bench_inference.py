@@ -0,0 +1,279 @@
+"""
+Offline inference benchmark suite
+Runs on a tiny randomly initialised pipeline (no downloads, CPU-only is fine)
+and measures latency and throughput across step counts, resolutions, batch
+sizes, schedulers and memory options, draft-then-refine against single-pass
+generation, plus generate.py and the API end to end.
+
+Usage:
+    python bench_inference.py --output baseline.json
+    python bench_inference.py --output current.json --compare baseline.json --threshold 0.15
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from itertools import product
+
+import torch
+
+from tiny_pipeline import save_tiny_pipeline
+
+
+def _summarize(latencies, images_per_run):
+    latencies = sorted(latencies)
+    median = statistics.median(latencies)
+    return {
+        "median_s": round(median, 4),
+        "min_s": round(latencies[0], 4),
+        "max_s": round(latencies[-1], 4),
+        "images_per_s": round(images_per_run / median, 3) if median else None,
+    }
+
+
+def _measure(run, repeats, warmup=1):
+    for _ in range(warmup):
+        run()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_pipeline(model_path, steps_list, sizes, batch_sizes, schedulers, slicing_options, repeats):
+    """
+    Matrix over the serving code path (registry, scheduler swap, batched run)
+
+    Returns:
+        List of result dicts
+    """
+    from inference_hf_model import _run_batch, get_pipeline
+    from schedulers import use_scheduler
+
+    device, dtype = "cpu", torch.float32
+    results = []
+    for steps, size, batch_size, scheduler, slicing in product(
+        steps_list, sizes, batch_sizes, schedulers, slicing_options
+    ):
+        requests = [
+            {"prompt": f"a red cotton shirt, variant {i}", "guidance_scale": 7.5, "seed": i}
+            for i in range(batch_size)
+        ]
+
+        def run():
+            with get_pipeline(model_path, device, dtype, attention_slicing=slicing) as pipe, \
+                    use_scheduler(pipe, scheduler):
+                _run_batch(pipe, requests, device, steps, size, size)
+
+        name = f"pipeline/steps={steps}/size={size}/batch={batch_size}/scheduler={scheduler}/slicing={slicing}"
+        result = {
+            "name": name,
+            "suite": "pipeline",
+            "steps": steps,
+            "size": size,
+            "batch_size": batch_size,
+            "scheduler": scheduler,
+            "attention_slicing": slicing,
+            **_summarize(_measure(run, repeats), batch_size),
+        }
+        result["ms_per_step"] = round(result["median_s"] / steps * 1000, 2)
+        results.append(result)
+        print(f"{name}: {result['median_s']}s, {result['images_per_s']} img/s")
+    return results
+
+
+def bench_refine(model_path, steps, size, base_size, strengths, repeats):
+    """
+    Single-pass generation against draft-then-refine at the same output size
+
+    Returns:
+        List of result dicts
+    """
+    from inference_hf_model import generate_image
+    from refine import refine_steps, resolve_refine
+
+    results = []
+    for strength in [None] + list(strengths):
+        settings = resolve_refine({"base_size": base_size, "strength": strength}) if strength else None
+
+        def run():
+            generate_image("a red cotton shirt", model_path=model_path, output_path=None,
+                           num_inference_steps=steps, height=size, width=size, seed=0, refine=settings)
+
+        mode = f"refine-{base_size}-{strength}" if settings else "single"
+        name = f"refine/steps={steps}/size={size}/mode={mode}"
+        result = {"name": name, "suite": "refine", "steps": steps, "size": size, "mode": mode,
+                  **_summarize(_measure(run, repeats), 1)}
+        if settings:
+            result["refine_steps"] = refine_steps(settings, steps)
+            result["speedup_vs_single"] = round(results[0]["median_s"] / result["median_s"], 3)
+        results.append(result)
+        print(f"{name}: {result['median_s']}s")
+    return results
+
+
+def bench_generate_script(model_path, steps, size, repeats):
+    """generate.py's generate_image, including its PNG save"""
+    import generate
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        def run():
+            generate.generate_image(
+                "a red cotton shirt",
+                model_path=model_path,
+                output_path=output_dir,
+                num_inference_steps=steps,
+                height=size,
+                width=size,
+                seed=0,
+            )
+
+        name = f"generate_py/steps={steps}/size={size}"
+        result = {"name": name, "suite": "generate_py", "steps": steps, "size": size,
+                  **_summarize(_measure(run, repeats), 1)}
+    print(f"{name}: {result['median_s']}s")
+    return [result]
+
+
+def bench_api(model_path, steps, size, repeats):
+    """POST /generate through the Flask app (no network, test client)"""
+    output_dir = tempfile.mkdtemp(prefix="bench-api-")
+    os.environ.update({
+        "MODEL_PATH": model_path,
+        "OUTPUT_DIR": output_dir,
+        "PRELOAD_MODEL": "False",
+        "BATCH_MAX_SIZE": "1",
+        "RESULT_CACHE_MEMORY_MB": "0",
+        "RESULT_CACHE_DISK_MB": "0",
+    })
+    import api
+
+    client = api.app.test_client()
+    results = []
+    for fmt in ("json", "png", "webp"):
+        headers = {} if fmt == "json" else {"Accept": f"image/{fmt}"}
+        body = {"prompt": "a red cotton shirt", "steps": steps, "height": size, "width": size, "seed": 0}
+
+        def run():
+            response = client.post("/generate", json=body, headers=headers)
+            if response.status_code != 200:
+                raise RuntimeError(f"/generate returned {response.status_code}: {response.data[:200]}")
+
+        name = f"api/generate/steps={steps}/size={size}/format={fmt}"
+        result = {"name": name, "suite": "api", "steps": steps, "size": size, "format": fmt,
+                  **_summarize(_measure(run, repeats), 1)}
+        results.append(result)
+        print(f"{name}: {result['median_s']}s")
+    api.writer.flush()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare median latencies against a baseline run
+
+    Returns:
+        List of (name, baseline seconds, current seconds, relative change)
+        for cases slower than the baseline by more than threshold
+    """
+    previous = {row["name"]: row for row in baseline["results"]}
+    regressions = []
+    print(f"\n{'case':80s} {'baseline':>9s} {'current':>9s} {'change':>8s}")
+    for row in results:
+        old = previous.get(row["name"])
+        if old is None:
+            continue
+        change = (row["median_s"] - old["median_s"]) / old["median_s"]
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{row['name']:80s} {old['median_s']:9.4f} {row['median_s']:9.4f} {change:+7.1%}{flag}")
+        if change > threshold:
+            regressions.append((row["name"], old["median_s"], row["median_s"], change))
+    return regressions
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline inference benchmarks on a tiny local pipeline")
+    parser.add_argument("--model-size", type=str, default="tiny", choices=["tiny", "small"],
+                        help="Size of the randomly initialised pipeline")
+    parser.add_argument("--suites", type=str, nargs="+", default=["pipeline", "refine", "generate_py", "api"],
+                        choices=["pipeline", "refine", "generate_py", "api"])
+    parser.add_argument("--steps", type=int, nargs="+", default=[4, 10])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--schedulers", type=str, nargs="+", default=["default", "dpmpp", "euler-a"])
+    parser.add_argument("--attention-slicing", type=str, nargs="+", default=["on", "off"], choices=["on", "off"])
+    parser.add_argument("--refine-strengths", type=float, nargs="+", default=[0.3, 0.5],
+                        help="Refine strengths compared with single-pass at the largest size, drafted at the smallest")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--output", type=str, default="bench_results.json", help="Where to write results")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown that counts as a regression (0.10 = 10%%)")
+
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    results = []
+    with tempfile.TemporaryDirectory() as model_dir:
+        print(f"Building {args.model_size} pipeline in {model_dir}...")
+        model_path = save_tiny_pipeline(model_dir, args.model_size)
+
+        if "pipeline" in args.suites:
+            results += bench_pipeline(
+                model_path,
+                args.steps,
+                args.sizes,
+                args.batch_sizes,
+                args.schedulers,
+                [option == "on" for option in args.attention_slicing],
+                args.repeats,
+            )
+        if "refine" in args.suites and max(args.sizes) > min(args.sizes):
+            results += bench_refine(
+                model_path, max(args.steps), max(args.sizes), min(args.sizes), args.refine_strengths, args.repeats
+            )
+        if "generate_py" in args.suites:
+            results += bench_generate_script(model_path, args.steps[0], args.sizes[0], args.repeats)
+        if "api" in args.suites:
+            results += bench_api(model_path, args.steps[0], args.sizes[0], args.repeats)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "model_size": args.model_size,
+        "environment": environment(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("environment", {}).get("cpu_count") != report["environment"]["cpu_count"]:
+            print("Warning: baseline was recorded on a machine with a different CPU count")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print(f"\n✅ No regressions beyond {args.threshold:.0%}")
@@ -0,0 +1,122 @@
+"""
+Benchmark the preprocess_dataset input pipeline: serial vs pooled decode/resize
+Reports images/sec for preparing batches alone and for preparing plus VAE
+encoding, where the pool works on the next batches while the VAE runs.
+
+Uses a synthetic dataset of JPEG-encoded images decoded on access (as a
+Hugging Face image column is) and, with no model given, a randomly initialised
+SD-shaped VAE.
+
+Usage:
+    python bench_preprocess.py --workers 0 2 4 --images 64
+    python bench_preprocess.py --model_path ./models/clothes-diffusion --resolution 512 --json preprocess.json
+"""
+import argparse
+import io
+import json
+import time
+
+import torch
+from diffusers import AutoencoderKL
+from PIL import Image
+
+from bench_encode import synthetic_image
+from bench_vae import SD_VAE_CONFIG
+from preprocess_dataset import prefetch_batches, to_model_input
+
+
+class JpegDataset:
+    """Items with a JPEG decoded on every access and a caption"""
+
+    def __init__(self, num_images, width, height, distinct=8):
+        self.num_images = num_images
+        self.images = []
+        for seed in range(distinct):
+            buffer = io.BytesIO()
+            synthetic_image(max(width, height), seed).resize((width, height)).save(
+                buffer, format="JPEG", quality=90
+            )
+            self.images.append(buffer.getvalue())
+
+    def __len__(self):
+        return self.num_images
+
+    def __getitem__(self, idx):
+        image = Image.open(io.BytesIO(self.images[idx % len(self.images)]))
+        return {"image": image, "text": f"synthetic garment {idx}"}
+
+
+def run(dataset, resolution, batch_size, workers, prefetch, pool, vae=None):
+    """
+    One pass over the dataset
+
+    Returns:
+        Images per second
+    """
+    batches = [range(i, min(i + batch_size, len(dataset))) for i in range(0, len(dataset), batch_size)]
+    start = time.perf_counter()
+    with torch.no_grad():
+        for images, _ in prefetch_batches(dataset, batches, resolution, workers, prefetch, pool):
+            pixels = to_model_input(images)
+            if vae is not None:
+                vae.encode(pixels).latent_dist.sample()
+    return len(dataset) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark serial and pooled preprocessing")
+    parser.add_argument("--model_id", type=str, default=None, help="Hugging Face model ID to take the VAE from")
+    parser.add_argument("--model_path", type=str, default=None, help="Local pipeline folder to take the VAE from")
+    parser.add_argument("--no-vae", dest="no_vae", action="store_true", help="Only time decode/resize")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--source-size", dest="source_size", type=int, nargs=2, default=[768, 1024],
+                        metavar=("WIDTH", "HEIGHT"), help="Size of the stored JPEGs")
+    parser.add_argument("--resolution", type=int, default=512)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4], help="Pool sizes (0 = serial)")
+    parser.add_argument("--prefetch", type=int, default=None)
+    parser.add_argument("--pool", type=str, nargs="+", default=["thread"], choices=["thread", "process"])
+    parser.add_argument("--json", type=str, default=None, help="Write results to this JSON file")
+
+    args = parser.parse_args()
+
+    dataset = JpegDataset(args.images, *args.source_size)
+    vae = None
+    if not args.no_vae:
+        torch.manual_seed(0)
+        model_to_load = args.model_path or args.model_id
+        vae = AutoencoderKL.from_pretrained(model_to_load, subfolder="vae") if model_to_load else AutoencoderKL(**SD_VAE_CONFIG)
+        vae.eval()
+
+    print(f"{args.images} JPEGs of {args.source_size[0]}x{args.source_size[1]} -> {args.resolution}px, "
+          f"batches of {args.batch_size}, {torch.get_num_threads()} torch threads")
+    stages = [("prepare", None)] + ([("prepare + encode", vae)] if vae is not None else [])
+    results = []
+    for stage, stage_vae in stages:
+        # Warm-up (first-touch allocations, VAE kernels)
+        run(JpegDataset(args.batch_size, *args.source_size), args.resolution, args.batch_size, 0, None, "thread", stage_vae)
+        serial = None
+        for pool in args.pool:
+            for workers in args.workers:
+                if workers == 0 and serial is not None:
+                    continue
+                rate = run(dataset, args.resolution, args.batch_size, workers, args.prefetch, pool, stage_vae)
+                if workers == 0:
+                    serial = rate
+                results.append({
+                    "stage": stage,
+                    "pool": pool if workers else "serial",
+                    "workers": workers,
+                    "images_per_second": round(rate, 2),
+                    "speedup": round(rate / serial, 2) if serial else None,
+                })
+
+    print(f"\n  {'stage':17s} {'pool':7s} {'workers':>7s} {'images/s':>9s} {'speedup':>8s}")
+    for row in results:
+        speedup = f"{row['speedup']:7.2f}x" if row["speedup"] is not None else f"{'':8s}"
+        print(f"  {row['stage']:17s} {row['pool']:7s} {row['workers']:7d} {row['images_per_second']:9.2f} {speedup}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.json}")
@@ -0,0 +1,205 @@
+"""
+Benchmark VAE decode modes: full, tiled and tiny autoencoder
+Reports time, peak RSS and the difference from the full decoder at each
+resolution, plus full vs tiled encoding (as used for img2img and training).
+
+With no model given, a randomly initialised SD-shaped VAE and tiny
+autoencoder are used: time and memory are representative, image differences
+of the tiny decoder are not (its random weights aren't trained to match).
+
+Usage:
+    python bench_vae.py --sizes 512 768 1024
+    python bench_vae.py --model_path ./models/clothes-diffusion --tiny-vae madebyollin/taesd --json vae.json
+"""
+import argparse
+import json
+import math
+import resource
+import statistics
+import time
+
+import torch
+from diffusers import AutoencoderKL, AutoencoderTiny
+
+from vae_decode import VAE_TILE_OVERLAP, VAE_TILE_SIZE, configure_tiling
+
+# Stable Diffusion 1.x/2.x VAE shape
+SD_VAE_CONFIG = {
+    "block_out_channels": (128, 256, 512, 512),
+    "down_block_types": ("DownEncoderBlock2D",) * 4,
+    "up_block_types": ("UpDecoderBlock2D",) * 4,
+    "layers_per_block": 2,
+    "latent_channels": 4,
+    "sample_size": 512,
+}
+
+
+def reset_peak_rss():
+    """Reset the process high-water mark so the next peak_rss() covers only what follows (Linux)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def compare(reference, output):
+    """Max absolute difference and PSNR (dB) of two tensors in [-1, 1]"""
+    diff = (reference.float() - output.float())
+    mse = diff.pow(2).mean().item()
+    psnr = float("inf") if mse == 0 else 10 * math.log10(4.0 / mse)
+    return round(diff.abs().max().item(), 4), round(psnr, 2)
+
+
+def measure(run, repeats):
+    """
+    Time a call and the peak RSS it adds above the memory in use before it
+
+    Returns:
+        (last output, median seconds, peak extra bytes or None if the
+        high-water mark can't be reset)
+    """
+    run()  # Warm-up
+    timings = []
+    extra = None
+    for _ in range(repeats):
+        can_reset = reset_peak_rss()
+        before = current_rss()
+        start = time.perf_counter()
+        output = run()
+        timings.append(time.perf_counter() - start)
+        if can_reset:
+            extra = max(extra or 0, peak_rss() - before)
+    return output, statistics.median(timings), extra
+
+
+@torch.inference_mode()
+def benchmark(vae, tiny_vae, size, repeats=3, tile_size=VAE_TILE_SIZE, overlap=VAE_TILE_OVERLAP, seed=0):
+    """
+    Decode (and encode) one random sample at size x size in every mode
+
+    Returns:
+        List of dicts with mode, median ms, peak extra RSS in MB and the
+        difference from the full decoder / encoder
+    """
+    generator = torch.Generator().manual_seed(seed)
+    scale = 2 ** (len(vae.config.block_out_channels) - 1)
+    latents = torch.randn((1, vae.config.latent_channels, size // scale, size // scale), generator=generator)
+    image = torch.rand((1, 3, size, size), generator=generator) * 2 - 1
+
+    def decode_full():
+        vae.disable_tiling()
+        return vae.decode(latents).sample
+
+    def decode_tiled():
+        configure_tiling(vae, tile_size, overlap)
+        return vae.decode(latents).sample
+
+    def decode_tiny():
+        # The tiny decoder takes latents in the same (unscaled) space as the full one
+        scaled = latents * vae.config.scaling_factor / tiny_vae.config.scaling_factor
+        return tiny_vae.decode(scaled).sample
+
+    def encode_full():
+        vae.disable_tiling()
+        return vae.encode(image).latent_dist.mean
+
+    def encode_tiled():
+        configure_tiling(vae, tile_size, overlap)
+        return vae.encode(image).latent_dist.mean
+
+    results = []
+    for stage, cases in (
+        ("decode", [("full", decode_full), ("tiled", decode_tiled), ("tiny", decode_tiny)]),
+        ("encode", [("full", encode_full), ("tiled", encode_tiled)]),
+    ):
+        reference = None
+        for mode, run in cases:
+            if mode == "tiny" and tiny_vae is None:
+                continue
+            output, seconds, extra = measure(run, repeats)
+            if reference is None:
+                reference = output
+            max_abs, psnr = compare(reference, output)
+            results.append({
+                "stage": stage,
+                "mode": mode,
+                "ms": round(seconds * 1000, 1),
+                "peak_extra_rss_mb": round(extra / 2 ** 20, 1) if extra is not None else None,
+                "max_abs_diff": max_abs,
+                "psnr_db": psnr,
+            })
+    vae.disable_tiling()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark full, tiled and tiny-autoencoder VAE decoding")
+    parser.add_argument("--model_id", type=str, default=None, help="Hugging Face model ID to take the VAE from")
+    parser.add_argument("--model_path", type=str, default=None, help="Local pipeline folder to take the VAE from")
+    parser.add_argument("--tiny-vae", dest="tiny_vae", type=str, default=None,
+                        help="Tiny autoencoder ID or path (default: randomly initialised)")
+    parser.add_argument("--no-tiny", dest="no_tiny", action="store_true", help="Skip the tiny autoencoder")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 768, 1024])
+    parser.add_argument("--tile-size", dest="tile_size", type=int, default=VAE_TILE_SIZE)
+    parser.add_argument("--tile-overlap", dest="tile_overlap", type=float, default=VAE_TILE_OVERLAP)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", type=str, default=None, help="Write results to this JSON file")
+
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model_to_load = args.model_path or args.model_id
+    if model_to_load:
+        vae = AutoencoderKL.from_pretrained(model_to_load, subfolder="vae")
+    else:
+        vae = AutoencoderKL(**SD_VAE_CONFIG)
+    vae.eval()
+
+    tiny_vae = None
+    if not args.no_tiny:
+        tiny_vae = AutoencoderTiny.from_pretrained(args.tiny_vae) if args.tiny_vae else AutoencoderTiny()
+        tiny_vae.eval()
+
+    print(f"VAE: {model_to_load or 'random SD-shaped'}, tiny: {args.tiny_vae or ('none' if args.no_tiny else 'random')}, "
+          f"tiles of {args.tile_size}px with {args.tile_overlap:.0%} overlap, {torch.get_num_threads()} threads")
+    report = {}
+    for size in args.sizes:
+        results = benchmark(vae, tiny_vae, size, args.repeats, args.tile_size, args.tile_overlap)
+        report[str(size)] = results
+
+        print(f"\n{size}x{size}")
+        print(f"  {'stage':7s} {'mode':6s} {'ms':>9s} {'peak +MB':>9s} {'max diff':>9s} {'PSNR dB':>8s}")
+        for row in results:
+            peak = f"{row['peak_extra_rss_mb']:9.1f}" if row["peak_extra_rss_mb"] is not None else f"{'n/a':>9s}"
+            print(f"  {row['stage']:7s} {row['mode']:6s} {row['ms']:9.1f} {peak} "
+                  f"{row['max_abs_diff']:9.4f} {row['psnr_db']:8.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.json}")
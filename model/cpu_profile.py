@@ -0,0 +1,317 @@
+"""
+Opt-in CPU inference profile for the serving path
+bfloat16 autocast, channels_last, thread counts, inference_mode and torch.compile
+
+Run directly to measure what each optimization is worth on this host:
+    python cpu_profile.py --model_path ./models/clothes-diffusion --steps 10
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from contextlib import ExitStack
+
+import torch
+
+
+def _env_flag(name, default):
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "auto")
+
+
+def bf16_supported():
+    """Whether this CPU has native bfloat16 support (AVX512-BF16 / AMX)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+class CPUProfile:
+    """
+    Settings applied to pipelines running on the CPU
+
+    Everything is off unless enabled. Each option can also be switched
+    individually so the benchmark can measure them one at a time.
+    """
+
+    def __init__(
+        self,
+        enabled=False,
+        bf16=True,
+        channels_last=True,
+        inference_mode=True,
+        attention_slicing=False,
+        compile_unet=False,
+        num_threads=None,
+        interop_threads=None,
+        warmup_size=512,
+    ):
+        """
+        Args:
+            enabled: Apply the profile at all
+            bf16: bfloat16 autocast (only used when the CPU supports it)
+            channels_last: channels_last memory format for the UNet and VAE
+            inference_mode: Run under torch.inference_mode instead of no_grad
+            attention_slicing: Always slice attention (saves memory, costs speed;
+                otherwise the memory planner slices only when needed)
+            compile_unet: torch.compile the UNet and warm it up after loading
+            num_threads: Intra-op threads (None keeps torch's default)
+            interop_threads: Inter-op threads (None keeps torch's default)
+            warmup_size: Image size used to warm up the compiled UNet
+        """
+        self.enabled = enabled
+        self.bf16 = bf16 and bf16_supported()
+        self.channels_last = channels_last
+        self.inference_mode = inference_mode
+        self.attention_slicing = attention_slicing
+        self.compile_unet = compile_unet
+        self.num_threads = num_threads
+        self.interop_threads = interop_threads
+        self.warmup_size = warmup_size
+
+    @classmethod
+    def from_env(cls):
+        """Build the profile from CPU_PROFILE and the CPU_* variables"""
+        threads = os.getenv("CPU_THREADS")
+        interop = os.getenv("CPU_INTEROP_THREADS")
+        return cls(
+            enabled=_env_flag("CPU_PROFILE", "0"),
+            bf16=_env_flag("CPU_BF16", "auto"),
+            channels_last=_env_flag("CPU_CHANNELS_LAST", "1"),
+            inference_mode=_env_flag("CPU_INFERENCE_MODE", "1"),
+            attention_slicing=_env_flag("CPU_ATTENTION_SLICING", "0"),
+            compile_unet=_env_flag("CPU_COMPILE", "0"),
+            num_threads=int(threads) if threads else None,
+            interop_threads=int(interop) if interop else None,
+            warmup_size=int(os.getenv("CPU_WARMUP_SIZE", "512")),
+        )
+
+    def active(self, device):
+        return self.enabled and device == "cpu"
+
+    def tag(self):
+        """Short description of the settings that change outputs or loaded weights"""
+        if not self.enabled:
+            return "off"
+        parts = ["bf16" if self.bf16 else "fp32"]
+        if self.channels_last:
+            parts.append("channels_last")
+        if self.compile_unet:
+            parts.append("compiled")
+        return "+".join(parts)
+
+    def apply_threads(self):
+        """Set torch thread counts (inter-op threads can only be set before first use)"""
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        if self.interop_threads:
+            try:
+                torch.set_interop_threads(self.interop_threads)
+            except RuntimeError as e:
+                print(f"Warning: could not set inter-op threads: {e}")
+
+    def wants_attention_slicing(self, device, requested=None):
+        """
+        Whether a pipeline on this device should use attention slicing
+
+        An explicit True/False from the caller always wins. Otherwise
+        CPU_ATTENTION_SLICING=1 forces slicing on, and None leaves the choice
+        to the memory planner.
+        """
+        if requested is None and self.active(device) and self.attention_slicing:
+            return True
+        return requested
+
+    def optimize(self, pipe, device, mapped=()):
+        """
+        Apply memory format and compilation to a freshly loaded pipeline
+
+        Args:
+            pipe: Pipeline to optimize
+            device: Its device
+            mapped: Components whose weights are memory-mapped and shared
+                (see shared_weights); they stay in the file's layout, since
+                channels_last would copy every conv weight into private memory
+
+        Returns:
+            The same pipeline
+        """
+        if not self.active(device):
+            return pipe
+        if self.channels_last:
+            for name in ("unet", "vae"):
+                if name in mapped:
+                    print(f"Keeping mapped {name} weights shared (no channels_last)")
+                else:
+                    getattr(pipe, name).to(memory_format=torch.channels_last)
+        if self.compile_unet:
+            pipe.unet = torch.compile(pipe.unet)
+            self.warmup(pipe)
+        print(f"✅ Applied CPU profile: {self.tag()}, {torch.get_num_threads()} threads")
+        return pipe
+
+    def warmup(self, pipe, steps=2):
+        """Run a short generation so compilation happens before the first request"""
+        start = time.perf_counter()
+        with self.inference_context("cpu"):
+            pipe(
+                prompt="warm-up",
+                num_inference_steps=steps,
+                height=self.warmup_size,
+                width=self.warmup_size,
+            )
+        print(f"✅ Warmed up compiled UNet in {time.perf_counter() - start:.1f}s")
+
+    def inference_context(self, device):
+        """
+        Context manager for running a pipeline
+
+        CUDA keeps fp16 autocast; CPU uses inference_mode and bf16 autocast
+        when the profile enables them, and plain no_grad otherwise.
+        """
+        stack = ExitStack()
+        if device == "cuda":
+            stack.enter_context(torch.autocast(device))
+            return stack
+        if self.active(device) and self.inference_mode:
+            stack.enter_context(torch.inference_mode())
+        else:
+            stack.enter_context(torch.no_grad())
+        if self.active(device) and self.bf16:
+            stack.enter_context(torch.autocast("cpu", dtype=torch.bfloat16))
+        return stack
+
+
+default_cpu_profile = CPUProfile.from_env()
+if default_cpu_profile.enabled:
+    default_cpu_profile.apply_threads()
+
+
+def _time_steps(pipe, profile, prompt, steps, height, width, seed=0):
+    """
+    Generate one image and time every denoising step
+
+    Returns:
+        (list of per-step seconds, total seconds)
+    """
+    marks = [time.perf_counter()]
+
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        marks.append(time.perf_counter())
+        return callback_kwargs
+
+    start = time.perf_counter()
+    with profile.inference_context("cpu"):
+        pipe(
+            prompt=prompt,
+            num_inference_steps=steps,
+            height=height,
+            width=width,
+            generator=torch.Generator("cpu").manual_seed(seed),
+            callback_on_step_end=on_step_end,
+        )
+    total = time.perf_counter() - start
+    return [b - a for a, b in zip(marks, marks[1:])], total
+
+
+def benchmark(model_to_load, prompt, steps, height, width, num_threads=None, compile_unet=False, repeats=2):
+    """
+    Apply the CPU optimizations one after another and time each stage
+
+    Returns:
+        List of dicts with the stage name, median step time and total time
+    """
+    from inference_hf_model import load_pipeline
+
+    profile = CPUProfile(enabled=False)
+    profile.bf16 = False
+    pipe = load_pipeline(model_to_load, "cpu", torch.float32, attention_slicing=True, cpu_profile=profile)
+
+    def enable(**changes):
+        for name, value in changes.items():
+            setattr(profile, name, value)
+        profile.enabled = True
+
+    stages = [("baseline (fp32, no_grad, attention slicing)", lambda: None)]
+    if num_threads:
+        stages.append((f"{num_threads} threads", lambda: torch.set_num_threads(num_threads)))
+    stages += [
+        ("+ inference_mode", lambda: enable(inference_mode=True)),
+        ("+ no attention slicing", pipe.disable_attention_slicing),
+        ("+ channels_last", lambda: (
+            pipe.unet.to(memory_format=torch.channels_last),
+            pipe.vae.to(memory_format=torch.channels_last),
+        )),
+    ]
+    if bf16_supported():
+        stages.append(("+ bf16 autocast", lambda: enable(bf16=True)))
+    else:
+        print("bfloat16 is not supported natively on this CPU, skipping bf16 autocast")
+    if compile_unet:
+        def compile_and_warm():
+            pipe.unet = torch.compile(pipe.unet)
+            _time_steps(pipe, profile, prompt, 2, height, width)
+        stages.append(("+ torch.compile (UNet)", compile_and_warm))
+
+    results = []
+    for name, apply in stages:
+        apply()
+        # The first run of each stage also pays for one-off setup, so it is not counted
+        _time_steps(pipe, profile, prompt, 2, height, width)
+        step_times, totals = [], []
+        for _ in range(repeats):
+            times, total = _time_steps(pipe, profile, prompt, steps, height, width)
+            step_times += times[1:] or times
+            totals.append(total)
+        results.append({
+            "stage": name,
+            "step_ms": round(statistics.median(step_times) * 1000, 1),
+            "total_s": round(statistics.median(totals), 2),
+        })
+        print(f"{name}: {results[-1]['step_ms']} ms/step, {results[-1]['total_s']}s total")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure CPU inference optimizations step by step")
+    parser.add_argument("--model_id", type=str, default=None, help="Hugging Face model ID")
+    parser.add_argument("--model_path", type=str, default=None, help="Local path to model directory")
+    parser.add_argument("--prompt", type=str, default="a red cotton t-shirt")
+    parser.add_argument("--steps", type=int, default=10, help="Denoising steps per timed run")
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads to test")
+    parser.add_argument("--compile", action="store_true", help="Also measure torch.compile of the UNet")
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--json", type=str, default=None, help="Write results to this JSON file")
+
+    args = parser.parse_args()
+
+    from inference_hf_model import resolve_model
+
+    print(f"Threads: {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op")
+    print(f"bfloat16 supported: {bf16_supported()}")
+    results = benchmark(
+        resolve_model(args.model_id, args.model_path),
+        args.prompt,
+        args.steps,
+        args.height,
+        args.width,
+        num_threads=args.threads,
+        compile_unet=args.compile,
+        repeats=args.repeats,
+    )
+
+    baseline = results[0]["step_ms"]
+    print(f"\n{'stage':45s} {'ms/step':>10s} {'vs prev':>8s} {'vs base':>8s}")
+    previous = baseline
+    for row in results:
+        print(f"{row['stage']:45s} {row['step_ms']:10.1f} "
+              f"{previous / row['step_ms']:7.2f}x {baseline / row['step_ms']:7.2f}x")
+        previous = row["step_ms"]
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.json}")
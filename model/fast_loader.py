@@ -0,0 +1,299 @@
+"""
+Fast model startup
+Builds pipeline components on empty weights and points their parameters at
+memory-mapped safetensors instead of deserializing every file. Only the
+components a code path needs are built, they load concurrently, and weights
+converted to another dtype are kept on disk so the next start maps them
+directly.
+
+Compare startup against from_pretrained:
+    python fast_loader.py --model_path ./models/clothes-diffusion
+"""
+import argparse
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import torch
+from safetensors.torch import save_file
+
+from shared_weights import SAFETENSORS_DTYPES, local_model_dir, mmap_safetensors, read_safetensors_header, weight_files
+
+# dtype-converted copies of safetensors files, keyed by source file and dtype
+CONVERTED_WEIGHTS_DIR = os.getenv("CONVERTED_WEIGHTS_DIR", os.path.expanduser("~/.cache/clothes-diffusion/converted"))
+
+# Components each code path builds (the safety checker and feature extractor never are)
+INFERENCE_COMPONENTS = ("unet", "vae", "text_encoder", "tokenizer", "scheduler", "text_encoder_2", "tokenizer_2")
+TRAINING_COMPONENTS = ("unet", "text_encoder", "tokenizer")
+
+# Threads building modules on empty weights (see _empty_weights)
+_empty_weights_state = threading.local()
+_empty_weights_hook = None
+_empty_weights_hook_lock = threading.Lock()
+
+
+def _meta_parameter(module, name, param):
+    # Process-wide parameter registration hook that only acts on threads inside _empty_weights
+    if param is None or not getattr(_empty_weights_state, "active", False):
+        return None
+    kwargs = dict(param.__dict__)
+    kwargs["requires_grad"] = param.requires_grad
+    return type(param)(param.to("meta"), **kwargs)
+
+
+@contextmanager
+def _empty_weights():
+    """
+    Build modules with parameters on the meta device, on this thread only
+
+    Like accelerate's init_empty_weights(include_buffers=False), but through
+    a registration hook that checks a thread-local flag instead of patching
+    nn.Module, so other threads building modules meanwhile (requests,
+    warm-up, concurrent loads) get real weights.
+    """
+    global _empty_weights_hook
+    with _empty_weights_hook_lock:
+        if _empty_weights_hook is None:
+            _empty_weights_hook = torch.nn.modules.module.register_module_parameter_registration_hook(_meta_parameter)
+    previous = getattr(_empty_weights_state, "active", False)
+    _empty_weights_state.active = True
+    try:
+        yield
+    finally:
+        _empty_weights_state.active = previous
+
+
+def read_model_index(model_dir):
+    """model_index.json of a local pipeline folder"""
+    with open(os.path.join(model_dir, "model_index.json")) as f:
+        return json.load(f)
+
+
+def _component_class(model_index, name):
+    library, class_name = model_index[name]
+    return getattr(importlib.import_module(library), class_name)
+
+
+def _needs_conversion(path, dtype):
+    header, _ = read_safetensors_header(path)
+    return any(
+        SAFETENSORS_DTYPES[info["dtype"]].is_floating_point and SAFETENSORS_DTYPES[info["dtype"]] != dtype
+        for info in header.values()
+    )
+
+
+def converted_copy(path, dtype, cache_dir=CONVERTED_WEIGHTS_DIR):
+    """
+    Path of a copy of a safetensors file with floating-point tensors in dtype,
+    writing it on first use
+
+    The cache key includes the source file's size and modification time, so
+    retrained or re-downloaded weights get a fresh copy.
+    """
+    stat = os.stat(path)
+    source = f"{os.path.realpath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{dtype}"
+    target = os.path.join(cache_dir, hashlib.sha256(source.encode()).hexdigest()[:24] + ".safetensors")
+    if os.path.exists(target):
+        return target
+
+    start = time.perf_counter()
+    tensors = {
+        name: (tensor.to(dtype) if tensor.is_floating_point() else tensor).contiguous()
+        for name, tensor in mmap_safetensors(path).items()
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = f"{target}.{os.getpid()}.tmp"
+    save_file(tensors, temp_path, metadata={"source": os.path.realpath(path), "dtype": str(dtype)})
+    os.replace(temp_path, target)
+    print(f"✅ Cached {dtype} weights for {path} ({time.perf_counter() - start:.1f}s)")
+    return target
+
+
+def load_component(model_dir, name, dtype=None, cache_dir=CONVERTED_WEIGHTS_DIR):
+    """
+    Load one pipeline component
+
+    Models are built on empty weights and their parameters are assigned
+    tensors that view a memory mapping of the weights, so nothing is copied
+    until a page is touched.
+
+    Args:
+        model_dir: Local pipeline folder
+        name: Component name in model_index.json (e.g. "unet")
+        dtype: dtype for floating-point weights (None keeps the file's)
+        cache_dir: Where dtype-converted copies are kept
+
+    Returns:
+        The component (model in eval mode, tokenizer or scheduler)
+
+    Raises:
+        ValueError: If the checkpoint doesn't cover every parameter (older
+            layouts that need from_pretrained's key conversion)
+    """
+    directory = os.path.join(model_dir, name)
+    cls = _component_class(read_model_index(model_dir), name)
+    if not issubclass(cls, torch.nn.Module):
+        return cls.from_pretrained(directory)
+
+    files = weight_files(directory, "fp16" if dtype == torch.float16 else None)
+    if not files:
+        raise FileNotFoundError(f"No safetensors weights in {directory}")
+    state_dict = {}
+    for path in files:
+        if dtype is not None and _needs_conversion(path, dtype):
+            path = converted_copy(path, dtype, cache_dir)
+        state_dict.update(mmap_safetensors(path))
+
+    # Buffers are still created normally: non-persistent ones aren't in the checkpoint
+    with _empty_weights():
+        if hasattr(cls, "load_config"):
+            module = cls.from_config(cls.load_config(directory))
+        else:
+            module = cls(cls.config_class.from_pretrained(directory))
+    module.load_state_dict(state_dict, strict=False, assign=True)
+    missing = [param_name for param_name, param in module.named_parameters() if param.is_meta]
+    if missing:
+        raise ValueError(f"{name}: {len(missing)} parameters are not in the checkpoint (e.g. {missing[0]})")
+    if dtype is not None:
+        # Float buffers created at build time; the mapped weights already match
+        for submodule in module.modules():
+            for buffer_name, buffer in submodule.named_buffers(recurse=False):
+                if buffer.is_floating_point() and buffer.dtype != dtype:
+                    setattr(submodule, buffer_name, buffer.to(dtype))
+    return module.eval()
+
+
+def load_components(model_to_load, names, dtype=None, max_workers=4):
+    """
+    Load several components of a pipeline concurrently
+
+    Args:
+        model_to_load: Local pipeline folder or a downloaded Hugging Face ID
+        names: Components to load; names the pipeline doesn't have are skipped
+        dtype: dtype for floating-point weights
+        max_workers: Components loaded at the same time
+
+    Returns:
+        Dict of name -> component
+
+    Raises:
+        FileNotFoundError: If the model isn't available locally
+    """
+    model_dir = local_model_dir(model_to_load)
+    if model_dir is None or not os.path.exists(os.path.join(model_dir, "model_index.json")):
+        raise FileNotFoundError(f"{model_to_load} is not a local pipeline folder or downloaded model")
+    model_index = read_model_index(model_dir)
+    names = [name for name in names if isinstance(model_index.get(name), list) and model_index[name][0]]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {name: pool.submit(load_component, model_dir, name, dtype) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def build_pipeline(model_to_load, dtype=None, components=INFERENCE_COMPONENTS):
+    """
+    Assemble a pipeline from fast-loaded components
+
+    Components that aren't requested (safety checker, feature extractor,
+    image encoder) are passed as None.
+
+    Returns:
+        Pipeline of the class named in model_index.json, on the CPU
+    """
+    import diffusers
+
+    model_dir = local_model_dir(model_to_load)
+    if model_dir is None or not os.path.exists(os.path.join(model_dir, "model_index.json")):
+        raise FileNotFoundError(f"{model_to_load} is not a local pipeline folder or downloaded model")
+    model_index = read_model_index(model_dir)
+    pipeline_cls = getattr(diffusers, model_index["_class_name"])
+    loaded = load_components(model_dir, components, dtype)
+
+    parameters = inspect.signature(pipeline_cls.__init__).parameters
+    kwargs = {}
+    for name, value in model_index.items():
+        if name.startswith("_") or name not in parameters:
+            continue
+        # Components are [library, class] pairs; everything else is a config value
+        kwargs[name] = loaded.get(name) if isinstance(value, list) else value
+    if "requires_safety_checker" in parameters:
+        kwargs["requires_safety_checker"] = False
+    pipe = pipeline_cls(**kwargs)
+    pipe.register_to_config(_name_or_path=model_to_load)
+    return pipe
+
+
+def copy_component(model_to_load, name, output_dir):
+    """
+    Copy a component's config and weights into a pipeline folder without loading it
+
+    Returns:
+        True if copied, False if the model isn't available locally
+    """
+    model_dir = local_model_dir(model_to_load)
+    source = os.path.join(model_dir, name) if model_dir else None
+    if source is None or not weight_files(source):
+        return False
+    destination = os.path.join(output_dir, name)
+    os.makedirs(destination, exist_ok=True)
+    for path in weight_files(source) + [os.path.join(source, "config.json")]:
+        shutil.copyfile(path, os.path.join(destination, os.path.basename(path)))
+    return True
+
+
+def _time_load(load, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = load()
+        timings.append(time.perf_counter() - start)
+        del result
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare from_pretrained and fast-loader startup times")
+    parser.add_argument("--model_id", type=str, default=None, help="Downloaded Hugging Face model ID")
+    parser.add_argument("--model_path", type=str, default=None, help="Local pipeline folder")
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "float16", "bfloat16"])
+    parser.add_argument("--repeats", type=int, default=3, help="Best of N (after one untimed load warms the page cache)")
+
+    args = parser.parse_args()
+
+    from diffusers import AutoencoderKL, DiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextModel, CLIPTokenizer
+
+    model_to_load = args.model_path or args.model_id
+    dtype = getattr(torch, args.dtype)
+
+    def from_pretrained_pipeline():
+        return DiffusionPipeline.from_pretrained(model_to_load, torch_dtype=dtype, safety_checker=None)
+
+    def from_pretrained_training():
+        # What train() used to do: every component, with the VAE loaded twice
+        return (
+            CLIPTokenizer.from_pretrained(model_to_load, subfolder="tokenizer"),
+            CLIPTextModel.from_pretrained(model_to_load, subfolder="text_encoder"),
+            AutoencoderKL.from_pretrained(model_to_load, subfolder="vae"),
+            UNet2DConditionModel.from_pretrained(model_to_load, subfolder="unet"),
+            AutoencoderKL.from_pretrained(model_to_load, subfolder="vae"),
+        )
+
+    cases = [
+        ("inference: from_pretrained", from_pretrained_pipeline),
+        ("inference: fast loader", lambda: build_pipeline(model_to_load, dtype=dtype)),
+        ("training: from_pretrained (VAE twice)", from_pretrained_training),
+        ("training: fast loader (cached latents)", lambda: load_components(model_to_load, TRAINING_COMPONENTS)),
+        ("training: fast loader (with VAE)",
+         lambda: load_components(model_to_load, TRAINING_COMPONENTS + ("vae",))),
+    ]
+    print(f"Startup times for {model_to_load} ({args.dtype}), best of {args.repeats}:")
+    for label, load in cases:
+        load()  # Warm the page cache and write any converted copies
+        print(f"  {label:42s} {_time_load(load, args.repeats):7.2f}s")
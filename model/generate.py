@@ -6,41 +6,27 @@ from diffusers import StableDiffusionPipeline
 from PIL import Image
 import argparse
 import os
+from pipeline_registry import default_registry
 
-def generate_image(
-    prompt,
-    model_path="./models/clothes-diffusion",
-    output_path="./outputs",
-    num_inference_steps=50,
-    guidance_scale=7.5,
-    height=512,
-    width=512,
-    seed=None,
-):
+def load_pipeline(model_path, device, dtype):
     """
-    Generate an image from a text prompt
+    Load the fine-tuned pipeline, falling back to the base model
     
     Args:
-        prompt: Text description of the clothing item
         model_path: Path to the fine-tuned model
-        output_path: Directory to save generated images
-        num_inference_steps: Number of denoising steps
-        guidance_scale: Guidance scale for classifier-free guidance
-        height: Height of generated image
-        width: Width of generated image
-        seed: Random seed for reproducibility
+        device: Device to move the pipeline to
+        dtype: Torch dtype for the weights
         
     Returns:
-        Generated PIL Image
+        Loaded pipeline
     """
-    
     # Check if custom model exists, otherwise use base model
     if os.path.exists(model_path) and os.path.exists(os.path.join(model_path, "unet")):
         print(f"Loading fine-tuned model from {model_path}...")
         try:
             pipe = StableDiffusionPipeline.from_pretrained(
                 model_path,
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+                torch_dtype=dtype,
                 safety_checker=None,  # Disable safety checker for clothing images
             )
         except Exception as e:
@@ -48,19 +34,77 @@ def generate_image(
             print("Falling back to base Stable Diffusion model...")
             pipe = StableDiffusionPipeline.from_pretrained(
                 "runwayml/stable-diffusion-v1-5",
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+                torch_dtype=dtype,
             )
     else:
         print("Fine-tuned model not found. Using base Stable Diffusion model...")
         pipe = StableDiffusionPipeline.from_pretrained(
             "runwayml/stable-diffusion-v1-5",
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+            torch_dtype=dtype,
         )
     
     # Move to GPU if available
+    return pipe.to(device)
+
+def generate_image(
+    prompt,
+    model_path="./models/clothes-diffusion",
+    output_path="./outputs",
+    num_inference_steps=50,
+    guidance_scale=7.5,
+    height=512,
+    width=512,
+    seed=None,
+):
+    """
+    Generate an image from a text prompt
+    
+    Args:
+        prompt: Text description of the clothing item
+        model_path: Path to the fine-tuned model
+        output_path: Directory to save generated images
+        num_inference_steps: Number of denoising steps
+        guidance_scale: Guidance scale for classifier-free guidance
+        height: Height of generated image
+        width: Width of generated image
+        seed: Random seed for reproducibility
+        
+    Returns:
+        Generated PIL Image
+    """
+    
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    pipe = pipe.to(device)
+    dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+    key = (model_path, StableDiffusionPipeline.__name__, str(dtype), device, ())
+    
+    with default_registry.acquire(key, lambda: load_pipeline(model_path, device, dtype)) as pipe:
+        image = _run_pipeline(
+            pipe,
+            prompt,
+            device=device,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            height=height,
+            width=width,
+            seed=seed,
+        )
+    
+    # Create output directory
+    os.makedirs(output_path, exist_ok=True)
+    
+    # Save image
+    import time
+    timestamp = int(time.time())
+    filename = f"generated_{timestamp}.png"
+    filepath = os.path.join(output_path, filename)
+    image.save(filepath)
+    
+    print(f"Image saved to {filepath}")
     
+    return image
+
+def _run_pipeline(pipe, prompt, device, num_inference_steps, guidance_scale, height, width, seed):
+    """Run one generation on an already loaded pipeline"""
     # Set seed if provided
     if seed is not None:
         generator = torch.Generator(device=device).manual_seed(seed)
@@ -81,18 +125,6 @@ def generate_image(
             generator=generator,
         ).images[0]
     
-    # Create output directory
-    os.makedirs(output_path, exist_ok=True)
-    
-    # Save image
-    import time
-    timestamp = int(time.time())
-    filename = f"generated_{timestamp}.png"
-    filepath = os.path.join(output_path, filename)
-    image.save(filepath)
-    
-    print(f"Image saved to {filepath}")
-    
     return image
 
 if __name__ == "__main__":
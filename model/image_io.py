@@ -0,0 +1,185 @@
+"""
+Image encoding, Accept-header format negotiation and background persistence
+"""
+import io
+import os
+import queue
+import threading
+import time
+import uuid
+
+from metrics import record_stage
+
+# name -> (mimetype, file extension)
+FORMATS = {
+    "png": ("image/png", "png"),
+    "webp-lossless": ("image/webp", "webp"),
+    "webp": ("image/webp", "webp"),
+    "jpeg": ("image/jpeg", "jpg"),
+}
+
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "6"))
+
+
+def encode_image(image, fmt="png", quality=90):
+    """
+    Encode a PIL image
+
+    Args:
+        image: PIL Image
+        fmt: One of FORMATS ("png", "webp-lossless", "webp", "jpeg")
+        quality: Quality for lossy formats (1-100)
+
+    Returns:
+        Encoded bytes
+    """
+    buffer = io.BytesIO()
+    if fmt == "png":
+        image.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    elif fmt == "webp-lossless":
+        image.save(buffer, format="WEBP", lossless=True, quality=quality, method=4)
+    elif fmt == "webp":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    elif fmt == "jpeg":
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+    else:
+        raise ValueError(f"Unsupported image format: {fmt}")
+    return buffer.getvalue()
+
+
+def negotiate_format(accept_header, requested=None, quality=None):
+    """
+    Pick a binary image format for a response
+
+    Args:
+        accept_header: Value of the Accept request header
+        requested: Explicit format override ("png", "webp", "jpeg", "webp-lossless")
+        quality: Requested lossy quality; image/webp without a quality means
+            lossless WebP
+
+    Returns:
+        Format name from FORMATS, or None when the client wants JSON
+    """
+    if requested:
+        requested = requested.lower()
+        if requested == "jpg":
+            requested = "jpeg"
+        if requested == "webp" and quality is None:
+            requested = "webp-lossless"
+        if requested not in FORMATS:
+            raise ValueError(f"Unsupported image format: {requested}")
+        return requested
+
+    candidates = []
+    for position, part in enumerate((accept_header or "").split(",")):
+        fields = [field.strip() for field in part.split(";")]
+        media_type = fields[0].lower()
+        q = 1.0
+        for field in fields[1:]:
+            if field.startswith("q="):
+                try:
+                    q = float(field[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type and q > 0:
+            candidates.append((-q, position, media_type))
+
+    for _, _, media_type in sorted(candidates):
+        if media_type in ("application/json", "*/*", "text/event-stream"):
+            return None
+        if media_type in ("image/png", "image/*"):
+            return "png"
+        if media_type == "image/webp":
+            return "webp" if quality is not None else "webp-lossless"
+        if media_type == "image/jpeg":
+            return "jpeg"
+    return None
+
+
+class BackgroundWriter:
+    """
+    Writes files on a background thread so responses don't wait for disk
+
+    Data stays readable through get_pending() until it has been written.
+    """
+
+    def __init__(self, output_dir, max_pending=64):
+        """
+        Args:
+            output_dir: Directory files are written to
+            max_pending: Queue depth before submit() blocks
+        """
+        self.output_dir = output_dir
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._write_loop, name="image-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, data, extension="png", filename=None):
+        """
+        Queue bytes to be written
+
+        Args:
+            data: Encoded image bytes
+            extension: File extension used for generated filenames
+            filename: Explicit filename (defaults to generated_<uuid>.<extension>)
+
+        Returns:
+            Filename the data will be written to
+        """
+        filename = filename or f"generated_{uuid.uuid4().hex}.{extension}"
+        with self._lock:
+            self._pending[filename] = data
+        self._queue.put((filename, data))
+        return filename
+
+    def run(self, task):
+        """Queue an arbitrary callable to run on the writer thread"""
+        self._queue.put((None, task))
+
+    def get_pending(self, filename):
+        """Bytes queued for filename that are not on disk yet, or None"""
+        with self._lock:
+            return self._pending.get(filename)
+
+    def flush(self):
+        """Block until every queued file has been written"""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending": pending, "written": self.written, "failed": self.failed}
+
+    def _write_loop(self):
+        while True:
+            filename, data = self._queue.get()
+            if filename is None:
+                try:
+                    data()
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Background write failed: {e}")
+                finally:
+                    self._queue.task_done()
+                continue
+            try:
+                start = time.perf_counter()
+                os.makedirs(self.output_dir, exist_ok=True)
+                path = os.path.join(self.output_dir, filename)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                record_stage("disk_write", time.perf_counter() - start)
+                self.written += 1
+            except OSError as e:
+                self.failed += 1
+                print(f"Failed to write {filename}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.pop(filename, None)
+                self._queue.task_done()
@@ -6,8 +6,187 @@ import torch
 from diffusers import StableDiffusionPipeline, StableDiffusionXLPipeline
 from PIL import Image
 import argparse
+import json
 import os
+import random
+import time
 from pathlib import Path
+from pipeline_registry import default_registry
+from prompt_cache import default_prompt_cache
+from cpu_profile import default_cpu_profile
+from metrics import BATCH_SIZE, StepClock, record_stage
+from schedulers import LCM_LORA, lcm_available, load_lcm_adapter, quality_preset, use_scheduler
+from shared_weights import WEIGHT_COMPONENTS, local_model_dir, share_pipeline_weights
+from fast_loader import build_pipeline
+from memory_planner import chunk_sizes, use_memory_plan
+from refine import draft_size, draft_then_refine, refine_steps, resolve_refine
+from vae_decode import VAE_MODES
+
+DEFAULT_MODEL_ID = "runwayml/stable-diffusion-v1-5"
+# Map safetensors weights read-only so processes serving the same model share them (CPU only)
+MMAP_WEIGHTS = os.getenv("MMAP_WEIGHTS", "False").lower() == "true"
+# Build only the needed components straight from mapped safetensors (falls back to from_pretrained)
+FAST_LOAD = os.getenv("FAST_LOAD", "True").lower() == "true"
+
+def resolve_model(model_id=None, model_path=None):
+    """
+    Pick the model to load: a local path if it exists, else a Hugging Face ID
+    
+    Args:
+        model_id: Hugging Face model ID
+        model_path: Local path to model (takes precedence when it exists)
+        
+    Returns:
+        Model path or ID to pass to from_pretrained
+    """
+    if model_path and os.path.exists(model_path):
+        return model_path
+    if model_id:
+        return model_id
+    # Default to Stable Diffusion v1.5
+    return DEFAULT_MODEL_ID
+
+def is_sdxl_model(model_to_load):
+    """Check if a model path or ID refers to SDXL or regular SD"""
+    # Local pipelines record their class; only guess from the name for Hub IDs
+    model_index = os.path.join(model_to_load, "model_index.json")
+    if os.path.isfile(model_index):
+        with open(model_index) as f:
+            return "XL" in json.load(f).get("_class_name", "")
+    return "xl" in model_to_load.lower() or "sdxl" in model_to_load.lower()
+
+def get_device_and_dtype():
+    """Return the inference device and the dtype to load weights in"""
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = torch.float16 if device == "cuda" else torch.float32
+    return device, dtype
+
+def load_pipeline(model_to_load, device, dtype, attention_slicing=None, cpu_profile=None, mmap_weights=None):
+    """
+    Load a pipeline from disk or the Hub and move it to the device
+    
+    Args:
+        model_to_load: Model path or Hugging Face ID
+        device: Device to move the pipeline to
+        dtype: Torch dtype for the weights
+        attention_slicing: True/False fixes attention slicing on or off; None
+            leaves it to the memory planner per request
+        cpu_profile: CPUProfile applied on the CPU (defaults to the one
+            configured by CPU_PROFILE)
+        mmap_weights: Back the weights with a shared read-only mapping of the
+            safetensors files (defaults to MMAP_WEIGHTS; CPU only)
+        
+    Returns:
+        Loaded pipeline
+    """
+    pipe = None
+    fast_loaded = False
+    if FAST_LOAD:
+        start = time.perf_counter()
+        try:
+            pipe = build_pipeline(model_to_load, dtype=dtype)
+            fast_loaded = True
+            print(f"✅ Fast-loaded {model_to_load} in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            print(f"Fast load not possible ({e}); using from_pretrained")
+    
+    # Load the appropriate pipeline
+    if pipe is None:
+        try:
+            if is_sdxl_model(model_to_load):
+                print(f"Loading SDXL pipeline from {model_to_load}...")
+                pipe = StableDiffusionXLPipeline.from_pretrained(
+                    model_to_load,
+                    torch_dtype=dtype,
+                    safety_checker=None,
+                    requires_safety_checker=False,
+                )
+            else:
+                print(f"Loading Stable Diffusion pipeline from {model_to_load}...")
+                pipe = StableDiffusionPipeline.from_pretrained(
+                    model_to_load,
+                    torch_dtype=dtype,
+                    safety_checker=None,
+                    requires_safety_checker=False,
+                )
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            print("Falling back to Stable Diffusion v1.5...")
+            pipe = StableDiffusionPipeline.from_pretrained(
+                DEFAULT_MODEL_ID,
+                torch_dtype=dtype,
+                safety_checker=None,
+            )
+    
+    # Move to device
+    pipe = pipe.to(device)
+    
+    # With MMAP_WEIGHTS (the default in worker-pool processes) weights are shared
+    # across processes: fast-loaded ones are mapped already, others are remapped
+    # here. Shared components keep the file layout; the CPU profile skips
+    # channels_last for them, since converting would give each process a private
+    # copy. A single process without MMAP_WEIGHTS gets channels_last as usual.
+    share = (MMAP_WEIGHTS if mmap_weights is None else mmap_weights) and device == "cpu"
+    mapped = set(WEIGHT_COMPONENTS) if share and fast_loaded else set()
+    if share and not fast_loaded:
+        model_dir = local_model_dir(model_to_load)
+        if model_dir:
+            report = share_pipeline_weights(pipe, model_dir)
+            mapped = {name for name, r in report.items() if r["shared_bytes"]}
+            shared = sum(r["shared_bytes"] for r in report.values())
+            private = sum(r["private_bytes"] for r in report.values())
+            print(f"✅ Memory-mapped {shared / 1024 ** 2:.0f} MB of weights ({private / 1024 ** 2:.0f} MB private)")
+    
+    if LCM_LORA:
+        load_lcm_adapter(pipe, LCM_LORA)
+    
+    # The unconditional embedding never changes, so compute it once up front
+    if not isinstance(pipe, StableDiffusionXLPipeline):
+        default_prompt_cache.unconditional(pipe, 1)
+    
+    # Attention slicing is planned per request unless the caller fixed it
+    pipe._attention_slicing = attention_slicing
+    if attention_slicing:
+        try:
+            pipe.enable_attention_slicing()
+            print("✅ Enabled attention slicing for memory efficiency")
+        except Exception:
+            pass
+    
+    # Opt-in CPU optimizations (channels_last, torch.compile + warm-up)
+    return (cpu_profile or default_cpu_profile).optimize(pipe, device, mapped=mapped)
+
+def get_pipeline(model_to_load, device, dtype, attention_slicing=None, registry=None):
+    """
+    Context manager giving exclusive use of a resident pipeline
+    
+    Pipelines are cached in the process-wide registry, so only the first
+    call for a given model/dtype/device/options combination loads weights.
+    
+    Args:
+        model_to_load: Model path or Hugging Face ID
+        device: Inference device
+        dtype: Torch dtype for the weights
+        attention_slicing: True/False fixes attention slicing; None (default)
+            lets the memory planner choose per request
+        registry: PipelineRegistry to use (defaults to the process-wide one)
+    """
+    pipeline_cls = StableDiffusionXLPipeline if is_sdxl_model(model_to_load) else StableDiffusionPipeline
+    attention_slicing = default_cpu_profile.wants_attention_slicing(device, attention_slicing)
+    options = [("attention_slicing", attention_slicing), ("lcm_lora", LCM_LORA), ("mmap_weights", MMAP_WEIGHTS)]
+    if default_cpu_profile.active(device):
+        options.append(("cpu_profile", default_cpu_profile.tag()))
+    key = (
+        model_to_load,
+        pipeline_cls.__name__,
+        str(dtype),
+        device,
+        tuple(options),
+    )
+    registry = registry or default_registry
+    return registry.acquire(
+        key, lambda: load_pipeline(model_to_load, device, dtype, attention_slicing=attention_slicing)
+    )
 
 def generate_image(
     prompt,
@@ -20,135 +199,430 @@ def generate_image(
     width=512,
     seed=None,
     negative_prompt=None,
+    step_callback=None,
+    scheduler=None,
+    timer=None,
+    vae_mode=None,
+    refine=None,
+    num_images=1,
 ):
     """
-    Generate an image from a text prompt using a Hugging Face model
+    Generate an image (or several candidates) from a text prompt using a Hugging Face model
     
     Args:
         prompt: Text description of the image
         model_id: Hugging Face model ID (e.g., "runwayml/stable-diffusion-v1-5")
         model_path: Local path to model (if None, uses model_id)
-        output_path: Directory to save generated images
+        output_path: Directory to save generated images (None to skip saving)
         num_inference_steps: Number of denoising steps
         guidance_scale: Guidance scale for classifier-free guidance
         height: Height of generated image
         width: Width of generated image
         seed: Random seed for reproducibility
         negative_prompt: Negative prompt to avoid certain features
+        step_callback: Optional callable(step, total_steps, latents) run after
+            each denoising step; raising from it aborts the generation
+        scheduler: Sampler to use (see schedulers.SCHEDULERS; None keeps the
+            model's own)
+        timer: Optional metrics.StageTimer receiving per-stage durations
+        vae_mode: "full", "tiled", "tiny" or "auto" (see vae_decode; None = auto)
+        refine: refine.RefineSettings to draft at a lower resolution and
+            refine at the target size (None = single pass)
+        num_images: Candidates to generate in one batched pass; image i uses
+            seed + i (see candidate_seeds). step_callback receives each
+            candidate's steps.
         
     Returns:
-        Generated PIL Image
+        Generated PIL Image, or a list of num_images images when num_images > 1
     """
     
-    # Determine which model to use
-    if model_path and os.path.exists(model_path):
-        print(f"Loading model from local path: {model_path}")
-        model_to_load = model_path
-    elif model_id:
-        print(f"Loading model from Hugging Face: {model_id}")
-        model_to_load = model_id
-    else:
-        # Default to Stable Diffusion v1.5
-        model_id = "runwayml/stable-diffusion-v1-5"
-        print(f"No model specified, using default: {model_id}")
-        model_to_load = model_id
+    model_to_load = resolve_model(model_id, model_path)
+    device, dtype = get_device_and_dtype()
     
-    # Check if it's SDXL or regular SD
-    is_sdxl = "xl" in model_to_load.lower() or "sdxl" in model_to_load.lower()
+    print(f"Device: {device}, Dtype: {dtype}")
+    print(f"\nGenerating image for prompt: '{prompt}'...")
+    print(f"Steps: {num_inference_steps}, Guidance: {guidance_scale}, Size: {width}x{height}")
+    if scheduler:
+        print(f"Scheduler: {scheduler}")
+    if refine:
+        print(f"Refine: {refine}")
     
-    # Determine device and dtype
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    dtype = torch.float16 if device == "cuda" else torch.float32
+    requests = [
+        {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "guidance_scale": guidance_scale,
+            "seed": candidate_seed,
+            "step_callback": step_callback,
+            # One timer per call; stages would otherwise be counted once per candidate
+            "timer": timer if index == 0 else None,
+        }
+        for index, candidate_seed in enumerate(candidate_seeds(seed, num_images))
+    ]
+    images = _generate_chunked(
+        model_to_load, requests, device, dtype, num_inference_steps, height, width, scheduler, vae_mode, refine
+    )
     
-    print(f"Device: {device}, Dtype: {dtype}")
+    # A step_callback that raised for some candidates only
+    for image in images:
+        if isinstance(image, BaseException):
+            raise image
     
-    # Load the appropriate pipeline
-    try:
-        if is_sdxl:
-            print("Loading SDXL pipeline...")
-            pipe = StableDiffusionXLPipeline.from_pretrained(
-                model_to_load,
-                torch_dtype=dtype,
-                safety_checker=None,
-                requires_safety_checker=False,
-            )
-        else:
-            print("Loading Stable Diffusion pipeline...")
-            pipe = StableDiffusionPipeline.from_pretrained(
-                model_to_load,
-                torch_dtype=dtype,
-                safety_checker=None,
-                requires_safety_checker=False,
-            )
-    except Exception as e:
-        print(f"Error loading model: {e}")
-        print("Falling back to Stable Diffusion v1.5...")
-        pipe = StableDiffusionPipeline.from_pretrained(
-            "runwayml/stable-diffusion-v1-5",
-            torch_dtype=dtype,
-            safety_checker=None,
+    if num_images == 1:
+        if output_path:
+            save_image(images[0], output_path)
+        return images[0]
+    
+    if output_path:
+        for index, image in enumerate(images):
+            save_image(image, output_path, suffix=f"_{index}")
+    return images
+
+def candidate_seeds(seed, num_images):
+    """
+    Seeds for num_images candidates: seed, seed + 1, ...
+    
+    A single image keeps seed as given (None = random). Several candidates
+    without a seed get a random base seed, so each one can be reproduced.
+    """
+    if num_images == 1:
+        return [seed]
+    base = int(seed) if seed is not None else random.randrange(2 ** 31)
+    return [base + index for index in range(num_images)]
+
+def generate_images_batch(
+    requests,
+    model_id=None,
+    model_path=None,
+    output_path="./outputs",
+    num_inference_steps=50,
+    height=512,
+    width=512,
+    scheduler=None,
+    vae_mode=None,
+    refine=None,
+):
+    """
+    Generate one image per request in one batched pipeline call, or in as few
+    as the memory budget allows (see memory_planner.chunk_sizes)
+    
+    All requests share the model, size, step count, scheduler, decoder and
+    refine settings; prompts, negative prompts, guidance scales and seeds are
+    per request.
+    
+    Args:
+        requests: List of dicts with "prompt" and optional "negative_prompt",
+            "guidance_scale", "seed", "step_callback" and "timer"
+        model_id: Hugging Face model ID
+        model_path: Local path to model (if None, uses model_id)
+        output_path: Directory to save generated images (None to skip saving)
+        num_inference_steps: Number of denoising steps
+        height: Height of generated images
+        width: Width of generated images
+        scheduler: Sampler to use (None keeps the model's own)
+        vae_mode: "full", "tiled", "tiny" or "auto" (see vae_decode; None = auto)
+        refine: refine.RefineSettings for draft-then-refine (None = single pass)
+        
+    Returns:
+        List in the same order as requests holding a PIL Image, or the
+        exception raised by that request's step_callback
+    """
+    model_to_load = resolve_model(model_id, model_path)
+    device, dtype = get_device_and_dtype()
+    
+    print(f"\nGenerating a batch of {len(requests)} images...")
+    print(f"Steps: {num_inference_steps}, Size: {width}x{height}, Scheduler: {scheduler or 'default'}")
+    
+    images = _generate_chunked(
+        model_to_load, requests, device, dtype, num_inference_steps, height, width, scheduler, vae_mode, refine
+    )
+    
+    if output_path:
+        for index, image in enumerate(images):
+            if not isinstance(image, BaseException):
+                save_image(image, output_path, suffix=f"_{index}" if len(images) > 1 else "")
+    
+    return images
+
+def _generate_chunked(model_to_load, requests, device, dtype, num_inference_steps, height, width,
+                      scheduler, vae_mode, refine):
+    """
+    Run requests on the resident pipeline, split into as few pipeline calls
+    as the memory budget allows
+    
+    Returns:
+        List in the same order as requests holding a PIL Image or an exception
+    """
+    acquire_start = time.perf_counter()
+    with get_pipeline(model_to_load, device=device, dtype=dtype) as pipe, use_scheduler(pipe, scheduler):
+        record_stage(
+            "pipeline_acquire", time.perf_counter() - acquire_start, [r.get("timer") for r in requests]
         )
+        guidance = any(float(r.get("guidance_scale", 7.5)) > 1 for r in requests)
+        sizes = chunk_sizes(pipe, len(requests), height, width, vae_mode, device=device, guidance=guidance)
+        if len(sizes) > 1:
+            print(f"Splitting {len(requests)} images into batches of {sizes} to fit the memory budget")
+        images = []
+        for size in sizes:
+            chunk = requests[len(images):len(images) + size]
+            with use_memory_plan(pipe, len(chunk), height, width, vae_mode, device=device, guidance=guidance):
+                images += _run_batch(
+                    pipe,
+                    chunk,
+                    device=device,
+                    num_inference_steps=num_inference_steps,
+                    height=height,
+                    width=width,
+                    refine=refine,
+                )
+    return images
+
+def save_image(image, output_path, suffix=""):
+    """
+    Save a generated image under a timestamped filename
     
-    # Move to device
-    pipe = pipe.to(device)
+    Returns:
+        Path of the saved file
+    """
+    # Create output directory
+    os.makedirs(output_path, exist_ok=True)
     
-    # Enable memory efficient attention if available
-    try:
-        pipe.enable_attention_slicing()
-        print("✅ Enabled attention slicing for memory efficiency")
-    except:
-        pass
+    # Save image
+    timestamp = int(time.time())
+    filename = f"generated_{timestamp}{suffix}.png"
+    filepath = os.path.join(output_path, filename)
+    image.save(filepath)
     
-    # Set seed if provided
+    print(f"✅ Image saved to {filepath}")
+    
+    return filepath
+
+def _make_generator(seed, device):
+    generator = torch.Generator(device=device)
     if seed is not None:
-        generator = torch.Generator(device=device).manual_seed(seed)
+        return generator.manual_seed(int(seed))
+    generator.seed()
+    return generator
+
+def _run_batch(pipe, requests, device, num_inference_steps, height, width, refine=None):
+    """Run a batch of requests on an already loaded pipeline"""
+    is_sdxl = isinstance(pipe, StableDiffusionXLPipeline)
+    # Draft-then-refine only pays off when the output is larger than the draft
+    refining = refine is not None and draft_size(height, width, refine.base_size) is not None
+    
+    prompts = [r["prompt"] for r in requests]
+    negative_prompts = [r.get("negative_prompt") for r in requests]
+    if all(n is None for n in negative_prompts):
+        negative_prompts = None
     else:
+        negative_prompts = [n or "" for n in negative_prompts]
+    guidance_scales = [float(r.get("guidance_scale", 7.5)) for r in requests]
+    seeds = [r.get("seed") for r in requests]
+    
+    # Set seeds if provided; each request gets its own generator so results
+    # don't depend on which other requests share the batch
+    if all(seed is None for seed in seeds):
         generator = None
+    else:
+        generator = [_make_generator(seed, device) for seed in seeds]
     
-    print(f"\nGenerating image for prompt: '{prompt}'...")
-    print(f"Steps: {num_inference_steps}, Guidance: {guidance_scale}, Size: {width}x{height}")
+    # Progress counts the draft and refine steps as one run
+    callback, callback_errors = _batch_step_callback(
+        requests, num_inference_steps, [refine_steps(refine, num_inference_steps)] if refining else ()
+    )
+    timers = [r.get("timer") for r in requests]
+    clock = StepClock(timers)
     
-    # Generate image
+    # Generate images
     try:
-        with torch.autocast(device) if device == "cuda" else torch.no_grad():
-            if is_sdxl:
+        with default_cpu_profile.inference_context(device):
+            if len(set(guidance_scales)) > 1 and (is_sdxl or _uses_guidance_embedding(pipe) or refining):
+                # SDXL, LCM-distilled models and refined batches: run each guidance scale as its own sub-batch
+                return _run_grouped_by_guidance(
+                    pipe, requests, device, num_inference_steps, height, width, refine
+                )
+            if not is_sdxl:
+                # Reuse cached text-encoder outputs (SDXL also needs pooled embeddings)
+                prompt_embeds, negative_prompt_embeds = _encode_prompts(
+                    pipe, prompts, negative_prompts, timers
+                )
+            BATCH_SIZE.observe(len(requests))
+            clock.start()
+            if refining:
+                if is_sdxl:
+                    prompt_kwargs = {"prompt": prompts, "negative_prompt": negative_prompts}
+                else:
+                    prompt_kwargs = {"prompt_embeds": prompt_embeds, "negative_prompt_embeds": negative_prompt_embeds}
+                images = draft_then_refine(
+                    pipe,
+                    prompt_kwargs,
+                    guidance_scales[0],
+                    generator,
+                    num_inference_steps=num_inference_steps,
+                    height=height,
+                    width=width,
+                    settings=refine,
+                    callback=clock.wrap(callback),
+                )
+            elif len(set(guidance_scales)) > 1:
+                images = _run_mixed_guidance(
+                    pipe,
+                    prompt_embeds,
+                    negative_prompt_embeds,
+                    guidance_scales,
+                    generator,
+                    num_inference_steps=num_inference_steps,
+                    height=height,
+                    width=width,
+                    callback=clock.wrap(callback),
+                )
+            elif is_sdxl:
                 # SDXL uses different parameters
-                image = pipe(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
+                images = pipe(
+                    prompt=prompts,
+                    negative_prompt=negative_prompts,
                     num_inference_steps=num_inference_steps,
-                    guidance_scale=guidance_scale,
+                    guidance_scale=guidance_scales[0],
                     height=height,
                     width=width,
                     generator=generator,
-                ).images[0]
+                    callback_on_step_end=clock.wrap(callback),
+                ).images
             else:
-                image = pipe(
-                    prompt,
-                    negative_prompt=negative_prompt,
+                images = pipe(
+                    prompt_embeds=prompt_embeds,
+                    negative_prompt_embeds=negative_prompt_embeds,
                     num_inference_steps=num_inference_steps,
-                    guidance_scale=guidance_scale,
+                    guidance_scale=guidance_scales[0],
                     height=height,
                     width=width,
                     generator=generator,
-                ).images[0]
+                    callback_on_step_end=clock.wrap(callback),
+                ).images
+            clock.finish()
     except Exception as e:
         print(f"Error during generation: {e}")
         raise
     
-    # Create output directory
-    os.makedirs(output_path, exist_ok=True)
+    # Requests whose callback raised get the exception instead of an image
+    return [error if error is not None else image for image, error in zip(images, callback_errors)]
+
+def _encode_prompts(pipe, prompts, negative_prompts, timers=()):
+    """Prompt and negative prompt embeddings from the text-encoder cache"""
+    prompt_embeds = default_prompt_cache.encode(pipe, prompts, timers)
+    if negative_prompts is None:
+        negative_prompt_embeds = default_prompt_cache.unconditional(pipe, len(prompts))
+    else:
+        negative_prompt_embeds = default_prompt_cache.encode(pipe, negative_prompts, timers)
+    return prompt_embeds, negative_prompt_embeds
+
+def _batch_step_callback(requests, num_inference_steps, later_steps=()):
+    """
+    Build a callback_on_step_end that fans out to each request's step_callback
     
-    # Save image
-    import time
-    timestamp = int(time.time())
-    filename = f"generated_{timestamp}.png"
-    filepath = os.path.join(output_path, filename)
-    image.save(filepath)
+    A request whose callback raises stops receiving updates and its error is
+    recorded; the run is only aborted once every request in the batch has failed.
     
-    print(f"✅ Image saved to {filepath}")
+    Args:
+        later_steps: Expected step counts of further pipeline calls that share
+            the callback (draft then refine); steps are numbered across all calls
+    
+    Returns:
+        (callback or None, list of per-request errors filled in during the run)
+    """
+    callbacks = [r.get("step_callback") for r in requests]
+    errors = [None] * len(requests)
+    if all(cb is None for cb in callbacks):
+        return None, errors
+    calls = {"pipe": None, "offset": 0, "done": 0, "later": list(later_steps)}
+    
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        latents = callback_kwargs.get("latents")
+        total = getattr(pipe, "_num_timesteps", None) or num_inference_steps
+        if calls["pipe"] is not pipe:
+            # The next pipeline call has started
+            if calls["pipe"] is not None:
+                calls["offset"] = calls["done"]
+                calls["later"] = calls["later"][1:]
+            calls["pipe"] = pipe
+        step += calls["offset"]
+        total += calls["offset"] + sum(calls["later"])
+        calls["done"] = step + 1
+        for index, step_callback in enumerate(callbacks):
+            if step_callback is None or errors[index] is not None:
+                continue
+            try:
+                step_callback(step + 1, total, latents[index:index + 1] if latents is not None else None)
+            except Exception as e:
+                errors[index] = e
+        if all(error is not None for error in errors):
+            raise errors[0]
+        return callback_kwargs
     
-    return image
+    return on_step_end, errors
+
+def _uses_guidance_embedding(pipe):
+    """LCM-distilled UNets take the guidance scale as an input instead of using CFG"""
+    return getattr(pipe.unet.config, "time_cond_proj_dim", None) is not None
+
+def _run_grouped_by_guidance(pipe, requests, device, num_inference_steps, height, width, refine=None):
+    images = [None] * len(requests)
+    groups = {}
+    for index, request in enumerate(requests):
+        groups.setdefault(float(request.get("guidance_scale", 7.5)), []).append(index)
+    for indices in groups.values():
+        group_images = _run_batch(
+            pipe, [requests[i] for i in indices], device, num_inference_steps, height, width, refine
+        )
+        for index, image in zip(indices, group_images):
+            images[index] = image
+    return images
+
+def _run_mixed_guidance(
+    pipe,
+    prompt_embeds,
+    negative_prompt_embeds,
+    guidance_scales,
+    generator,
+    num_inference_steps,
+    height,
+    width,
+    callback=None,
+):
+    """
+    Denoising loop for a batch whose requests use different guidance scales
+    
+    The stock pipeline only takes one guidance scale, so this mirrors its loop
+    and applies classifier-free guidance with a per-sample scale.
+    """
+    device = pipe._execution_device
+    batch_size = prompt_embeds.shape[0]
+    prompt_embeds = torch.cat([negative_prompt_embeds, prompt_embeds])
+    
+    pipe.scheduler.set_timesteps(num_inference_steps, device=device)
+    latents = pipe.prepare_latents(
+        batch_size,
+        pipe.unet.config.in_channels,
+        height,
+        width,
+        prompt_embeds.dtype,
+        device,
+        generator,
+    )
+    extra_step_kwargs = pipe.prepare_extra_step_kwargs(generator, 0.0)
+    scales = torch.tensor(guidance_scales, device=device, dtype=latents.dtype).view(-1, 1, 1, 1)
+    
+    for i, t in enumerate(pipe.progress_bar(pipe.scheduler.timesteps)):
+        latent_model_input = pipe.scheduler.scale_model_input(torch.cat([latents] * 2), t)
+        noise_pred = pipe.unet(latent_model_input, t, encoder_hidden_states=prompt_embeds).sample
+        noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+        noise_pred = noise_pred_uncond + scales * (noise_pred_text - noise_pred_uncond)
+        latents = pipe.scheduler.step(noise_pred, t, latents, **extra_step_kwargs).prev_sample
+        if callback is not None:
+            callback(pipe, i, t, {"latents": latents})
+    
+    image = pipe.vae.decode(latents / pipe.vae.config.scaling_factor, return_dict=False)[0]
+    return pipe.image_processor.postprocess(image, output_type="pil")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate images from text using Hugging Face models")
@@ -158,27 +632,64 @@ if __name__ == "__main__":
     parser.add_argument("--model_path", type=str, default=None, 
                        help="Local path to model directory")
     parser.add_argument("--output_path", type=str, default="./outputs", help="Output directory")
-    parser.add_argument("--steps", type=int, default=50, help="Number of inference steps")
-    parser.add_argument("--guidance", type=float, default=7.5, help="Guidance scale")
+    parser.add_argument("--steps", type=int, default=None, help="Number of inference steps (default: 50)")
+    parser.add_argument("--guidance", type=float, default=None, help="Guidance scale (default: 7.5)")
     parser.add_argument("--height", type=int, default=512, help="Image height")
     parser.add_argument("--width", type=int, default=512, help="Image width")
     parser.add_argument("--seed", type=int, default=None, help="Random seed")
     parser.add_argument("--negative_prompt", type=str, default=None, 
                        help="Negative prompt to avoid certain features")
+    parser.add_argument("--scheduler", type=str, default=None,
+                       help="Sampler: dpmpp, dpmpp-karras, unipc, euler-a, euler, ddim or lcm")
+    parser.add_argument("--preset", type=str, default=None, choices=["draft", "standard", "final"],
+                       help="Quality preset (sets scheduler, steps and guidance unless given explicitly)")
+    parser.add_argument("--vae-mode", type=str, default="auto", choices=VAE_MODES,
+                       help="VAE decode: full, tiled (bounded memory), tiny (TAESD) or auto")
+    parser.add_argument("--num_images", type=int, default=1,
+                       help="Candidates to generate in one batched pass (seeds seed, seed+1, ...)")
+    parser.add_argument("--refine", action="store_true",
+                       help="Draft at --refine-base-size, upscale the latents and refine at the full size")
+    parser.add_argument("--refine-base-size", type=int, default=None, help="Longest side of the draft")
+    parser.add_argument("--refine-strength", type=float, default=None, help="Share of the schedule re-run (0-1]")
+    parser.add_argument("--refine-steps", type=int, default=None, help="Steps at the full size")
     
     args = parser.parse_args()
     
+    steps, guidance, scheduler = args.steps, args.guidance, args.scheduler
+    if args.preset:
+        # Values given on the command line win over the preset's
+        preset = quality_preset(args.preset, lcm=lcm_available(resolve_model(args.model_id, args.model_path)))
+        steps = steps if steps is not None else preset["steps"]
+        guidance = guidance if guidance is not None else preset.get("guidance_scale")
+        scheduler = scheduler or preset["scheduler"]
+    steps = steps if steps is not None else 50
+    guidance = guidance if guidance is not None else 7.5
+    
+    refine = None
+    if args.refine:
+        refine = resolve_refine({
+            name: value for name, value in (
+                ("base_size", args.refine_base_size),
+                ("strength", args.refine_strength),
+                ("steps", args.refine_steps),
+            ) if value is not None
+        })
+    
     generate_image(
         prompt=args.prompt,
         model_id=args.model_id,
         model_path=args.model_path,
         output_path=args.output_path,
-        num_inference_steps=args.steps,
-        guidance_scale=args.guidance,
+        num_inference_steps=steps,
+        guidance_scale=guidance,
         height=args.height,
         width=args.width,
         seed=args.seed,
         negative_prompt=args.negative_prompt,
+        scheduler=scheduler,
+        vae_mode=args.vae_mode,
+        refine=refine,
+        num_images=args.num_images,
     )
 
 
@@ -0,0 +1,210 @@
+"""
+Asynchronous generation jobs drained by a fixed pool of worker threads
+Decouples HTTP concurrency (many short poll requests) from model concurrency
+"""
+import queue
+import threading
+import time
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+EXPIRED = "expired"
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED, EXPIRED)
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at its configured depth"""
+
+
+class JobCancelled(Exception):
+    """Raised from a progress callback to stop a cancelled job"""
+
+
+class Job:
+    """A queued or running generation and its progress/result"""
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = QUEUED
+        self.step = 0
+        self.total_steps = params.get("steps")
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def report_progress(self, step, total_steps, latents=None):
+        """
+        Progress callback for the pipeline
+
+        Raises JobCancelled once the job has been cancelled, which stops the
+        denoising loop and frees the worker.
+        """
+        self.step = step
+        self.total_steps = total_steps
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.id)
+
+    def to_dict(self):
+        progress = 0.0
+        if self.status == SUCCEEDED:
+            progress = 1.0
+        elif self.total_steps:
+            progress = min(self.step / self.total_steps, 1.0)
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": round(progress, 3),
+            "step": self.step,
+            "total_steps": self.total_steps,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Bounded job queue with a fixed-size worker pool
+
+    run_job(job) is called on a worker thread and returns the job result
+    (a JSON-serialisable dict). Finished jobs are kept for ttl_seconds; jobs
+    still queued after ttl_seconds expire without running. Only jobs still
+    waiting count toward max_queue: a job cancelled or expired while queued
+    frees its slot at once, though workers skip its queue entry later.
+    """
+
+    def __init__(self, run_job, num_workers=1, max_queue=16, ttl_seconds=3600):
+        """
+        Args:
+            run_job: Callable(job) returning the job result
+            num_workers: Number of generation worker threads
+            max_queue: Maximum number of queued (not yet running) jobs
+            ttl_seconds: How long jobs are kept before they expire
+        """
+        self.run_job = run_job
+        self.ttl_seconds = ttl_seconds
+        self.max_queue = max_queue
+        self._queue = queue.Queue()
+        self._waiting = 0  # jobs still QUEUED
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._workers = []
+        for index in range(max(1, int(num_workers))):
+            worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, params):
+        """
+        Enqueue a job
+
+        Raises:
+            QueueFullError: If max_queue jobs are already waiting
+        """
+        self._expire_old_jobs()
+        job = Job(params)
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                raise QueueFullError("Job queue is full, try again later")
+            self._jobs[job.id] = job
+            self._waiting += 1
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        self._expire_old_jobs()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job
+
+        Returns:
+            The job, or None if it does not exist
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == QUEUED:
+                self._finish(job, CANCELLED)
+        job.cancel_event.set()
+        return job
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "queued": self._waiting,
+            "max_queue": self.max_queue,
+            "workers": len(self._workers),
+            "jobs": counts,
+        }
+
+    def _finish(self, job, status, result=None, error=None):
+        # Caller holds self._lock
+        if job.status == QUEUED:
+            self._waiting -= 1
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+
+    def _expire_old_jobs(self):
+        now = time.time()
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.finished and job.finished_at < now - self.ttl_seconds:
+                    del self._jobs[job_id]
+                elif job.status == QUEUED and job.created_at < now - self.ttl_seconds:
+                    self._finish(job, EXPIRED, error="Job expired before it could run")
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                with self._lock:
+                    if job.status != QUEUED:
+                        # Cancelled or expired while waiting
+                        continue
+                    if job.created_at < time.time() - self.ttl_seconds:
+                        self._finish(job, EXPIRED, error="Job expired before it could run")
+                        continue
+                    job.status = RUNNING
+                    self._waiting -= 1
+                    job.started_at = time.time()
+
+                try:
+                    result = self.run_job(job)
+                except JobCancelled:
+                    with self._lock:
+                        self._finish(job, CANCELLED)
+                except Exception as e:
+                    with self._lock:
+                        self._finish(job, FAILED, error=str(e))
+                else:
+                    with self._lock:
+                        if job.cancel_event.is_set():
+                            self._finish(job, CANCELLED)
+                        else:
+                            self._finish(job, SUCCEEDED, result=result)
+            finally:
+                self._queue.task_done()
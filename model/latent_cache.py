@@ -0,0 +1,579 @@
+"""
+Sharded on-disk cache of VAE latents and captions for training
+preprocess_dataset streams fixed-size shards to disk next to a manifest of the
+shards written so far, so memory stays flat and an interrupted run resumes
+after the last complete shard. train_model reads the shards directly.
+
+The manifest header records what the latents were made from: the VAE (a hash
+of its config and weights, and its scaling factor), the resolution, the
+stored dtype (float32, or float16 for half the disk and memory), the dataset
+(name and Hugging Face fingerprint) and the item count. Every shard file is
+listed with its size and sha256. load_latent_cache refuses a cache that
+doesn't match the run or fails its checksums (CacheMismatchError) instead of
+training on the wrong latents. Captions are kept in a binary string table
+(write_strings / read_strings), not a pickle.
+
+Latents are stored as plain .npy arrays and memory-mapped when read: opening
+a cache doesn't load it, and DataLoader workers share the page cache instead
+of each holding a copy. Compare peak memory across worker counts with:
+    python latent_cache.py --cache_dir ./data/cached_latents --workers 0 2 4
+
+Captions can also be cached as token ids and, optionally, frozen text-encoder
+hidden states in fp16 (build_text_cache), so training skips both. These are
+tied to fingerprints of the tokenizer and text encoder and ignored (and
+rebuilt by preprocess_dataset) when either changes.
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 3  # 1: torch.save shards, 2: JSON captions and no header
+DEFAULT_SHARD_SIZE = 1024  # items per shard (~64 MB of 512px SD latents in fp32)
+LATENT_DTYPES = {"float32": torch.float32, "float16": torch.float16}
+STRINGS_MAGIC = b"T2ISTR01"
+
+
+class CacheMismatchError(ValueError):
+    """Raised when a latent cache can't be used as is; preprocess_dataset.py rebuilds it"""
+
+
+def shard_name(index):
+    return f"shard-{index:05d}"
+
+
+def read_manifest(cache_dir):
+    """The cache manifest, or None when there isn't one"""
+    try:
+        with open(os.path.join(cache_dir, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(cache_dir, manifest):
+    # Written to a temporary file and renamed, so a crash never leaves a torn manifest
+    path = os.path.join(cache_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def vae_identity(pretrained_model_name_or_path):
+    """
+    What the cached latents depend on in a pipeline's VAE
+
+    Returns:
+        {"model", "fingerprint", "scaling_factor"}; fingerprint is a hash of
+        the VAE config and weight files, scaling_factor comes from its config.
+        Both are None when the model isn't available locally.
+    """
+    from shared_weights import local_model_dir, weight_files
+
+    identity = {"model": pretrained_model_name_or_path, "fingerprint": None, "scaling_factor": None}
+    model_dir = local_model_dir(pretrained_model_name_or_path)
+    vae_dir = os.path.join(model_dir, "vae") if model_dir else None
+    if vae_dir is None or not os.path.exists(os.path.join(vae_dir, "config.json")):
+        return identity
+    with open(os.path.join(vae_dir, "config.json")) as f:
+        config = json.load(f)
+    # The files from_pretrained loads: plain safetensors, else the .bin
+    files = weight_files(vae_dir) or sorted(
+        os.path.join(vae_dir, name) for name in os.listdir(vae_dir) if name.endswith(".bin")
+    )
+    digest = hashlib.sha256(json.dumps(
+        {key: value for key, value in config.items() if not key.startswith("_")}, sort_keys=True
+    ).encode("utf-8"))
+    for path in files:
+        digest.update(file_sha256(path).encode("utf-8"))
+    identity["fingerprint"] = digest.hexdigest()[:16]
+    identity["scaling_factor"] = config.get("scaling_factor", 0.18215)
+    return identity
+
+
+def cache_header(dataset_name, dataset, pretrained_model_name_or_path, resolution):
+    """
+    Header describing the latents of a dataset, as written by preprocess_dataset
+    and expected by train_model (see check_header)
+
+    Args:
+        dataset_name: Hugging Face dataset name
+        dataset: The loaded dataset (for its fingerprint and length)
+        pretrained_model_name_or_path: Pipeline whose VAE encodes the images
+        resolution: Image resolution
+    """
+    return {
+        "vae": vae_identity(pretrained_model_name_or_path),
+        "resolution": resolution,
+        "dataset": {"name": dataset_name, "fingerprint": getattr(dataset, "_fingerprint", None)},
+        "num_items": len(dataset),
+    }
+
+
+def check_header(header, expected):
+    """
+    Raise CacheMismatchError listing every way a cache header differs from
+    the expected one (see cache_header). Fingerprints that couldn't be
+    computed on either side fall back to comparing names.
+    """
+    problems = []
+    vae, expected_vae = header["vae"], expected["vae"]
+    if vae["fingerprint"] and expected_vae["fingerprint"]:
+        if vae["fingerprint"] != expected_vae["fingerprint"]:
+            problems.append(f"VAE weights differ (cache: {vae['model']}, run: {expected_vae['model']})")
+    elif vae["model"] != expected_vae["model"]:
+        problems.append(f"VAE from {vae['model']}, run uses {expected_vae['model']}")
+    if vae["scaling_factor"] and expected_vae["scaling_factor"] and vae["scaling_factor"] != expected_vae["scaling_factor"]:
+        problems.append(f"scaling factor {vae['scaling_factor']}, run uses {expected_vae['scaling_factor']}")
+    if header["resolution"] != expected["resolution"]:
+        problems.append(f"resolution {header['resolution']}, run uses {expected['resolution']}")
+    dataset, expected_dataset = header["dataset"], expected["dataset"]
+    if dataset["name"] != expected_dataset["name"]:
+        problems.append(f"dataset {dataset['name']}, run uses {expected_dataset['name']}")
+    elif dataset["fingerprint"] and expected_dataset["fingerprint"] and dataset["fingerprint"] != expected_dataset["fingerprint"]:
+        problems.append("dataset revision differs (fingerprint "
+                        f"{dataset['fingerprint']}, run has {expected_dataset['fingerprint']})")
+    if header["num_items"] != expected["num_items"]:
+        problems.append(f"{header['num_items']} items, dataset has {expected['num_items']}")
+    if problems:
+        raise CacheMismatchError("Latent cache doesn't match this run: " + "; ".join(problems)
+                                 + ". Run preprocess_dataset.py again to rebuild it")
+
+
+def write_strings(path, strings):
+    """
+    Write strings as a table: magic, uint64 count, count + 1 uint64 offsets
+    into the UTF-8 data that follows (little-endian)
+    """
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    with open(path + ".tmp", "wb") as f:
+        f.write(STRINGS_MAGIC)
+        f.write(np.uint64(len(encoded)).astype("<u8").tobytes())
+        f.write(offsets.tobytes())
+        f.write(b"".join(encoded))
+    os.replace(path + ".tmp", path)
+
+
+def read_strings(path):
+    """Strings of a table written by write_strings"""
+    with open(path, "rb") as f:
+        data = f.read()
+    header = len(STRINGS_MAGIC) + 8
+    if data[:len(STRINGS_MAGIC)] != STRINGS_MAGIC or len(data) < header:
+        raise CacheMismatchError(f"{path} is not a string table")
+    count = int(np.frombuffer(data, dtype="<u8", count=1, offset=len(STRINGS_MAGIC))[0])
+    offsets = np.frombuffer(data, dtype="<u8", count=count + 1, offset=header).tolist()
+    blob = memoryview(data)[header + 8 * (count + 1):]
+    if offsets[-1] != len(blob):
+        raise CacheMismatchError(f"{path} is truncated")
+    return [str(blob[offsets[i]:offsets[i + 1]], "utf-8") for i in range(count)]
+
+
+class ShardWriter:
+    """
+    Streams latents and captions to fixed-size shards
+
+    Each full shard is written (atomically) before the manifest is updated to
+    include it, so the manifest only ever lists complete shards. Opening a
+    cache whose manifest was written with the same header resumes after its
+    last shard; any other cache in the directory is replaced.
+    """
+
+    def __init__(self, cache_dir, header, shard_size=DEFAULT_SHARD_SIZE, dtype="float32"):
+        """
+        Args:
+            cache_dir: Directory holding the shards and manifest
+            header: What is being encoded (see cache_header); a cache made
+                with a different header is not resumed
+            shard_size: Items per shard
+            dtype: Stored latent dtype, "float32" or "float16"
+        """
+        if dtype not in LATENT_DTYPES:
+            raise ValueError(f"Unknown latent dtype '{dtype}' (choose {' or '.join(LATENT_DTYPES)})")
+        self.cache_dir = cache_dir
+        self.shard_size = shard_size
+        self.dtype = LATENT_DTYPES[dtype]
+        header = {**header, "dtype": dtype}
+        os.makedirs(cache_dir, exist_ok=True)
+
+        manifest = read_manifest(cache_dir)
+        if (manifest is not None and manifest.get("version") == FORMAT_VERSION
+                and manifest.get("header") == header and manifest.get("shard_size") == shard_size):
+            self.manifest = manifest
+        else:
+            if manifest is not None:
+                print(f"Existing cache in {cache_dir} was built with different settings; starting over")
+            self.manifest = {
+                "version": FORMAT_VERSION,
+                "header": header,
+                "shard_size": shard_size,
+                "shards": [],
+                "num_items": 0,
+                "complete": False,
+            }
+            self._remove_stale_shards()
+            _write_manifest(cache_dir, self.manifest)
+        self._latents = []
+        self._texts = []
+
+    @property
+    def completed(self):
+        """Items already in written shards (where a resumed run starts)"""
+        return self.manifest["num_items"]
+
+    @property
+    def complete(self):
+        return self.manifest["complete"]
+
+    def add(self, latents, texts):
+        """Queue a batch; full shards are written as soon as they fill up"""
+        self._latents.append(latents.to("cpu", self.dtype))
+        self._texts.extend(texts)
+        while len(self._texts) >= self.shard_size:
+            self._write_shard(self.shard_size)
+
+    def close(self):
+        """Write the last partial shard and mark the cache complete"""
+        if self._texts:
+            self._write_shard(len(self._texts))
+        self.manifest["complete"] = True
+        _write_manifest(self.cache_dir, self.manifest)
+
+    def _write_shard(self, count):
+        pending = torch.cat(self._latents) if len(self._latents) > 1 else self._latents[0]
+        latents, rest = pending[:count], pending[count:]
+        texts, self._texts = self._texts[:count], self._texts[count:]
+        self._latents = [rest] if len(rest) else []
+
+        name = shard_name(len(self.manifest["shards"]))
+        path = os.path.join(self.cache_dir, name)
+        _save_array(path + ".npy", latents.numpy())
+        write_strings(path + ".strings", texts)
+
+        shard = {"latents": name + ".npy", "texts": name + ".strings", "count": count, "checksums": {}}
+        _add_checksum(self.cache_dir, shard, "latents")
+        _add_checksum(self.cache_dir, shard, "texts")
+        self.manifest["shards"].append(shard)
+        self.manifest["num_items"] += count
+        _write_manifest(self.cache_dir, self.manifest)
+
+    def _remove_stale_shards(self):
+        for name in os.listdir(self.cache_dir):
+            if name.startswith("shard-"):
+                os.remove(os.path.join(self.cache_dir, name))
+
+
+class LatentStore:
+    """
+    Latents of a sharded cache, memory-mapped and indexed without loading them
+
+    Shards are mapped on first access in each process. Pickling keeps only the
+    file paths, so DataLoader workers map the files themselves (with fork or
+    spawn) rather than receiving a copy of the data. Items are returned as
+    tensors over the mapping (copy-on-write), without copying.
+    """
+
+    def __init__(self, paths, counts, item_shape, dtype, as_dtype=None):
+        """
+        Args:
+            paths: .npy file per shard
+            counts: Items per shard
+            item_shape: Shape of one item
+            dtype: Stored dtype
+            as_dtype: Optional numpy dtype items are converted to (a copy), for
+                dtypes torch can't wrap such as uint16 token ids
+        """
+        self.paths = list(paths)
+        self._starts = []
+        total = 0
+        for count in counts:
+            self._starts.append(total)
+            total += count
+        self._len = total
+        self.item_shape = tuple(item_shape)
+        self.dtype = dtype
+        self.as_dtype = as_dtype
+        self._maps = [None] * len(self.paths)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError(idx)
+        shard = bisect.bisect_right(self._starts, idx) - 1
+        if self._maps[shard] is None:
+            self._maps[shard] = np.load(self.paths[shard], mmap_mode="c")
+        item = self._maps[shard][idx - self._starts[shard]]
+        if self.as_dtype is not None:
+            item = item.astype(self.as_dtype)
+        return torch.from_numpy(item)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_maps"] = [None] * len(self.paths)
+        return state
+
+    @property
+    def shape(self):
+        return (self._len, *self.item_shape)
+
+
+def load_latent_cache(cache_dir, expected=None, verify=True):
+    """
+    Read a latent cache written by preprocess_dataset
+
+    Args:
+        cache_dir: Cache directory
+        expected: Header the cache must match (see cache_header), or None
+        verify: Check the sha256 of every shard file (otherwise only sizes)
+
+    Returns:
+        (latents, texts), or None when the directory holds no cache at all
+
+    Raises:
+        CacheMismatchError: The cache is from an older format, incomplete,
+            made for other data or settings, or corrupt
+    """
+    manifest = read_manifest(cache_dir)
+    if manifest is None:
+        if os.path.exists(os.path.join(cache_dir, "latents.pt")):
+            raise CacheMismatchError(f"{cache_dir} holds a latents.pt / texts.pkl cache, which records nothing "
+                                     f"about how it was made; run preprocess_dataset.py again to rebuild it")
+        return None
+    if manifest.get("version") != FORMAT_VERSION:
+        raise CacheMismatchError(f"Cache in {cache_dir} was written by an older preprocess_dataset.py "
+                                 f"(format {manifest.get('version')}); run it again to rebuild")
+    if not manifest["complete"]:
+        raise CacheMismatchError(f"Cache in {cache_dir} is incomplete ({manifest['num_items']}/"
+                                 f"{manifest['header']['num_items']} items); run preprocess_dataset.py again to resume it")
+    if expected is not None:
+        check_header(manifest["header"], expected)
+    verify_shards(cache_dir, manifest, full=verify)
+
+    texts = []
+    for shard in manifest["shards"]:
+        texts.extend(read_strings(os.path.join(cache_dir, shard["texts"])))
+    if len(texts) != manifest["header"]["num_items"]:
+        raise CacheMismatchError(f"Cache in {cache_dir} holds {len(texts)} captions, "
+                                 f"its header says {manifest['header']['num_items']}")
+    return _open_store(cache_dir, manifest, "latents"), texts
+
+
+def verify_shards(cache_dir, manifest, full=True):
+    """
+    Check every file listed in the manifest against its recorded size and
+    (when full) sha256; raises CacheMismatchError naming the first bad file
+    """
+    for shard in manifest["shards"]:
+        for field, recorded in shard["checksums"].items():
+            path = os.path.join(cache_dir, shard[field])
+            if not os.path.exists(path):
+                raise CacheMismatchError(f"{path} is missing; run preprocess_dataset.py again to rebuild the cache")
+            if os.path.getsize(path) != recorded["size"] or (full and file_sha256(path) != recorded["sha256"]):
+                raise CacheMismatchError(f"{path} fails its checksum; run preprocess_dataset.py again to rebuild the cache")
+
+
+def _open_store(cache_dir, manifest, field, as_dtype=None):
+    paths = [os.path.join(cache_dir, shard[field]) for shard in manifest["shards"]]
+    # The header of the first shard gives the item shape and dtype; no data is read
+    first = np.load(paths[0], mmap_mode="r") if paths else np.zeros((0,), dtype=np.float32)
+    return LatentStore(paths, [shard["count"] for shard in manifest["shards"]], first.shape[1:], first.dtype, as_dtype)
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Hash of everything that decides a tokenizer's ids: vocabulary, merges, length and special tokens"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([
+        type(tokenizer).__name__,
+        tokenizer.model_max_length,
+        sorted(tokenizer.get_vocab().items()),
+        sorted(f"{pair[0]} {pair[1]} {rank}" for pair, rank in getattr(tokenizer, "bpe_ranks", {}).items()),
+        tokenizer.all_special_tokens,
+    ]).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def text_encoder_fingerprint(text_encoder):
+    """Hash of a text encoder's config and weights"""
+    digest = hashlib.sha256(text_encoder.config.to_json_string().encode("utf-8"))
+    for name, tensor in sorted(text_encoder.state_dict().items()):
+        digest.update(name.encode("utf-8"))
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _token_dtype(tokenizer):
+    return np.uint16 if len(tokenizer) <= 2 ** 16 else np.int32
+
+
+def build_text_cache(cache_dir, tokenizer, text_encoder=None, batch_size=32, device="cpu"):
+    """
+    Add token ids (and optionally fp16 text-encoder states) to a complete cache
+
+    Shards that already have them for the same tokenizer and text encoder are
+    skipped, so this resumes after an interruption; a different tokenizer or
+    encoder replaces them all. States are last_hidden_state, as used by
+    train_model.
+
+    Args:
+        cache_dir: Cache written by preprocess_dataset
+        tokenizer: CLIP tokenizer used for training
+        text_encoder: Frozen text encoder, or None to store token ids only
+        batch_size: Captions per text-encoder forward
+        device: Device for the text encoder
+    """
+    manifest = read_manifest(cache_dir)
+    text = {
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "max_length": tokenizer.model_max_length,
+        "text_encoder": text_encoder_fingerprint(text_encoder) if text_encoder is not None else None,
+    }
+    previous = manifest.get("text")
+    if previous is None or previous["tokenizer"] != text["tokenizer"] or previous["max_length"] != text["max_length"]:
+        # Ids (and states) from another tokenizer are useless
+        for shard in manifest["shards"]:
+            _drop(cache_dir, shard, "ids")
+            _drop(cache_dir, shard, "states")
+    elif text_encoder is None:
+        # Ids only this time; states already cached stay valid
+        text["text_encoder"] = previous["text_encoder"]
+    elif previous["text_encoder"] != text["text_encoder"]:
+        for shard in manifest["shards"]:
+            _drop(cache_dir, shard, "states")
+    manifest["text"] = text
+    _write_manifest(cache_dir, manifest)
+
+    for shard in manifest["shards"]:
+        if "ids" in shard and ("states" in shard or text_encoder is None):
+            continue
+        name = shard["latents"][:-len(".npy")]
+        texts = read_strings(os.path.join(cache_dir, shard["texts"]))
+        input_ids = tokenizer(
+            texts, padding="max_length", max_length=tokenizer.model_max_length, truncation=True, return_tensors="np"
+        ).input_ids
+        _save_array(os.path.join(cache_dir, name + ".ids.npy"), input_ids.astype(_token_dtype(tokenizer)))
+        shard["ids"] = name + ".ids.npy"
+        _add_checksum(cache_dir, shard, "ids")
+
+        if text_encoder is not None:
+            states = []
+            with torch.no_grad():
+                for i in range(0, len(texts), batch_size):
+                    batch = torch.from_numpy(input_ids[i:i + batch_size].astype(np.int64)).to(device)
+                    states.append(text_encoder(batch)[0].to("cpu", torch.float16).numpy())
+            _save_array(os.path.join(cache_dir, name + ".states.npy"), np.concatenate(states))
+            shard["states"] = name + ".states.npy"
+            _add_checksum(cache_dir, shard, "states")
+        _write_manifest(cache_dir, manifest)
+
+
+def _add_checksum(cache_dir, shard, field):
+    path = os.path.join(cache_dir, shard[field])
+    shard["checksums"][field] = {"size": os.path.getsize(path), "sha256": file_sha256(path)}
+
+
+def _drop(cache_dir, shard, field):
+    shard["checksums"].pop(field, None)
+    name = shard.pop(field, None)
+    if name is not None and os.path.exists(os.path.join(cache_dir, name)):
+        os.remove(os.path.join(cache_dir, name))
+
+
+def _save_array(path, array):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def load_text_cache(cache_dir, tokenizer, text_encoder=None):
+    """
+    Cached token ids and text-encoder states, if they match the given models
+
+    Args:
+        cache_dir: Cache written by preprocess_dataset
+        tokenizer: Tokenizer training will use
+        text_encoder: Text encoder training will use (None skips the states)
+
+    Returns:
+        (input_ids, encoder_hidden_states); either is None when not cached or
+        built with a different tokenizer / text encoder. input_ids items are
+        int64 tensors, states fp16 tensors.
+    """
+    manifest = read_manifest(cache_dir)
+    text = manifest.get("text") if manifest is not None and manifest.get("version") == FORMAT_VERSION else None
+    if text is None or not all("ids" in shard for shard in manifest["shards"]):
+        return None, None
+    if text["tokenizer"] != tokenizer_fingerprint(tokenizer) or text["max_length"] != tokenizer.model_max_length:
+        print(f"Cached token ids in {cache_dir} are from a different tokenizer; tokenizing on the fly")
+        return None, None
+    input_ids = _open_store(cache_dir, manifest, "ids", as_dtype=np.int64)
+
+    states = None
+    if text_encoder is not None and all("states" in shard for shard in manifest["shards"]):
+        if text["text_encoder"] == text_encoder_fingerprint(text_encoder):
+            states = _open_store(cache_dir, manifest, "states")
+        else:
+            print(f"Cached text-encoder states in {cache_dir} are from a different text encoder; encoding on the fly")
+    return input_ids, states
+
+
+def _worker_memory(batch):
+    """collate_fn reporting the memory of the process that built the batch"""
+    from shared_weights import memory_usage
+
+    return torch.stack(batch), os.getpid(), memory_usage()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read a latent cache through a DataLoader and report memory use")
+    parser.add_argument("--cache_dir", type=str, default="./data/cached_latents")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2])
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--verify", action="store_true", help="Also check the sha256 of every shard file")
+
+    args = parser.parse_args()
+
+    from shared_weights import memory_usage
+
+    start = time.perf_counter()
+    cache = load_latent_cache(args.cache_dir, verify=args.verify)
+    if cache is None:
+        raise SystemExit(f"No complete cache in {args.cache_dir}")
+    latents, texts = cache
+    print(f"Opened {len(texts)} cached latents {tuple(latents.shape)} in {time.perf_counter() - start:.3f}s")
+
+    for workers in args.workers:
+        loader = torch.utils.data.DataLoader(
+            latents, batch_size=args.batch_size, shuffle=True, num_workers=workers, collate_fn=_worker_memory
+        )
+        peaks = {}
+        start = time.perf_counter()
+        for _, pid, usage in loader:
+            peaks[pid] = {key: max(value, peaks.get(pid, {}).get(key, 0)) for key, value in usage.items()}
+        seconds = time.perf_counter() - start
+        main = memory_usage()
+        print(f"\n{workers} workers: one epoch in {seconds:.2f}s")
+        print(f"  main process: RSS {main.get('rss', 0) / 2 ** 20:.0f} MB, anonymous {main.get('anonymous', 0) / 2 ** 20:.0f} MB")
+        for pid, usage in sorted(peaks.items()):
+            if pid != os.getpid():
+                print(f"  worker {pid}: peak RSS {usage.get('rss', 0) / 2 ** 20:.0f} MB, "
+                      f"PSS {usage.get('pss', 0) / 2 ** 20:.0f} MB, anonymous {usage.get('anonymous', 0) / 2 ** 20:.0f} MB")
@@ -0,0 +1,362 @@
+"""
+HTTP load test for the text-to-image API
+Drives /generate, /generate/stream (JSON and SSE) and /generated/<filename>
+with a configurable concurrency, arrival rate and request mix, then reports
+latency percentiles, throughput and error rates per endpoint.
+
+Against a running server:
+    python load_test.py --url http://localhost:5001 --concurrency 8 --duration 60
+
+Against a stub backend started for the test (no weights loaded):
+    python load_test.py --spawn-stub --stub-step-ms 20 --concurrency 16 --rate 20
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MIX = "generate=0.6,stream=0.2,sse=0.1,fetch=0.1"
+
+
+def parse_mix(spec):
+    """
+    Parse "generate=0.6,stream=0.2,sse=0.1,fetch=0.1" into normalized weights
+
+    Kinds: generate (JSON), generate_image (binary via Accept), stream (base64
+    JSON), sse (Server-Sent Events) and fetch (GET an image URL returned earlier)
+    """
+    kinds = ("generate", "generate_image", "stream", "sse", "fetch")
+    weights = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in kinds:
+            raise ValueError(f"Unknown request kind: {name} (choose from {', '.join(kinds)})")
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    return {name: weight / total for name, weight in weights.items()}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(fraction * (len(values) - 1)))))
+    return values[index]
+
+
+class Stats:
+    """Latencies and outcomes per request kind"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.first_event = {}
+        self.errors = {}
+        self.bytes = {}
+        self.image_paths = []
+
+    def record(self, kind, latency, ok, size=0, first_event=None, error=None):
+        with self._lock:
+            if ok:
+                self.latencies.setdefault(kind, []).append(latency)
+                self.bytes[kind] = self.bytes.get(kind, 0) + size
+                if first_event is not None:
+                    self.first_event.setdefault(kind, []).append(first_event)
+            else:
+                self.errors.setdefault(kind, {})
+                self.errors[kind][error] = self.errors[kind].get(error, 0) + 1
+
+    def add_image_path(self, image_path):
+        with self._lock:
+            self.image_paths.append(image_path)
+            if len(self.image_paths) > 1000:
+                self.image_paths = self.image_paths[-1000:]
+
+    def random_image_path(self):
+        with self._lock:
+            return random.choice(self.image_paths) if self.image_paths else None
+
+    def report(self, elapsed):
+        rows = {}
+        with self._lock:
+            kinds = sorted(set(self.latencies) | set(self.errors))
+            for kind in kinds:
+                latencies = self.latencies.get(kind, [])
+                errors = sum(self.errors.get(kind, {}).values())
+                total = len(latencies) + errors
+                row = {
+                    "requests": total,
+                    "errors": errors,
+                    "error_rate": round(errors / total, 4) if total else 0.0,
+                    "throughput_rps": round(len(latencies) / elapsed, 3),
+                    "p50_ms": _ms(percentile(latencies, 0.50)),
+                    "p95_ms": _ms(percentile(latencies, 0.95)),
+                    "p99_ms": _ms(percentile(latencies, 0.99)),
+                    "mean_ms": _ms(sum(latencies) / len(latencies)) if latencies else None,
+                    "avg_bytes": round(self.bytes.get(kind, 0) / len(latencies)) if latencies else None,
+                    "error_types": dict(self.errors.get(kind, {})),
+                }
+                if kind in self.first_event:
+                    row["p50_first_event_ms"] = _ms(percentile(self.first_event[kind], 0.50))
+                    row["p95_first_event_ms"] = _ms(percentile(self.first_event[kind], 0.95))
+                rows[kind] = row
+            completed = sum(len(v) for v in self.latencies.values())
+            failed = sum(sum(v.values()) for v in self.errors.values())
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "requests": completed + failed,
+            "errors": failed,
+            "error_rate": round(failed / (completed + failed), 4) if completed + failed else 0.0,
+            "throughput_rps": round(completed / elapsed, 3),
+            "by_kind": rows,
+        }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class LoadTester:
+    """Issues requests of a random kind and records the outcome"""
+
+    def __init__(self, base_url, mix, body, timeout, stats):
+        self.base_url = base_url.rstrip("/")
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.body = body
+        self.timeout = timeout
+        self.stats = stats
+
+    def run_one(self, scheduled_at=None):
+        """
+        Send one request
+
+        Latency is measured from scheduled_at when given (open-loop mode), so
+        time spent waiting for a free client thread counts against the server
+        instead of being hidden.
+        """
+        kind = random.choices(self.kinds, self.weights)[0]
+        image_path = self.stats.random_image_path() if kind == "fetch" else None
+        if kind == "fetch" and image_path is None:
+            kind = "generate"
+        start = scheduled_at or time.perf_counter()
+        try:
+            size, first_event = self._send(kind, image_path, start)
+        except urllib.error.HTTPError as e:
+            self.stats.record(kind, 0, False, error=f"HTTP {e.code}")
+        except Exception as e:
+            self.stats.record(kind, 0, False, error=type(e).__name__)
+        else:
+            self.stats.record(kind, time.perf_counter() - start, True, size, first_event)
+
+    def _body(self):
+        body = dict(self.body)
+        if body.get("seed") == "random":
+            body["seed"] = random.randint(0, 2 ** 31 - 1)
+        return json.dumps(body).encode("utf-8")
+
+    def _post(self, path, accept):
+        return urllib.request.Request(
+            self.base_url + path,
+            data=self._body(),
+            headers={"Content-Type": "application/json", "Accept": accept},
+            method="POST",
+        )
+
+    def _send(self, kind, image_path, start):
+        if kind == "fetch":
+            with urllib.request.urlopen(self.base_url + image_path, timeout=self.timeout) as r:
+                return len(r.read()), None
+
+        if kind == "sse":
+            request = self._post("/generate/stream", "text/event-stream")
+            first_event = None
+            size = 0
+            event = None
+            with urllib.request.urlopen(request, timeout=self.timeout) as r:
+                for raw in r:
+                    size += len(raw)
+                    line = raw.decode("utf-8").rstrip("\n")
+                    if first_event is None and line.startswith("event:"):
+                        first_event = time.perf_counter() - start
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:") and event == "error":
+                        raise RuntimeError("SSE error event")
+                    elif line.startswith("data:") and event == "result":
+                        self._remember(json.loads(line[len("data:"):]))
+            if event != "result":
+                raise RuntimeError("SSE stream ended without a result")
+            return size, first_event
+
+        if kind == "generate_image":
+            request = self._post("/generate", "image/png")
+            with urllib.request.urlopen(request, timeout=self.timeout) as r:
+                data = r.read()
+                self._remember({"image_url": r.headers.get("X-Image-Url")})
+            return len(data), None
+
+        path = "/generate" if kind == "generate" else "/generate/stream"
+        with urllib.request.urlopen(self._post(path, "application/json"), timeout=self.timeout) as r:
+            data = r.read()
+        self._remember(json.loads(data))
+        return len(data), None
+
+    def _remember(self, payload):
+        image_url = payload.get("image_url")
+        if image_url and image_url.startswith("/generated/"):
+            self.stats.add_image_path(image_url)
+
+
+def run_closed_loop(tester, concurrency, duration, max_requests):
+    """concurrency clients, each sending its next request as soon as the last one finishes"""
+    deadline = time.perf_counter() + duration
+    sent = [0]
+    lock = threading.Lock()
+
+    def client():
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests and sent[0] >= max_requests:
+                    return
+                sent[0] += 1
+            tester.run_one()
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open_loop(tester, rate, concurrency, duration, max_requests):
+    """Poisson arrivals at `rate` requests/s, at most `concurrency` in flight"""
+    start = time.perf_counter()
+    next_arrival = start
+    sent = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while next_arrival < start + duration and (not max_requests or sent < max_requests):
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(tester.run_one, next_arrival)
+            sent += 1
+            next_arrival += random.expovariate(rate)
+
+
+def spawn_stub_server(args):
+    """Start api.py with the stub backend on a free port and wait until /ready"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(
+        os.environ,
+        GENERATOR_BACKEND="stub",
+        PORT=str(port),
+        STUB_STEP_MS=str(args.stub_step_ms),
+        STUB_IMAGE_MS=str(args.stub_image_ms),
+        STUB_COMPUTE_SIZE=str(args.stub_compute_size),
+        OUTPUT_DIR=args.stub_output_dir,
+    )
+    api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api.py")
+    process = subprocess.Popen(
+        [sys.executable, api_path], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            with urllib.request.urlopen(url + "/ready", timeout=1) as r:
+                if r.status == 200:
+                    return process, url
+        except Exception:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError("Stub server exited during startup")
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Stub server did not become ready")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the text-to-image API")
+    parser.add_argument("--url", type=str, default="http://localhost:5001", help="API base URL")
+    parser.add_argument("--concurrency", type=int, default=4, help="Clients (closed loop) or max in flight")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Arrival rate in requests/s (open loop); omit for closed loop")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to send requests for")
+    parser.add_argument("--requests", type=int, default=None, help="Stop after this many requests")
+    parser.add_argument("--mix", type=str, default=DEFAULT_MIX,
+                        help="Request mix, e.g. generate=0.6,stream=0.2,sse=0.1,fetch=0.1")
+    parser.add_argument("--prompt", type=str, default="a red cotton t-shirt")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--seed", type=str, default="random",
+                        help="'random' (cache misses), 'none' or a fixed integer (cache hits)")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-request timeout in seconds")
+    parser.add_argument("--json", type=str, default=None, help="Write the report to this JSON file")
+    parser.add_argument("--spawn-stub", action="store_true",
+                        help="Start api.py with GENERATOR_BACKEND=stub and test that")
+    parser.add_argument("--stub-step-ms", type=float, default=20)
+    parser.add_argument("--stub-image-ms", type=float, default=5)
+    parser.add_argument("--stub-compute-size", type=int, default=0)
+    parser.add_argument("--stub-output-dir", type=str, default="./outputs/load_test")
+
+    args = parser.parse_args()
+
+    body = {"prompt": args.prompt, "steps": args.steps, "height": args.size, "width": args.size}
+    if args.seed == "random":
+        body["seed"] = "random"
+    elif args.seed != "none":
+        body["seed"] = int(args.seed)
+
+    process = None
+    url = args.url
+    if args.spawn_stub:
+        process, url = spawn_stub_server(args)
+        print(f"Started stub server at {url}")
+
+    stats = Stats()
+    tester = LoadTester(url, parse_mix(args.mix), body, args.timeout, stats)
+    mode = f"open loop at {args.rate} req/s" if args.rate else "closed loop"
+    print(f"Load testing {url}: {mode}, concurrency {args.concurrency}, {args.duration}s, mix {args.mix}")
+
+    start = time.perf_counter()
+    try:
+        if args.rate:
+            run_open_loop(tester, args.rate, args.concurrency, args.duration, args.requests)
+        else:
+            run_closed_loop(tester, args.concurrency, args.duration, args.requests)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    report = stats.report(time.perf_counter() - start)
+    report["config"] = {
+        "url": url, "concurrency": args.concurrency, "rate": args.rate,
+        "duration": args.duration, "mix": args.mix, "body": body,
+    }
+
+    print(f"\n{'kind':15s} {'reqs':>6s} {'err%':>6s} {'rps':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s}")
+    for kind, row in report["by_kind"].items():
+        print(f"{kind:15s} {row['requests']:6d} {row['error_rate'] * 100:5.1f}% {row['throughput_rps']:7.2f} "
+              f"{row['p50_ms'] or 0:8.1f} {row['p95_ms'] or 0:8.1f} {row['p99_ms'] or 0:8.1f}")
+        if row["error_types"]:
+            print(f"{'':15s} errors: {row['error_types']}")
+    print(f"\nTotal: {report['requests']} requests, {report['throughput_rps']} req/s, "
+          f"{report['error_rate'] * 100:.1f}% errors")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.json}")
@@ -0,0 +1,376 @@
+"""
+Per-request memory planning
+Estimates the working memory a generation needs at its resolution and batch
+size, then picks the fastest attention, feed-forward and VAE settings that fit
+the memory budget. Slicing and chunking are only switched on when needed, so
+512px requests on a roomy host run at full speed.
+
+Print the plan for a few sizes without generating anything:
+    python memory_planner.py --model_path ./models/clothes-diffusion --sizes 512 768 1024 --batch 1 4
+"""
+import argparse
+import math
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import torch
+import torch.nn.functional as F
+
+from metrics import Counter, default_metrics
+from vae_decode import VAE_TILE_SIZE, effective_vae_mode, resolve_vae_mode, use_vae
+
+# Working-memory budget per generation (0 = MEMORY_BUDGET_FRACTION of the memory available when it starts)
+MEMORY_BUDGET_MB = float(os.getenv("MEMORY_BUDGET_MB", "0"))
+MEMORY_BUDGET_FRACTION = float(os.getenv("MEMORY_BUDGET_FRACTION", "0.8"))
+
+# Full-resolution feature maps alive at the decoder's peak, measured with bench_vae.py
+# (about 7.3 for the SD VAE at 512px in fp32; the tiny decoder about 4)
+VAE_DECODE_MAPS = 8
+TINY_DECODE_MAPS = 4
+
+# Relative slowdown of each option, used to order the candidates (from bench_vae.py and
+# bench_inference.py on CPU); only the order matters
+PENALTIES = {
+    "vae_slicing": 0.01,
+    "ff_chunking": 0.05,
+    "attention_slicing": 0.10,
+    "vae_tiling": 0.15,
+}
+
+MEMORY_PLANS = default_metrics.register(Counter(
+    "t2i_memory_plans_total", "Generations by chosen attention implementation and VAE decode",
+    ["attention", "vae"],
+))
+
+
+@dataclass
+class MemoryPlan:
+    """Settings chosen for one pipeline call and the estimates behind them"""
+    attention: str  # "sdpa", "sliced" or "full" (materialized scores, torch without SDPA)
+    attention_slice_size: int = None
+    ff_chunk_size: int = None
+    vae_mode: str = "full"
+    vae_slicing: bool = False
+    budget_bytes: int = 0
+    unet_bytes: int = 0
+    vae_bytes: int = 0
+    fits: bool = True
+    notes: list = field(default_factory=list)
+
+    def describe(self):
+        attention = self.attention + (f"({self.attention_slice_size})" if self.attention_slice_size else "")
+        parts = [
+            f"attention={attention}",
+            f"ff_chunk={self.ff_chunk_size or 'off'}",
+            f"vae={self.vae_mode}{'+sliced' if self.vae_slicing else ''}",
+            f"unet~{self.unet_bytes / 2 ** 20:.0f}MB",
+            f"vae~{self.vae_bytes / 2 ** 20:.0f}MB",
+            f"budget {self.budget_bytes / 2 ** 20:.1f}MB",
+        ]
+        if not self.fits:
+            parts.append("OVER BUDGET")
+        return ", ".join(parts + self.notes)
+
+
+def available_memory(device="cpu"):
+    """Bytes of memory free for new allocations (MemAvailable on the CPU, free VRAM on CUDA)"""
+    if device == "cuda" and torch.cuda.is_available():
+        free, _ = torch.cuda.mem_get_info()
+        return free
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError):
+        return 0
+
+
+def memory_budget(device="cpu"):
+    """Working-memory budget for one generation in bytes"""
+    if MEMORY_BUDGET_MB > 0:
+        return int(MEMORY_BUDGET_MB * 2 ** 20)
+    return int(available_memory(device) * MEMORY_BUDGET_FRACTION)
+
+
+def sdpa_available():
+    """Whether attention can use fused scaled_dot_product_attention (never materializes the scores)"""
+    return hasattr(F, "scaled_dot_product_attention")
+
+
+def _halve(size):
+    return (size + 1) // 2
+
+
+def _unet_levels(unet_config, height, width):
+    """(tokens, channels, heads, has attention) per UNet resolution level"""
+    channels = unet_config.block_out_channels
+    heads = unet_config.num_attention_heads or unet_config.attention_head_dim
+    if isinstance(heads, int):
+        heads = [heads] * len(channels)
+    h, w = height // 8, width // 8
+    levels = []
+    for index, block_type in enumerate(unet_config.down_block_types):
+        levels.append((h * w, channels[index], heads[index], "CrossAttn" in block_type))
+        h, w = _halve(h), _halve(w)
+    return levels
+
+
+def _transformer_tokens(unet_config, height, width):
+    """Sequence length of every transformer in the UNet: down blocks, mid block and up blocks"""
+    levels = _unet_levels(unet_config, height, width)
+    tokens = [t for t, _, _, attention in levels if attention]
+    if "CrossAttn" in (getattr(unet_config, "mid_block_type", None) or "UNetMidBlock2DCrossAttn"):
+        # The mid block runs at the last down block's resolution (it has no downsampler)
+        tokens.append(levels[-1][0])
+    for index, block_type in enumerate(unet_config.up_block_types):
+        # Up blocks mirror the down levels, restoring each skip's size
+        if "CrossAttn" in block_type:
+            tokens.append(levels[len(levels) - 1 - index][0])
+    return tokens
+
+
+def ff_chunk_size(unet_config, height, width):
+    """Largest token chunk dividing the sequence length of every transformer block"""
+    tokens = _transformer_tokens(unet_config, height, width)
+    if not tokens or math.gcd(*tokens) == max(tokens):
+        return None  # A single chunk would be the whole sequence
+    return math.gcd(*tokens)
+
+
+def estimate_unet_bytes(unet_config, batch, height, width, element_size,
+                        attention="sdpa", slice_size=None, ff_chunk=None):
+    """
+    Peak activation memory of one UNet call
+
+    Skip connections from every down block stay alive until the up path uses
+    them; on top of that come a few working tensors at the largest level, the
+    attention scores (unless fused) and the GEGLU feed-forward projection.
+
+    Args:
+        batch: Samples per UNet call (requests x 2 with classifier-free guidance)
+    """
+    levels = _unet_levels(unet_config, height, width)
+    layers = unet_config.layers_per_block
+    layers = layers[0] if isinstance(layers, (list, tuple)) else layers
+    skips = sum(tokens * channels * (layers + 1) for tokens, channels, _, _ in levels)
+    working = 4 * max(tokens * channels for tokens, channels, _, _ in levels)
+
+    attention_peak = 0
+    for tokens, channels, heads, has_attention in levels:
+        if not has_attention:
+            continue
+        if attention == "sdpa":
+            scores = 4 * tokens * channels  # q, k, v and output
+        elif attention == "sliced":
+            scores = 2 * slice_size * tokens * tokens / batch  # per-sample share of one slice
+        else:
+            scores = 2 * heads * tokens * tokens
+        feed_forward = 12 * (ff_chunk or tokens) * channels  # GEGLU projection (8C) and its output (4C)
+        attention_peak = max(attention_peak, scores + feed_forward)
+    return int(batch * (skips + working + attention_peak) * element_size)
+
+
+def estimate_vae_bytes(vae_config, images, height, width, element_size, mode="full", slicing=False,
+                       tile_size=VAE_TILE_SIZE):
+    """Peak memory of decoding a batch of latents"""
+    if mode == "tiny":
+        per_image = height * width * 64 * TINY_DECODE_MAPS
+    else:
+        pixels = min(height * width, tile_size * tile_size) if mode == "tiled" else height * width
+        per_image = pixels * vae_config.block_out_channels[0] * VAE_DECODE_MAPS
+        if mode == "tiled":
+            per_image += height * width * 3 * 2  # stitched output
+    return int(per_image * (1 if slicing else images) * element_size)
+
+
+def _min_heads(unet_config):
+    heads = unet_config.num_attention_heads or unet_config.attention_head_dim
+    return min(heads) if isinstance(heads, (list, tuple)) else heads
+
+
+def _attention_options(unet_config, fixed_attention):
+    """(attention, slice size, penalty) candidates, fastest first"""
+    if fixed_attention is not None:
+        # Chosen at load time (attention_slicing=True/False or a compiled UNet); plan around it.
+        # enable_attention_slicing() slices each layer into half its heads
+        return [("sliced", "auto", PENALTIES["attention_slicing"])] if fixed_attention else [
+            ("sdpa" if sdpa_available() else "full", None, 0.0)
+        ]
+    options = [("sdpa", None, 0.0)] if sdpa_available() else [("full", None, 0.0)]
+    smallest = _min_heads(unet_config)
+    # Slices are offered with SDPA too, as a fallback when its estimate doesn't fit;
+    # smaller slices use less memory and run slower
+    size = smallest // 2
+    while size >= 1:
+        options.append(("sliced", size, PENALTIES["attention_slicing"] * smallest / size))
+        size //= 2
+    return options
+
+
+def plan_memory(pipe, num_images, height, width, vae_mode=None, device="cpu", guidance=True, budget=None):
+    """
+    Pick the fastest settings whose estimated peak fits the budget
+
+    The UNet and the VAE never hold their activations at the same time, so
+    each is planned separately against the whole budget. When nothing fits,
+    the most frugal settings are used and the plan is marked over budget.
+
+    Args:
+        pipe: Loaded pipeline
+        num_images: Images generated in this call
+        height: Output height in pixels
+        width: Output width in pixels
+        vae_mode: Requested decode mode; "auto" may be tiled to fit the budget,
+            other modes are kept as requested
+        device: Inference device
+        guidance: Classifier-free guidance doubles the UNet batch
+        budget: Bytes available (default: memory_budget(device))
+
+    Returns:
+        MemoryPlan
+    """
+    budget = memory_budget(device) if budget is None else budget
+    element_size = torch.empty((), dtype=pipe.unet.dtype).element_size()
+    unet_config, vae_config = pipe.unet.config, pipe.vae.config
+    batch = num_images * (2 if guidance else 1)
+    fixed_attention = getattr(pipe, "_attention_slicing", None)
+    if getattr(pipe.unet, "_orig_mod", None) is not None:
+        # Switching attention processors would recompile the UNet
+        fixed_attention = bool(fixed_attention)
+
+    chunk = ff_chunk_size(unet_config, height, width)
+    unet_candidates = []
+    for attention, slice_size, penalty in _attention_options(unet_config, fixed_attention):
+        for ff_chunk in ([None, chunk] if chunk and fixed_attention is None else [None]):
+            estimate_slice = max(1, _min_heads(unet_config) // 2) if slice_size == "auto" else slice_size
+            needed = estimate_unet_bytes(
+                unet_config, batch, height, width, element_size, attention, estimate_slice, ff_chunk
+            )
+            cost = penalty + (PENALTIES["ff_chunking"] if ff_chunk else 0.0)
+            unet_candidates.append((cost, needed, attention, None if slice_size == "auto" else slice_size, ff_chunk))
+
+    requested = resolve_vae_mode(vae_mode)
+    mode = effective_vae_mode(requested, height, width)
+    vae_modes = [(mode, 0.0)]
+    if requested == "auto" and mode == "full":
+        vae_modes.append(("tiled", PENALTIES["vae_tiling"]))
+    vae_candidates = []
+    for candidate_mode, penalty in vae_modes:
+        for slicing in ([False, True] if num_images > 1 else [False]):
+            needed = estimate_vae_bytes(vae_config, num_images, height, width, element_size, candidate_mode, slicing)
+            cost = penalty + (PENALTIES["vae_slicing"] if slicing else 0.0)
+            vae_candidates.append((cost, needed, candidate_mode, slicing))
+
+    def pick(candidates):
+        fitting = [c for c in candidates if c[1] <= budget]
+        if fitting:
+            return min(fitting, key=lambda c: (c[0], c[1])), True
+        return min(candidates, key=lambda c: (c[1], c[0])), False
+
+    (_, unet_bytes, attention, slice_size, ff_chunk), unet_fits = pick(unet_candidates)
+    (_, vae_bytes, chosen_mode, vae_slicing), vae_fits = pick(vae_candidates)
+    plan = MemoryPlan(
+        attention=attention,
+        attention_slice_size=slice_size,
+        ff_chunk_size=ff_chunk,
+        vae_mode=chosen_mode,
+        vae_slicing=vae_slicing,
+        budget_bytes=budget,
+        unet_bytes=unet_bytes,
+        vae_bytes=vae_bytes,
+        fits=unet_fits and vae_fits,
+    )
+    if fixed_attention is not None:
+        plan.notes.append("attention fixed at load")
+    if chosen_mode != mode:
+        plan.notes.append("auto decode tiled to fit")
+    return plan
+
+
+def chunk_sizes(pipe, num_images, height, width, vae_mode=None, device="cpu", guidance=True):
+    """
+    Split a batch into pipeline calls that each fit the memory budget
+
+    Returns:
+        List of image counts per call, as even as possible (e.g. 5 -> [3, 2])
+    """
+    budget = memory_budget(device)
+    largest = 1
+    for count in range(num_images, 1, -1):
+        if plan_memory(pipe, count, height, width, vae_mode, device, guidance, budget=budget).fits:
+            largest = count
+            break
+    calls = math.ceil(num_images / largest)
+    return [num_images // calls + (1 if index < num_images % calls else 0) for index in range(calls)]
+
+
+def _set_feed_forward_chunking(unet, chunk_size):
+    for module in unet.modules():
+        if hasattr(module, "set_chunk_feed_forward"):
+            module.set_chunk_feed_forward(chunk_size, dim=1)
+
+
+def apply_plan(pipe, plan):
+    """
+    Switch the pipeline's attention and feed-forward settings to the plan's
+
+    Settings stay in place after the call; the next plan only changes what differs.
+    """
+    if getattr(pipe, "_attention_slicing", None) is None and getattr(pipe.unet, "_orig_mod", None) is None:
+        attention = (plan.attention, plan.attention_slice_size)
+        if getattr(pipe, "_planned_attention", None) != attention:
+            pipe.set_attention_slice(plan.attention_slice_size if plan.attention == "sliced" else None)
+            pipe._planned_attention = attention
+        if getattr(pipe, "_planned_ff_chunk", None) != plan.ff_chunk_size:
+            _set_feed_forward_chunking(pipe.unet, plan.ff_chunk_size)
+            pipe._planned_ff_chunk = plan.ff_chunk_size
+    if hasattr(pipe.vae, "enable_slicing"):
+        if plan.vae_slicing:
+            pipe.vae.enable_slicing()
+        else:
+            pipe.vae.disable_slicing()
+
+
+@contextmanager
+def use_memory_plan(pipe, num_images, height, width, vae_mode=None, device="cpu", guidance=True):
+    """
+    Plan, log and apply memory settings for one pipeline call, including the VAE decode mode
+
+    Yields:
+        The MemoryPlan in effect
+    """
+    plan = plan_memory(pipe, num_images, height, width, vae_mode, device, guidance)
+    print(f"Memory plan for {num_images}x {width}x{height}: {plan.describe()}")
+    MEMORY_PLANS.inc(attention=plan.attention, vae=plan.vae_mode + ("+sliced" if plan.vae_slicing else ""))
+    with use_vae(pipe, plan.vae_mode, height, width):
+        apply_plan(pipe, plan)
+        yield plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the memory plan for a model at several sizes")
+    parser.add_argument("--model_id", type=str, default=None, help="Hugging Face model ID")
+    parser.add_argument("--model_path", type=str, default=None, help="Local pipeline folder")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 768, 1024])
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--budget-mb", dest="budget_mb", type=float, default=None,
+                        help="Budget to plan for (default: MEMORY_BUDGET_MB or available memory)")
+    parser.add_argument("--vae-mode", dest="vae_mode", type=str, default="auto")
+
+    args = parser.parse_args()
+
+    from inference_hf_model import get_device_and_dtype, get_pipeline, resolve_model
+
+    device, dtype = get_device_and_dtype()
+    budget = int(args.budget_mb * 2 ** 20) if args.budget_mb else None
+    with get_pipeline(resolve_model(args.model_id, args.model_path), device, dtype) as pipe:
+        for size in args.sizes:
+            for batch in args.batch:
+                plan = plan_memory(pipe, batch, size, size, args.vae_mode, device, budget=budget)
+                print(f"{batch}x {size}x{size}: {plan.describe()}")
@@ -0,0 +1,266 @@
+"""
+Latency instrumentation for the generation path
+Counters, gauges and histograms rendered in the Prometheus text format, plus
+per-request stage timings that can be returned with a response
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers cache hits (milliseconds) up to cold model loads (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+STEP_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def _render_sample(self, key, value):
+        counts, total = value
+        lines = []
+        for bound, count in zip(self.buckets, counts):
+            labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together on /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+default_metrics = MetricsRegistry()
+
+REQUESTS = default_metrics.register(Counter(
+    "t2i_requests_total", "Generation API requests by endpoint and HTTP status", ["endpoint", "status"]
+))
+REQUEST_SECONDS = default_metrics.register(Histogram(
+    "t2i_request_seconds", "Time to produce a response, by endpoint", ["endpoint"]
+))
+IN_FLIGHT = default_metrics.register(Gauge(
+    "t2i_requests_in_flight", "Requests currently being handled, by endpoint", ["endpoint"]
+))
+STAGE_SECONDS = default_metrics.register(Histogram(
+    "t2i_stage_seconds", "Time spent per generation stage", ["stage"]
+))
+UNET_STEP_SECONDS = default_metrics.register(Histogram(
+    "t2i_unet_step_seconds", "Time per denoising step (one UNet call for the whole batch)",
+    buckets=STEP_BUCKETS,
+))
+QUEUE_WAIT_SECONDS = default_metrics.register(Histogram(
+    "t2i_queue_wait_seconds", "Time between a request being queued and starting", ["queue"]
+))
+BATCH_SIZE = default_metrics.register(Histogram(
+    "t2i_batch_size", "Requests per pipeline call", buckets=BATCH_SIZE_BUCKETS
+))
+QUEUE_DEPTH = default_metrics.register(Gauge(
+    "t2i_queue_depth", "Requests waiting in a queue (sampled at scrape time)", ["queue"]
+))
+
+
+class StageTimer:
+    """
+    Where the time went for one request
+
+    A batched pipeline call adds its stage durations to the timer of every
+    request in the batch.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.step_seconds = []
+        self.started_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_step(self, seconds):
+        with self._lock:
+            self.step_seconds.append(seconds)
+
+    def to_dict(self):
+        with self._lock:
+            steps = list(self.step_seconds)
+            breakdown = {
+                "total_ms": round((time.perf_counter() - self.started_at) * 1000, 2),
+                "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in self.stages.items()},
+                "unet_steps": len(steps),
+            }
+        if steps:
+            breakdown["unet_step_ms_avg"] = round(sum(steps) / len(steps) * 1000, 2)
+            breakdown["unet_step_ms_max"] = round(max(steps) * 1000, 2)
+        return breakdown
+
+    def server_timing(self):
+        """Value for a Server-Timing response header"""
+        with self._lock:
+            return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items())
+
+
+def record_stage(stage, seconds, timers=()):
+    """Observe a stage duration once and add it to each request's timer"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    for timer in timers:
+        if timer is not None:
+            timer.add(stage, seconds)
+
+
+@contextmanager
+def timed(stage, timers=()):
+    """Time a block as one stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, timers)
+
+
+class StepClock:
+    """
+    Times the denoising loop from callback_on_step_end
+
+    Each step is measured from the end of the previous one, excluding time
+    spent in the step callback itself (previews, progress). Whatever runs
+    after the last step until finish() is the VAE decode.
+    """
+
+    def __init__(self, timers=()):
+        self.timers = [timer for timer in timers if timer is not None]
+        self.denoise_seconds = 0.0
+        self.steps = 0
+        self._mark = None
+
+    def start(self):
+        self._mark = time.perf_counter()
+
+    def wrap(self, callback=None):
+        """Wrap a callback_on_step_end so every step is timed"""
+        def on_step_end(pipe, step, timestep, callback_kwargs):
+            seconds = time.perf_counter() - self._mark
+            self.steps += 1
+            self.denoise_seconds += seconds
+            UNET_STEP_SECONDS.observe(seconds)
+            for timer in self.timers:
+                timer.add_step(seconds)
+            try:
+                if callback is not None:
+                    return callback(pipe, step, timestep, callback_kwargs)
+                return callback_kwargs
+            finally:
+                self._mark = time.perf_counter()
+        return on_step_end
+
+    def finish(self):
+        """Record the denoise and decode stages once the pipeline has returned"""
+        if not self.steps:
+            return
+        record_stage("denoise", self.denoise_seconds, self.timers)
+        record_stage("vae_decode", time.perf_counter() - self._mark, self.timers)
@@ -0,0 +1,230 @@
+"""
+Process-wide registry of loaded diffusion pipelines
+Keeps pipelines resident between requests so weights are loaded once per process
+"""
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+# RAM budget for resident pipelines (0 or unset = unlimited)
+PIPELINE_CACHE_MAX_GB = float(os.getenv("PIPELINE_CACHE_MAX_GB", "0"))
+
+
+def pipeline_size_bytes(pipe):
+    """
+    Estimate the memory held by a pipeline's weights
+
+    Args:
+        pipe: Diffusers pipeline
+
+    Returns:
+        Size of all parameters and buffers in bytes
+    """
+    total = 0
+    components = getattr(pipe, "components", {}) or {}
+    for component in components.values():
+        if isinstance(component, torch.nn.Module):
+            for tensor in list(component.parameters()) + list(component.buffers()):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class PipelineEntry:
+    """A loaded pipeline plus the bookkeeping the registry needs"""
+
+    def __init__(self, key, pipe, size_bytes, load_seconds):
+        self.key = key
+        self.pipe = pipe
+        self.size_bytes = size_bytes
+        self.load_seconds = load_seconds
+        self.hits = 0
+        self.users = 0
+        self.last_used = time.time()
+        # Pipelines keep scheduler state between steps, so one caller at a time
+        self.lock = threading.RLock()
+
+
+class PipelineRegistry:
+    """
+    LRU cache of pipelines keyed by (model, pipeline class, dtype, device, options)
+
+    Entries that are in use are never evicted. When the resident size exceeds
+    max_bytes, the least-recently-used idle entries are dropped.
+    """
+
+    def __init__(self, max_bytes=None):
+        """
+        Args:
+            max_bytes: RAM budget for resident pipelines (None = unlimited)
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.cold_load_seconds = 0.0
+        self.warm_lookup_seconds = 0.0
+
+    def get(self, key, loader, pin=False):
+        """
+        Return the entry for key, loading it with loader() on a miss
+
+        Concurrent callers asking for the same key wait for a single load.
+        With pin, the entry's user count is raised in the same critical
+        section that finds or inserts it, so no other thread can evict it
+        before the caller uses it; the caller must decrement users after.
+        """
+        start = time.perf_counter()
+        entry = self._lookup(key, pin)
+        if entry is not None:
+            self._record_hit(entry, time.perf_counter() - start)
+            return entry
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Another thread may have finished loading while we waited
+            entry = self._lookup(key, pin)
+            if entry is not None:
+                self._record_hit(entry, time.perf_counter() - start)
+                return entry
+
+            load_start = time.perf_counter()
+            pipe = loader()
+            load_seconds = time.perf_counter() - load_start
+            entry = PipelineEntry(key, pipe, pipeline_size_bytes(pipe), load_seconds)
+            if pin:
+                entry.users += 1
+
+            with self._lock:
+                self.misses += 1
+                self.cold_load_seconds += load_seconds
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                self._evict_over_budget(keep=key)
+
+        print(f"Loaded pipeline in {load_seconds:.1f}s ({entry.size_bytes / 1024 ** 2:.0f} MB)")
+        return entry
+
+    @contextmanager
+    def acquire(self, key, loader):
+        """
+        Context manager yielding exclusive use of a pipeline
+
+        The entry is pinned (cannot be evicted) and locked for the duration.
+        """
+        entry = self.get(key, loader, pin=True)
+        try:
+            with entry.lock:
+                entry.last_used = time.time()
+                yield entry.pipe
+        finally:
+            with self._lock:
+                entry.users -= 1
+                self._evict_over_budget()
+
+    def evict(self, key):
+        """Drop a pipeline from the registry if it is idle"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.users > 0:
+                return False
+            self._remove(key)
+        self._release_memory()
+        return True
+
+    def clear(self):
+        """Drop every idle pipeline"""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e.users == 0]:
+                self._remove(key)
+        self._release_memory()
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(entry.size_bytes for entry in self._entries.values())
+
+    def stats(self):
+        """Hit/miss counters and cold-vs-warm timings"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_cold = self.cold_load_seconds / self.misses if self.misses else 0.0
+            avg_warm = self.warm_lookup_seconds / self.hits if self.hits else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "avg_cold_load_seconds": round(avg_cold, 3),
+                "avg_warm_lookup_ms": round(avg_warm * 1000, 3),
+                "estimated_seconds_saved": round(self.hits * max(avg_cold - avg_warm, 0.0), 1),
+                "resident_mb": round(sum(e.size_bytes for e in self._entries.values()) / 1024 ** 2, 1),
+                "max_mb": round(self.max_bytes / 1024 ** 2, 1) if self.max_bytes else None,
+                "entries": [
+                    {
+                        "key": [str(part) for part in entry.key],
+                        "size_mb": round(entry.size_bytes / 1024 ** 2, 1),
+                        "load_seconds": round(entry.load_seconds, 3),
+                        "hits": entry.hits,
+                        "in_use": entry.users,
+                    }
+                    for entry in self._entries.values()
+                ],
+            }
+
+    def _lookup(self, key, pin=False):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if pin:
+                    entry.users += 1
+            return entry
+
+    def _record_hit(self, entry, seconds):
+        with self._lock:
+            self.hits += 1
+            self.warm_lookup_seconds += seconds
+            entry.hits += 1
+
+    def _evict_over_budget(self, keep=None):
+        # Caller holds self._lock
+        if not self.max_bytes or not self._entries:
+            return
+        if keep is None:
+            keep = next(reversed(self._entries))
+        resident = sum(e.size_bytes for e in self._entries.values())
+        for key in list(self._entries.keys()):
+            if resident <= self.max_bytes:
+                break
+            entry = self._entries[key]
+            # Never evict pipelines in use or the most recently used one
+            if entry.users > 0 or key == keep:
+                continue
+            resident -= entry.size_bytes
+            self._remove(key)
+            print(f"Evicted pipeline {key[0]} to stay under the RAM budget")
+
+    def _remove(self, key):
+        # Caller holds self._lock
+        self._entries.pop(key, None)
+        self._load_locks.pop(key, None)
+        self.evictions += 1
+
+    def _release_memory(self):
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+default_registry = PipelineRegistry(
+    max_bytes=int(PIPELINE_CACHE_MAX_GB * 1024 ** 3) if PIPELINE_CACHE_MAX_GB > 0 else None
+)
@@ -1,15 +1,110 @@
 """
 Pre-process dataset by encoding all images to latent space and caching them
 This significantly speeds up training by avoiding on-the-fly encoding
+
+Latents are streamed to fixed-size shards as they are encoded (see
+latent_cache.py); rerunning after an interruption resumes from the last
+complete shard. Images are decoded and resized by a thread (or process) pool
+that prepares the next batches while the VAE encodes the current one. The
+cache header records the VAE, resolution, dtype and dataset, which
+train_model checks before using it.
 """
 import torch
 from diffusers import AutoencoderKL
-from datasets import load_dataset
+from transformers import CLIPTextModel, CLIPTokenizer
 from PIL import Image
 import numpy as np
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
-import pickle
+from latent_cache import DEFAULT_SHARD_SIZE, ShardWriter, build_text_cache, cache_header, load_latent_cache
+
+DEFAULT_NUM_WORKERS = min(4, (os.cpu_count() or 1) - 1)  # leave a core to the VAE; 0 (serial) on one core
+
+# Dataset of a process-pool worker, set once by its initializer
+_worker_dataset = None
+
+def _init_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+def load_batch(indices, resolution, dataset=None):
+    """
+    Decode, convert and resize dataset items into one uint8 array
+    
+    Args:
+        indices: Dataset indices of the batch
+        resolution: Output side in pixels
+        dataset: Dataset to read (None = the process-pool worker's)
+    
+    Returns:
+        (uint8 array of shape (N, resolution, resolution, 3), list of texts)
+    """
+    dataset = dataset if dataset is not None else _worker_dataset
+    images = np.empty((len(indices), resolution, resolution, 3), dtype=np.uint8)
+    texts = []
+    for k, j in enumerate(indices):
+        item = dataset[j]
+        image = item['image']
+        
+        # Convert to RGB if needed
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        
+        # Resize if needed
+        if image.size != (resolution, resolution):
+            image = image.resize((resolution, resolution), Image.LANCZOS)
+        
+        images[k] = np.asarray(image)
+        texts.append(item['text'])
+    return images, texts
+
+def to_model_input(images):
+    """uint8 NHWC batch -> float NCHW tensor in [-1, 1], in one vectorized pass"""
+    return torch.from_numpy(images).permute(0, 3, 1, 2).float().div_(127.5).sub_(1.0)
+
+def prefetch_batches(dataset, batches, resolution, num_workers=DEFAULT_NUM_WORKERS, prefetch=None, pool="thread"):
+    """
+    Yield load_batch results in order, preparing the next batches in a pool
+    
+    PIL decodes and resizes with the GIL released, so threads scale across
+    cores; use processes when a dataset's own Python code is the bottleneck.
+    
+    Args:
+        dataset: Indexable dataset of {"image", "text"} items
+        batches: Iterable of index lists
+        resolution: Output side in pixels
+        num_workers: Pool size (0 = prepare each batch on the caller's thread)
+        prefetch: Batches prepared ahead of the one being consumed
+            (default: twice num_workers)
+        pool: "thread" or "process"
+    """
+    if num_workers <= 0:
+        for indices in batches:
+            yield load_batch(indices, resolution, dataset)
+        return
+    
+    if pool == "process":
+        executor = ProcessPoolExecutor(num_workers, initializer=_init_worker, initargs=(dataset,))
+        submit = lambda indices: executor.submit(load_batch, indices, resolution)
+    elif pool == "thread":
+        executor = ThreadPoolExecutor(num_workers, thread_name_prefix="preprocess")
+        submit = lambda indices: executor.submit(load_batch, indices, resolution, dataset)
+    else:
+        raise ValueError(f"Unknown pool '{pool}' (choose thread or process)")
+    
+    batches = iter(batches)
+    pending = deque()
+    try:
+        for indices in batches:
+            pending.append(submit(indices))
+            if len(pending) > (prefetch or 2 * num_workers):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
 
 def preprocess_dataset(
     dataset_name="wbensvage/clothes_desc",
@@ -17,6 +112,12 @@ def preprocess_dataset(
     cache_dir="./data/cached_latents",
     resolution=512,
     batch_size=4,
+    shard_size=DEFAULT_SHARD_SIZE,
+    num_workers=DEFAULT_NUM_WORKERS,
+    prefetch=None,
+    pool="thread",
+    text_states=False,
+    fp16=False,
 ):
     """
     Pre-process dataset by encoding all images to latent space
@@ -27,6 +128,16 @@ def preprocess_dataset(
         cache_dir: Directory to save cached latents
         resolution: Image resolution
         batch_size: Batch size for encoding (higher = faster but more memory)
+        shard_size: Images per cache shard (progress is saved once per shard)
+        num_workers: Decode/resize pool size (0 = on the main thread, between encodes)
+        prefetch: Batches prepared ahead of the one being encoded (default: 2 x num_workers)
+        pool: "thread" or "process" pool for decoding and resizing
+        text_states: Also cache the frozen text encoder's hidden states (fp16),
+            so training skips its forward pass; token ids are always cached
+        fp16: Store latents in float16 (half the disk and memory of float32)
+    
+    Returns:
+        (latents, texts) as read back by latent_cache.load_latent_cache
     """
     
     print("Loading VAE encoder...")
@@ -41,67 +152,41 @@ def preprocess_dataset(
     vae.requires_grad_(False)
     
     print("Loading dataset...")
+    from datasets import load_dataset
     dataset = load_dataset(dataset_name, split="train")
     
-    # Create cache directory
-    os.makedirs(cache_dir, exist_ok=True)
-    
-    # Process images in batches
-    all_latents = []
-    all_texts = []
-    
-    print(f"Encoding {len(dataset)} images to latent space...")
+    # Shards already written by an interrupted run with the same settings are kept
+    header = cache_header(dataset_name, dataset, pretrained_model_name_or_path, resolution)
+    writer = ShardWriter(cache_dir, header, shard_size=shard_size, dtype="float16" if fp16 else "float32")
+    if writer.complete:
+        print(f"Latents in {cache_dir} are already complete")
+        _cache_text(cache_dir, pretrained_model_name_or_path, text_states, device)
+        return load_latent_cache(cache_dir, verify=False)
+    start = writer.completed
+    if start:
+        print(f"Resuming after {start} cached images")
+    
+    print(f"Encoding {len(dataset) - start} images to latent space...")
     print(f"This may take a while, but it will speed up training significantly!")
     
+    batches = [range(i, min(i + batch_size, len(dataset))) for i in range(start, len(dataset), batch_size)]
     with torch.no_grad():
-        for i in tqdm(range(0, len(dataset), batch_size)):
-            batch_end = min(i + batch_size, len(dataset))
-            batch_images = []
-            batch_texts = []
-            
-            # Prepare batch
-            for j in range(i, batch_end):
-                item = dataset[j]
-                image = item['image']
-                text = item['text']
-                
-                # Convert to RGB if needed
-                if image.mode != "RGB":
-                    image = image.convert("RGB")
-                
-                # Resize if needed
-                if image.size != (resolution, resolution):
-                    image = image.resize((resolution, resolution), Image.LANCZOS)
-                
-                # Convert to tensor and normalize
-                image_array = np.array(image).astype(np.float32) / 255.0
-                image_array = (image_array - 0.5) / 0.5  # Normalize to [-1, 1]
-                image_tensor = torch.from_numpy(image_array).permute(2, 0, 1)  # CHW format
-                
-                batch_images.append(image_tensor)
-                batch_texts.append(text)
-            
-            # Stack batch
-            batch_tensor = torch.stack(batch_images).to(device)
+        # The pool decodes and resizes the next batches while this loop encodes
+        for batch_images, batch_texts in tqdm(
+            prefetch_batches(dataset, batches, resolution, num_workers, prefetch, pool), total=len(batches)
+        ):
+            batch_tensor = to_model_input(batch_images).to(device)
             
             # Encode to latent space
             latents = vae.encode(batch_tensor).latent_dist.sample()
             latents = latents * vae.config.scaling_factor
             
-            # Move to CPU and store
-            all_latents.append(latents.cpu())
-            all_texts.extend(batch_texts)
+            # Move to CPU; full shards go to disk
+            writer.add(latents, batch_texts)
     
-    # Concatenate all latents
-    print("Concatenating latents...")
-    all_latents = torch.cat(all_latents, dim=0)
-    
-    # Save cached data
-    print(f"Saving cached latents to {cache_dir}...")
-    torch.save(all_latents, os.path.join(cache_dir, "latents.pt"))
-    
-    with open(os.path.join(cache_dir, "texts.pkl"), "wb") as f:
-        pickle.dump(all_texts, f)
+    writer.close()
+    _cache_text(cache_dir, pretrained_model_name_or_path, text_states, device)
+    all_latents, all_texts = load_latent_cache(cache_dir, verify=False)
     
     print(f"Pre-processing complete!")
     print(f"Cached {len(all_texts)} images")
@@ -110,6 +195,18 @@ def preprocess_dataset(
     
     return all_latents, all_texts
 
+def _cache_text(cache_dir, pretrained_model_name_or_path, text_states, device):
+    """Token ids (and text-encoder states) for the cached captions; only missing or stale shards are redone"""
+    print("Caching token ids" + (" and text-encoder states..." if text_states else "..."))
+    tokenizer = CLIPTokenizer.from_pretrained(pretrained_model_name_or_path, subfolder="tokenizer")
+    text_encoder = None
+    if text_states:
+        text_encoder = CLIPTextModel.from_pretrained(pretrained_model_name_or_path, subfolder="text_encoder")
+        text_encoder = text_encoder.to(device)
+        text_encoder.eval()
+        text_encoder.requires_grad_(False)
+    build_text_cache(cache_dir, tokenizer, text_encoder, device=device)
+
 if __name__ == "__main__":
     import argparse
     
@@ -119,6 +216,15 @@ if __name__ == "__main__":
     parser.add_argument("--cache_dir", type=str, default="./data/cached_latents")
     parser.add_argument("--resolution", type=int, default=512)
     parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--shard_size", type=int, default=DEFAULT_SHARD_SIZE,
+                        help="Images per cache shard; an interrupted run resumes after the last full shard")
+    parser.add_argument("--num_workers", type=int, default=DEFAULT_NUM_WORKERS,
+                        help="Threads (or processes) decoding and resizing images; 0 = serial")
+    parser.add_argument("--prefetch", type=int, default=None, help="Batches prepared ahead (default: 2 x num_workers)")
+    parser.add_argument("--pool", type=str, default="thread", choices=["thread", "process"])
+    parser.add_argument("--text_states", action="store_true",
+                        help="Also cache fp16 text-encoder hidden states so training skips the text encoder")
+    parser.add_argument("--fp16", action="store_true", help="Store latents in float16 (half the disk and memory)")
     
     args = parser.parse_args()
     
@@ -128,6 +234,12 @@ if __name__ == "__main__":
         cache_dir=args.cache_dir,
         resolution=args.resolution,
         batch_size=args.batch_size,
+        shard_size=args.shard_size,
+        num_workers=args.num_workers,
+        prefetch=args.prefetch,
+        pool=args.pool,
+        text_states=args.text_states,
+        fp16=args.fp16,
     )
 
 
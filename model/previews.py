@@ -0,0 +1,75 @@
+"""
+Cheap previews of in-progress latents
+Projects the 4 latent channels straight to RGB instead of running the VAE
+decoder, or optionally decodes them with the tiny autoencoder
+"""
+import base64
+import io
+
+import torch
+from PIL import Image
+
+# Approximate linear maps from SD latent channels to RGB, fitted against VAE decodes
+SD_LATENT_RGB_FACTORS = [
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+]
+SDXL_LATENT_RGB_FACTORS = [
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+]
+SDXL_LATENT_RGB_BIAS = [0.1084, -0.0175, -0.0011]
+
+
+def latents_to_preview(latents, sdxl=False, max_size=None, decoder="approx"):
+    """
+    Convert latents to a low-resolution RGB preview
+
+    Args:
+        latents: Latent tensor of shape (4, h, w) or (1, 4, h, w)
+        sdxl: Use the SDXL projection instead of the SD 1.x/2.x one
+        max_size: Upscale the preview so its longest side is at most this many
+            pixels (None keeps the latent resolution, 1/8 of the output)
+        decoder: "approx" for the linear projection, "tiny" to decode with
+            the tiny autoencoder (sharper, downscaled to max_size)
+
+    Returns:
+        PIL Image
+    """
+    if latents.dim() == 4:
+        latents = latents[0]
+
+    if decoder == "tiny":
+        from vae_decode import tiny_preview
+        rgb = tiny_preview(latents.detach(), sdxl=sdxl)
+        image = Image.fromarray((rgb.permute(1, 2, 0) * 255).round().to(torch.uint8).cpu().numpy())
+        if max_size:
+            image.thumbnail((max_size, max_size), Image.BILINEAR)
+        return image
+
+    latents = latents.detach().float().cpu()
+
+    factors = torch.tensor(SDXL_LATENT_RGB_FACTORS if sdxl else SD_LATENT_RGB_FACTORS)
+    rgb = torch.einsum("chw,cr->rhw", latents, factors)
+    if sdxl:
+        rgb = rgb + torch.tensor(SDXL_LATENT_RGB_BIAS).view(3, 1, 1)
+
+    rgb = ((rgb + 1.0) / 2.0).clamp(0, 1)
+    array = (rgb.permute(1, 2, 0) * 255).round().to(torch.uint8).numpy()
+    image = Image.fromarray(array)
+
+    if max_size and max(image.size) < max_size:
+        scale = max_size / max(image.size)
+        image = image.resize((round(image.width * scale), round(image.height * scale)), Image.BILINEAR)
+    return image
+
+
+def preview_base64(image, quality=70):
+    """Encode a preview as a base64 JPEG string"""
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
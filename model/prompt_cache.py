@@ -0,0 +1,168 @@
+"""
+LRU cache of CLIP text-encoder outputs
+Prompts repeat a lot, and the unconditional (empty prompt) embedding never changes
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+from metrics import record_stage, timed
+
+PROMPT_CACHE_MAX_MB = float(os.getenv("PROMPT_CACHE_MAX_MB", "64"))
+
+
+def model_identity(pipe):
+    """Identify which text encoder produced an embedding"""
+    name = getattr(pipe.config, "_name_or_path", None) or type(pipe).__name__
+    return f"{name}|{pipe.text_encoder.dtype}|{pipe.text_encoder.device}"
+
+
+class PromptEmbeddingCache:
+    """
+    Text-encoder outputs keyed by (model, token ids)
+
+    Entries are evicted least-recently-used once the cache holds more than
+    max_bytes. The unconditional embedding of each model is kept separately
+    and never evicted.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        """
+        Args:
+            max_bytes: Memory budget for cached embeddings
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._unconditional = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+
+    def encode(self, pipe, prompts, timers=()):
+        """
+        Encode prompts the same way StableDiffusionPipeline.encode_prompt does
+
+        Args:
+            pipe: Stable Diffusion pipeline (tokenizer + text_encoder)
+            prompts: List of prompt strings
+            timers: metrics.StageTimer objects to add tokenize/text_encode time to
+
+        Returns:
+            Tensor of shape (len(prompts), max_length, hidden_size)
+        """
+        model = model_identity(pipe)
+        with timed("tokenize", timers):
+            text_inputs = self._tokenize(pipe, prompts)
+        token_ids = text_inputs.input_ids
+        keys = [(model, tuple(ids.tolist())) for ids in token_ids]
+
+        rows = [None] * len(prompts)
+        # Repeated prompts in one batch (several candidates of one request) are encoded once
+        missing = {}
+        with self._lock:
+            for index, key in enumerate(keys):
+                embedding = self._entries.get(key)
+                if embedding is None:
+                    missing.setdefault(key, []).append(index)
+                else:
+                    self._entries.move_to_end(key)
+                    rows[index] = embedding
+            self.hits += len(prompts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            first = [indices[0] for indices in missing.values()]
+            start = time.perf_counter()
+            encoded = self._run_text_encoder(
+                pipe, token_ids[first], text_inputs.attention_mask[first]
+            )
+            elapsed = time.perf_counter() - start
+            record_stage("text_encode", elapsed, timers)
+            with self._lock:
+                self.encode_seconds += elapsed
+                for row, (key, indices) in enumerate(missing.items()):
+                    for index in indices:
+                        rows[index] = encoded[row]
+                    # Clone so the entry doesn't keep the whole batch alive
+                    self._store(key, encoded[row].clone())
+
+        return torch.stack(rows)
+
+    def unconditional(self, pipe, batch_size):
+        """
+        Embedding of the empty prompt, computed once per model
+
+        Returns:
+            Tensor of shape (batch_size, max_length, hidden_size)
+        """
+        model = model_identity(pipe)
+        with self._lock:
+            embedding = self._unconditional.get(model)
+        if embedding is None:
+            text_inputs = self._tokenize(pipe, [""])
+            embedding = self._run_text_encoder(pipe, text_inputs.input_ids, text_inputs.attention_mask)[0]
+            with self._lock:
+                self._unconditional[model] = embedding
+        else:
+            with self._lock:
+                self.hits += 1
+        return embedding.unsqueeze(0).expand(batch_size, -1, -1)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_encode = self.encode_seconds / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "memory_mb": round(self._bytes / 1024 ** 2, 2),
+                "max_memory_mb": round(self.max_bytes / 1024 ** 2, 2),
+                "text_encoder_seconds": round(self.encode_seconds, 3),
+                "estimated_seconds_saved": round(self.hits * avg_encode, 3),
+            }
+
+    def _tokenize(self, pipe, prompts):
+        tokenizer = pipe.tokenizer
+        return tokenizer(
+            prompts,
+            padding="max_length",
+            max_length=tokenizer.model_max_length,
+            truncation=True,
+            return_tensors="pt",
+        )
+
+    def _run_text_encoder(self, pipe, token_ids, attention_mask):
+        text_encoder = pipe.text_encoder
+        device = text_encoder.device
+        # Same as encode_prompt: only some text encoders expect the attention mask
+        if getattr(text_encoder.config, "use_attention_mask", False):
+            attention_mask = attention_mask.to(device)
+        else:
+            attention_mask = None
+        with torch.no_grad():
+            embeddings = text_encoder(token_ids.to(device), attention_mask=attention_mask)[0]
+        return embeddings.to(dtype=text_encoder.dtype)
+
+    def _store(self, key, embedding):
+        # Caller holds self._lock
+        size = embedding.numel() * embedding.element_size()
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.numel() * previous.element_size()
+        self._entries[key] = embedding
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.numel() * evicted.element_size()
+
+
+default_prompt_cache = PromptEmbeddingCache(max_bytes=int(PROMPT_CACHE_MAX_MB * 1024 ** 2))
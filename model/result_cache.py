@@ -0,0 +1,280 @@
+"""
+Content-addressed cache of encoded images for deterministic (seeded) generations
+Two tiers: an in-memory LRU and a directory of files on disk
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from vae_decode import effective_vae_mode
+
+
+def normalize_params(params):
+    """
+    Canonical form of the parameters that determine a seeded generation
+
+    Whitespace in prompts is collapsed (the CLIP tokenizer does the same), and
+    an empty negative prompt is treated the same as none. The VAE mode and
+    refine settings only appear when they change the output, so keys from
+    before they existed stay valid.
+    """
+    def clean(text):
+        return " ".join(text.split()) if text else ""
+
+    normalized = {
+        "prompt": clean(params["prompt"]),
+        "negative_prompt": clean(params.get("negative_prompt")),
+        "steps": int(params["steps"]),
+        "guidance_scale": round(float(params["guidance_scale"]), 4),
+        "height": int(params["height"]),
+        "width": int(params["width"]),
+        "seed": int(params["seed"]) if params.get("seed") is not None else None,
+        "scheduler": params.get("scheduler") or "default",
+    }
+    vae_mode = effective_vae_mode(params.get("vae_mode"), normalized["height"], normalized["width"])
+    if vae_mode != "full":
+        normalized["vae_mode"] = vae_mode
+    if params.get("refine"):
+        normalized["refine"] = params["refine"].to_dict()
+    return normalized
+
+
+def result_key(params, model, revision):
+    """
+    Hash of the normalized parameters plus model identity and revision
+
+    Returns:
+        Hex digest, or None when the request is not deterministic (no seed)
+    """
+    if params.get("seed") is None:
+        return None
+    payload = {"model": model, "revision": revision, "params": normalize_params(params)}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def model_revision(model_to_load):
+    """
+    Identify the exact weights behind a model
+
+    Local directories are fingerprinted by file names, sizes and modification
+    times, so retraining into the same path invalidates cached results. Hub
+    models use MODEL_REVISION (default "main").
+    """
+    if os.path.isdir(model_to_load):
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(model_to_load):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                rel = os.path.relpath(path, model_to_load)
+                digest.update(f"{rel}:{stat.st_size}:{int(stat.st_mtime)}\n".encode("utf-8"))
+        return digest.hexdigest()[:16]
+    return os.getenv("MODEL_REVISION", "main")
+
+
+class ResultCache:
+    """
+    Two-tier cache of encoded image bytes
+
+    Memory tier: LRU bounded by max_memory_bytes. Disk tier: one file per key
+    under cache_dir, bounded by max_disk_bytes (oldest files removed first).
+    Entries older than ttl_seconds are treated as misses in both tiers.
+    """
+
+    def __init__(self, cache_dir, max_memory_bytes=256 * 1024 ** 2, max_disk_bytes=2 * 1024 ** 3,
+                 ttl_seconds=7 * 24 * 3600, extension="png", writer=None):
+        """
+        Args:
+            cache_dir: Directory for the disk tier
+            max_memory_bytes: Memory tier budget (0 disables the tier)
+            max_disk_bytes: Disk tier budget (0 disables the tier)
+            ttl_seconds: Maximum age of an entry
+            extension: File extension for disk entries
+            writer: Optional BackgroundWriter; disk writes then happen off the
+                calling thread
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.extension = extension
+        self.writer = writer
+        self._pending_disk = {}
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.puts = 0
+        self._disk_bytes = None
+
+    def path(self, key):
+        """Disk location of an entry"""
+        return os.path.join(self.cache_dir, f"{key}.{self.extension}")
+
+    def get(self, key):
+        """
+        Look up cached bytes
+
+        Returns:
+            Bytes, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                data, created = entry
+                if now - created <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return data
+                self._drop_memory(key)
+
+        with self._lock:
+            data = self._pending_disk.get(key)
+        if data is not None:
+            with self._lock:
+                self.memory_hits += 1
+            return data
+
+        # A file removed meanwhile (eviction, external cleanup) is just a miss
+        data, created = self._read_disk(key, now)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put_memory(key, data, created)
+        return data
+
+    def put(self, key, data):
+        """Store bytes in both tiers"""
+        now = time.time()
+        with self._lock:
+            self.puts += 1
+            self._put_memory(key, data, now)
+        if self.writer is None:
+            self._write_disk(key, data)
+        elif self.max_disk_bytes:
+            with self._lock:
+                self._pending_disk[key] = data
+            self.writer.run(lambda: self._write_pending(key))
+
+    def _write_pending(self, key):
+        with self._lock:
+            data = self._pending_disk.get(key)
+        if data is None:
+            return
+        try:
+            self._write_disk(key, data)
+        finally:
+            with self._lock:
+                self._pending_disk.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "puts": self.puts,
+                "memory_entries": len(self._memory),
+                "memory_mb": round(self._memory_bytes / 1024 ** 2, 2),
+                "max_memory_mb": round(self.max_memory_bytes / 1024 ** 2, 2),
+                "disk_mb": round((self._disk_bytes or 0) / 1024 ** 2, 2),
+                "max_disk_mb": round(self.max_disk_bytes / 1024 ** 2, 2),
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+    def _put_memory(self, key, data, created):
+        # Caller holds self._lock
+        if not self.max_memory_bytes or len(data) > self.max_memory_bytes:
+            return
+        self._drop_memory(key)
+        self._memory[key] = (data, created)
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+
+    def _drop_memory(self, key):
+        # Caller holds self._lock
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[0])
+
+    def _read_disk(self, key, now):
+        # Returns (bytes, mtime), or (None, None) on a miss
+        if not self.max_disk_bytes:
+            return None, None
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                # mtime of the open file, so a concurrent removal can't fail the lookup
+                created = os.fstat(f.fileno()).st_mtime
+                if now - created > self.ttl_seconds:
+                    expired = True
+                else:
+                    return f.read(), created
+        except OSError:
+            return None, None
+        if expired:
+            self._remove_file(path)
+        return None, None
+
+    def _write_disk(self, key, data):
+        if not self.max_disk_bytes:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += len(data)
+            over_budget = self.max_disk_bytes and self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _scan_disk_bytes(self):
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(f".{self.extension}"):
+                total += entry.stat().st_size
+        return total
+
+    def _evict_disk(self):
+        # Remove expired files, then the oldest until under budget
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(f".{self.extension}"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if total <= self.max_disk_bytes and now - mtime <= self.ttl_seconds:
+                break
+            self._remove_file(path)
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,160 @@
+"""
+Per-request sampler selection and quality presets
+Schedulers are swapped on a resident pipeline; the weights are never reloaded
+"""
+import os
+from contextlib import contextmanager
+
+from diffusers import (
+    DDIMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    EulerDiscreteScheduler,
+    LCMScheduler,
+    UniPCMultistepScheduler,
+)
+
+# Hugging Face ID or path of an LCM-LoRA adapter (e.g. latent-consistency/lcm-lora-sdv1-5)
+LCM_LORA = os.getenv("LCM_LORA", None)
+
+# name -> (scheduler class, config overrides)
+SCHEDULERS = {
+    "dpmpp": (DPMSolverMultistepScheduler, {"algorithm_type": "dpmsolver++", "solver_order": 2}),
+    "dpmpp-karras": (DPMSolverMultistepScheduler, {
+        "algorithm_type": "dpmsolver++", "solver_order": 2, "use_karras_sigmas": True,
+    }),
+    "unipc": (UniPCMultistepScheduler, {}),
+    "euler-a": (EulerAncestralDiscreteScheduler, {}),
+    "euler": (EulerDiscreteScheduler, {}),
+    "ddim": (DDIMScheduler, {}),
+    "lcm": (LCMScheduler, {}),
+}
+
+ALIASES = {
+    "dpm++": "dpmpp",
+    "dpmsolver++": "dpmpp",
+    "dpm++-karras": "dpmpp-karras",
+    "euler_a": "euler-a",
+    "euler-ancestral": "euler-a",
+}
+
+# Quality tier -> scheduler and step count
+QUALITY_PRESETS = {
+    "draft": {"scheduler": "dpmpp-karras", "steps": 12},
+    "standard": {"scheduler": "dpmpp-karras", "steps": 25},
+    "final": {"scheduler": "unipc", "steps": 40},
+}
+
+# Used instead when LCM sampling is available; LCM wants little or no guidance
+LCM_PRESETS = {
+    "draft": {"scheduler": "lcm", "steps": 4, "guidance_scale": 1.5},
+    "standard": {"scheduler": "lcm", "steps": 8, "guidance_scale": 1.5},
+}
+
+
+def resolve_scheduler(name):
+    """
+    Canonical scheduler name
+
+    Returns:
+        A key of SCHEDULERS, or "default" for the model's own scheduler
+
+    Raises:
+        ValueError: If the name is unknown
+    """
+    if not name or name.lower() == "default":
+        return "default"
+    name = ALIASES.get(name.lower(), name.lower())
+    if name not in SCHEDULERS:
+        raise ValueError(
+            f"Unknown scheduler: {name} (choose from default, {', '.join(SCHEDULERS)})"
+        )
+    return name
+
+
+def lcm_available(model_to_load):
+    """Whether LCM sampling can be used: an LCM-LoRA is configured or the model is LCM-distilled"""
+    return bool(LCM_LORA) or "lcm" in model_to_load.lower()
+
+
+def quality_preset(quality, lcm=False):
+    """
+    Scheduler, step count (and for LCM, guidance) for a quality tier
+
+    Args:
+        quality: "draft", "standard" or "final"
+        lcm: Prefer the LCM preset when the tier has one
+
+    Returns:
+        Dict with "scheduler", "steps" and optionally "guidance_scale"
+    """
+    quality = quality.lower()
+    if quality not in QUALITY_PRESETS:
+        raise ValueError(f"Unknown quality: {quality} (choose from {', '.join(QUALITY_PRESETS)})")
+    if lcm and quality in LCM_PRESETS:
+        return dict(LCM_PRESETS[quality])
+    return dict(QUALITY_PRESETS[quality])
+
+
+def load_lcm_adapter(pipe, lcm_lora):
+    """
+    Load an LCM-LoRA into the UNet as a disabled adapter
+
+    The adapter is only switched on while the "lcm" scheduler is in use, so
+    the other samplers keep using the original weights.
+    """
+    try:
+        pipe.load_lora_weights(lcm_lora, adapter_name="lcm")
+        pipe.disable_lora()
+        print(f"✅ Loaded LCM-LoRA adapter from {lcm_lora}")
+    except Exception as e:
+        print(f"Warning: could not load LCM-LoRA {lcm_lora}: {e}")
+
+
+def _has_lcm_adapter(pipe):
+    try:
+        adapters = pipe.get_list_adapters()
+    except Exception:
+        return False
+    return any("lcm" in names for names in adapters.values())
+
+
+def _is_lcm_distilled(pipe):
+    return getattr(pipe.unet.config, "time_cond_proj_dim", None) is not None
+
+
+def _scheduler_instance(pipe, name):
+    # Instances are built once per pipeline from the model's own scheduler config
+    instances = pipe.__dict__.setdefault("_scheduler_instances", {"default": pipe.scheduler})
+    if name not in instances:
+        scheduler_cls, overrides = SCHEDULERS[name]
+        instances[name] = scheduler_cls.from_config(instances["default"].config, **overrides)
+    return instances[name]
+
+
+@contextmanager
+def use_scheduler(pipe, name=None):
+    """
+    Temporarily swap the scheduler of a pipeline the caller has exclusive use of
+
+    Args:
+        pipe: Diffusers pipeline
+        name: Scheduler name or alias (None or "default" keeps the model's own)
+    """
+    name = resolve_scheduler(name)
+    default = _scheduler_instance(pipe, "default")
+    lora = False
+    if name == "lcm" and not _is_lcm_distilled(pipe):
+        if not _has_lcm_adapter(pipe):
+            raise ValueError("LCM sampling needs an LCM-distilled model or the LCM_LORA adapter")
+        lora = True
+
+    pipe.scheduler = _scheduler_instance(pipe, name)
+    if lora:
+        pipe.enable_lora()
+    try:
+        yield pipe
+    finally:
+        if lora:
+            pipe.disable_lora()
+        pipe.scheduler = default
@@ -0,0 +1,197 @@
+"""
+Memory-mapped model weights shared between processes
+Parameters are replaced with tensors that view a read-only (copy-on-write)
+mapping of the pipeline's safetensors files. Every process that maps the same
+file uses the same page-cache pages, so N worker processes hold one physical
+copy of the weights instead of N.
+"""
+import glob
+import json
+import os
+import re
+import struct
+
+import torch
+
+# safetensors dtype codes
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+# Pipeline components whose weights are worth sharing
+WEIGHT_COMPONENTS = ("unet", "vae", "text_encoder", "text_encoder_2")
+
+
+def read_safetensors_header(path):
+    """
+    Read a safetensors header
+
+    Returns:
+        (dict of tensor name -> {"dtype", "shape", "data_offsets"}, byte offset
+        where the tensor data starts)
+    """
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    return header, 8 + header_size
+
+
+def mmap_safetensors(path):
+    """
+    Map a safetensors file and return its tensors without reading them
+
+    The mapping is private: pages are shared with every other process mapping
+    the file until written to, and writes never reach the file.
+
+    Returns:
+        Dict of tensor name -> CPU tensor backed by the mapping
+    """
+    header, data_start = read_safetensors_header(path)
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    tensors = {}
+    for name, info in header.items():
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        offset = data_start + begin
+        element_size = torch.empty((), dtype=dtype).element_size()
+        tensor = torch.empty(0, dtype=torch.uint8)
+        if offset % element_size == 0:
+            tensor = tensor.new_empty(0, dtype=dtype).set_(storage, offset // element_size, info["shape"])
+        else:
+            # Unaligned entries can't be viewed in place; copy just this one
+            tensor = tensor.set_(storage, offset, (end - begin,)).clone().view(dtype).reshape(info["shape"])
+        tensors[name] = tensor
+    return tensors
+
+
+def weight_files(directory, variant=None):
+    """
+    A component's safetensors files for one variant
+
+    Hub repos can hold several copies of the same weights side by side
+    (diffusion_pytorch_model.safetensors, .fp16.safetensors, .non_ema.safetensors),
+    each possibly sharded (-00001-of-00002).
+
+    Args:
+        directory: Component folder
+        variant: Variant name such as "fp16" (None = the plain files); falls
+            back to the plain files when the variant isn't there
+
+    Returns:
+        Sorted list of file paths (empty if there are no safetensors weights)
+    """
+    by_variant = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.safetensors"))):
+        stem = re.sub(r"-\d+-of-\d+$", "", os.path.basename(path)[:-len(".safetensors")])
+        file_variant = stem.split(".", 1)[1] if "." in stem else None
+        by_variant.setdefault(file_variant, []).append(path)
+    return by_variant.get(variant) or by_variant.get(None, [])
+
+
+def share_module_weights(module, directory):
+    """
+    Point a module's parameters and buffers at a mapping of its weight files
+
+    Tensors whose dtype, shape or layout differ from the file (converted,
+    channels_last, LoRA-fused) keep their private copy.
+
+    Args:
+        module: torch.nn.Module loaded from directory
+        directory: Component folder holding *.safetensors files
+
+    Returns:
+        (bytes now shared, bytes still private)
+    """
+    current = module.state_dict()
+    dtype = next(iter(current.values())).dtype if current else torch.float32
+    mapped = {}
+    for path in weight_files(directory, "fp16" if dtype == torch.float16 else None):
+        mapped.update(mmap_safetensors(path))
+
+    state_dict = {}
+    shared = private = 0
+    for name, tensor in current.items():
+        candidate = mapped.get(name)
+        nbytes = tensor.numel() * tensor.element_size()
+        if (
+            candidate is not None
+            and candidate.dtype == tensor.dtype
+            and candidate.shape == tensor.shape
+            and tensor.device.type == "cpu"
+            and tensor.is_contiguous()
+            and torch.equal(candidate, tensor)
+        ):
+            state_dict[name] = candidate
+            shared += nbytes
+        else:
+            state_dict[name] = tensor
+            private += nbytes
+    module.load_state_dict(state_dict, assign=True)
+    return shared, private
+
+
+def share_pipeline_weights(pipe, model_dir):
+    """
+    Share the weights of every large pipeline component
+
+    Args:
+        pipe: Pipeline loaded from model_dir on the CPU
+        model_dir: Local pipeline folder (a Hub snapshot directory works too)
+
+    Returns:
+        Dict of component -> {"shared_bytes", "private_bytes"}
+    """
+    report = {}
+    for name in WEIGHT_COMPONENTS:
+        module = getattr(pipe, name, None)
+        directory = os.path.join(model_dir, name)
+        if not isinstance(module, torch.nn.Module) or not os.path.isdir(directory):
+            continue
+        shared, private = share_module_weights(module, directory)
+        report[name] = {"shared_bytes": shared, "private_bytes": private}
+    return report
+
+
+def local_model_dir(model_to_load):
+    """
+    Folder holding a pipeline's files: the path itself, or the Hub cache
+    snapshot for a model ID (None if it isn't downloaded)
+    """
+    if os.path.isdir(model_to_load):
+        return model_to_load
+    try:
+        from huggingface_hub import snapshot_download
+        return snapshot_download(model_to_load, local_files_only=True)
+    except Exception:
+        return None
+
+
+def memory_usage(pid="self"):
+    """
+    Resident (RSS), proportional (PSS) and shared memory of a process in bytes
+
+    PSS splits shared pages between the processes mapping them, so summing it
+    across workers gives their real combined footprint. Anonymous memory is
+    what isn't backed by a file (and so can't be shared through the page cache).
+    Linux only.
+    """
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[0].rstrip(":") in ("Rss", "Pss", "Shared_Clean", "Private_Dirty", "Anonymous"):
+                    usage[parts[0].rstrip(":").lower()] = int(parts[1]) * 1024
+    except OSError:
+        pass
+    return usage
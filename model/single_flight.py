@@ -0,0 +1,171 @@
+"""
+Single-flight deduplication of identical in-flight generations
+Concurrent requests with the same normalized parameters (a double-clicked
+"generate", a client retrying a slow response) join the generation already
+running instead of starting their own; its result fans out to every waiter
+"""
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+
+from metrics import Counter, default_metrics
+from result_cache import normalize_params
+
+SAVED_GENERATIONS = default_metrics.register(Counter(
+    "t2i_single_flight_saved_total", "Images not generated because an identical request was already in flight"
+))
+
+
+def flight_key(params, model, revision, include_unseeded=False):
+    """
+    Key under which identical requests are coalesced
+
+    Args:
+        params: Parsed generation parameters
+        model: Served model ID or path
+        revision: Weights revision (see result_cache.model_revision)
+        include_unseeded: Also coalesce requests without a seed; waiters then
+            share one random image instead of each getting their own
+
+    Returns:
+        Hex digest, or None when the request must run on its own
+    """
+    if params.get("seed") is None and not include_unseeded:
+        return None
+    payload = {
+        "model": model,
+        "revision": revision,
+        "params": normalize_params(params),
+        "num_images": int(params.get("num_images", 1)),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class _Waiter:
+    """One caller of a flight: its step callbacks and where its outcome goes"""
+
+    def __init__(self, callbacks):
+        self.callbacks = list(callbacks)
+        self.future = Future()
+
+
+class _Flight:
+    """A running generation and the callers waiting on it"""
+
+    def __init__(self):
+        self.waiters = []
+        self.lock = threading.Lock()
+        # Set (to the exception that dropped the last waiter) once nobody is waiting
+        self.abandoned = None
+
+    def fan_out(self, index):
+        """Step callback for output `index` that forwards to every waiter's callback"""
+        def callback(step, total_steps, latents=None):
+            with self.lock:
+                if self.abandoned is not None:
+                    # Every output stops, not just the one whose callback saw the cancel
+                    raise self.abandoned
+                waiters = list(self.waiters)
+            for waiter in waiters:
+                if waiter.callbacks[index] is None:
+                    continue
+                try:
+                    waiter.callbacks[index](step, total_steps, latents)
+                except Exception as e:
+                    # That caller is gone (closed stream, cancelled job); the others still want the result
+                    waiter.future.set_exception(e)
+                    with self.lock:
+                        self.waiters.remove(waiter)
+                        if not self.waiters:
+                            # Nobody is left waiting: stop the pipeline at this step
+                            self.abandoned = e
+            with self.lock:
+                if self.abandoned is not None:
+                    raise self.abandoned
+        return callback
+
+
+class SingleFlight:
+    """
+    Runs at most one generation per key at a time
+
+    The first caller with a key (the leader) runs the generation on its own
+    thread; callers arriving while it runs wait for its result. Each caller
+    keeps its own step callbacks, receiving the steps run after it joined. A
+    callback that raises drops only its caller, who gets that exception; the
+    generation stops early only once every caller has dropped out.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.saved = 0
+
+    def do(self, key, run, callbacks=(None,)):
+        """
+        Run run(callbacks) once for all concurrent callers with the same key
+
+        Args:
+            key: Flight key (see flight_key)
+            run: Callable taking a list of step callbacks, one per output image,
+                and returning the result
+            callbacks: This caller's callable(step, total_steps, latents) per
+                output image, or None entries
+
+        Returns:
+            (result, leader) where leader is False when the result was shared
+        """
+        waiter = _Waiter(callbacks)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = True
+            if flight is not None:
+                with flight.lock:
+                    # An abandoned flight is stopping; a new caller runs its own
+                    if flight.abandoned is None:
+                        flight.waiters.append(waiter)
+                        leader = False
+            if leader:
+                flight = self._flights[key] = _Flight()
+                flight.waiters.append(waiter)
+                self.leaders += 1
+            else:
+                self.followers += 1
+                self.saved += len(waiter.callbacks)
+
+        if not leader:
+            SAVED_GENERATIONS.inc(len(waiter.callbacks))
+            return waiter.future.result(), False
+
+        try:
+            result = run([flight.fan_out(index) for index in range(len(waiter.callbacks))])
+        except BaseException as e:
+            self._finish(key, flight, error=e)
+        else:
+            self._finish(key, flight, result=result)
+        return waiter.future.result(), True
+
+    def _finish(self, key, flight, result=None, error=None):
+        with self._lock:
+            # Callers arriving from now on start a new flight (and usually hit the result cache)
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.lock:
+            waiters, flight.waiters = flight.waiters, []
+        for waiter in waiters:
+            if error is not None:
+                waiter.future.set_exception(error)
+            else:
+                waiter.future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "saved_images": self.saved,
+            }
@@ -0,0 +1,101 @@
+"""
+Stand-in for the diffusers backend used for load testing the API
+Same call signatures as inference_hf_model.generate_image / generate_images_batch,
+but each step just sleeps and/or burns CPU, so the HTTP, serialization and
+queueing layers can be measured without loading weights
+"""
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from inference_hf_model import _batch_step_callback
+from metrics import BATCH_SIZE, StepClock
+
+
+class StubGenerator:
+    """
+    Fake generator with a configurable cost model
+
+    A batch costs step_ms (plus a compute_size matrix multiply) per denoising
+    step regardless of batch size, like a batched UNet call, plus image_ms per
+    image. At most `concurrency` batches run at once, like the real pipeline
+    which is used exclusively.
+    """
+
+    def __init__(self, step_ms=20.0, image_ms=5.0, compute_size=0, concurrency=1):
+        """
+        Args:
+            step_ms: Sleep per denoising step
+            image_ms: Sleep per generated image (stands in for the VAE decode)
+            compute_size: Side of a float32 matrix multiplied once per step
+                (0 = no CPU work)
+            concurrency: Batches allowed to run at the same time
+        """
+        self.step_ms = step_ms
+        self.image_ms = image_ms
+        self.compute_size = compute_size
+        self._slots = threading.Semaphore(max(1, concurrency))
+        self._matrix = np.random.rand(compute_size, compute_size).astype(np.float32) if compute_size else None
+
+    @classmethod
+    def from_env(cls):
+        """Build from STUB_STEP_MS, STUB_IMAGE_MS, STUB_COMPUTE_SIZE and STUB_CONCURRENCY"""
+        return cls(
+            step_ms=float(os.getenv("STUB_STEP_MS", "20")),
+            image_ms=float(os.getenv("STUB_IMAGE_MS", "5")),
+            compute_size=int(os.getenv("STUB_COMPUTE_SIZE", "0")),
+            concurrency=int(os.getenv("STUB_CONCURRENCY", "1")),
+        )
+
+    def generate_image(self, prompt, num_inference_steps=50, height=512, width=512, seed=None,
+                       step_callback=None, timer=None, **kwargs):
+        """Drop-in for inference_hf_model.generate_image (other arguments are ignored)"""
+        result = self.generate_images_batch(
+            [{"prompt": prompt, "seed": seed, "step_callback": step_callback, "timer": timer}],
+            num_inference_steps=num_inference_steps,
+            height=height,
+            width=width,
+        )[0]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def generate_images_batch(self, requests, num_inference_steps=50, height=512, width=512, **kwargs):
+        """
+        Drop-in for inference_hf_model.generate_images_batch
+
+        Returns:
+            List of PIL Images, or the exception raised by a request's step_callback
+        """
+        callback, errors = _batch_step_callback(requests, num_inference_steps)
+        clock = StepClock(r.get("timer") for r in requests)
+        on_step_end = clock.wrap(callback)
+        latents = torch.randn(len(requests), 4, height // 8, width // 8)
+
+        with self._slots:
+            BATCH_SIZE.observe(len(requests))
+            clock.start()
+            for step in range(num_inference_steps):
+                self._step_cost()
+                on_step_end(None, step, None, {"latents": latents})
+            images = [self._image(r.get("seed"), height, width) for r in requests]
+            time.sleep(self.image_ms * len(requests) / 1000)
+            clock.finish()
+
+        return [error if error is not None else image for image, error in zip(images, errors)]
+
+    def _step_cost(self):
+        if self._matrix is not None:
+            self._matrix @ self._matrix
+        if self.step_ms:
+            time.sleep(self.step_ms / 1000)
+
+    def _image(self, seed, height, width):
+        # Smooth random colours, so PNG/WebP sizes are closer to a real image than pure noise
+        rng = np.random.default_rng(seed)
+        small = rng.integers(0, 256, size=(max(1, height // 32), max(1, width // 32), 3), dtype=np.uint8)
+        return Image.fromarray(small).resize((width, height), Image.BICUBIC)
@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+from batching import MicroBatcher
+
+
+class GatedBatch:
+    """run_batch that blocks on its first call until released"""
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, key, params):
+        self.calls.append(list(params))
+        self.started.set()
+        self.release.wait(5)
+        return [f"{key}:{p}" for p in params]
+
+
+def busy_batcher(max_batch_size=2):
+    # One batch running, so later requests stay queued
+    run_batch = GatedBatch()
+    batcher = MicroBatcher(run_batch, max_batch_size=max_batch_size, max_wait_ms=1)
+    first = batcher.submit("k", 0)
+    run_batch.started.wait(5)
+    queued = [batcher.submit("k", i) for i in range(1, 4)]
+    return batcher, run_batch, first, queued
+
+
+def test_batches_share_a_key():
+    batcher = MicroBatcher(lambda key, params: [p * 2 for p in params], max_batch_size=4, max_wait_ms=200)
+    futures = [batcher.submit("a", i) for i in range(4)]
+    assert [f.result(5) for f in futures] == [0, 2, 4, 6]
+    assert batcher.stats()["max_batch_size_seen"] == 4
+    batcher.stop()
+
+
+def test_stop_drains_queued_requests():
+    batcher, run_batch, first, queued = busy_batcher()
+    threading.Timer(0.05, run_batch.release.set).start()
+    batcher.stop()
+    assert first.result(0) == "k:0"
+    assert [f.result(0) for f in queued] == ["k:1", "k:2", "k:3"]
+    assert batcher.stats()["queued"] == 0
+
+
+def test_stop_without_drain_fails_queued_requests():
+    batcher, run_batch, first, queued = busy_batcher()
+    threading.Timer(0.05, run_batch.release.set).start()
+    batcher.stop(drain=False)
+    # The running batch finishes; nothing queued behind it runs
+    assert first.result(5) == "k:0"
+    for future in queued:
+        with pytest.raises(RuntimeError, match="stopped"):
+            future.result(0)
+    assert run_batch.calls == [[0]]
+
+
+def test_stop_timeout_fails_stuck_requests():
+    batcher, run_batch, first, queued = busy_batcher()
+    batcher.stop(timeout=0.05)
+    for future in queued:
+        with pytest.raises(RuntimeError, match="stopped"):
+            future.result(0)
+    run_batch.release.set()
+    assert first.result(5) == "k:0"
+
+
+def test_submit_after_stop_raises():
+    batcher = MicroBatcher(lambda key, params: params)
+    batcher.stop()
+    with pytest.raises(RuntimeError, match="stopped"):
+        batcher.submit("k", 1)
+
+
+def test_failure_reaches_only_its_caller():
+    def run_batch(key, params):
+        return [ValueError(p) if p == "bad" else p for p in params]
+
+    batcher = MicroBatcher(run_batch, max_batch_size=2, max_wait_ms=200)
+    good, bad = batcher.submit("k", "good"), batcher.submit("k", "bad")
+    assert good.result(5) == "good"
+    with pytest.raises(ValueError):
+        bad.result(5)
+    batcher.stop()
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from jobs import CANCELLED, EXPIRED, QUEUED, RUNNING, SUCCEEDED, JobManager, QueueFullError
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class GatedRunner:
+    """run_job that reports one step and then blocks until released"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, job):
+        job.report_progress(1, 10)
+        self.started.set()
+        self.release.wait(5)
+        job.report_progress(2, 10)
+        return {"prompt": job.params["prompt"]}
+
+
+def test_cancelled_queued_job_frees_its_slot():
+    runner = GatedRunner()
+    manager = JobManager(runner, max_queue=2)
+    running = manager.submit({"prompt": "running"})
+    runner.started.wait(5)
+    queued = [manager.submit({"prompt": f"queued {i}"}) for i in range(2)]
+    with pytest.raises(QueueFullError):
+        manager.submit({"prompt": "one too many"})
+
+    manager.cancel(queued[0].id)
+    assert queued[0].status == CANCELLED
+    assert manager.stats()["queued"] == 1
+    late = manager.submit({"prompt": "late"})
+
+    runner.release.set()
+    wait_for(lambda: late.finished)
+    assert running.status == SUCCEEDED and queued[1].status == SUCCEEDED
+    assert late.result == {"prompt": "late"}
+    assert manager.stats()["queued"] == 0
+
+
+def test_cancel_stops_running_job():
+    runner = GatedRunner()
+    manager = JobManager(runner)
+    job = manager.submit({"prompt": "p", "steps": 10})
+    runner.started.wait(5)
+    assert job.status == RUNNING
+    manager.cancel(job.id)
+    runner.release.set()
+    wait_for(lambda: job.finished)
+    assert job.status == CANCELLED and job.result is None and job.step == 2
+
+
+def test_cancel_unknown_job():
+    assert JobManager(GatedRunner()).cancel("missing") is None
+
+
+def test_queued_jobs_expire_and_finished_jobs_are_dropped():
+    runner = GatedRunner()
+    manager = JobManager(runner, max_queue=1, ttl_seconds=0.2)
+    running = manager.submit({"prompt": "running"})
+    runner.started.wait(5)
+    stale = manager.submit({"prompt": "stale"})
+    time.sleep(0.3)
+
+    # The expired job gives its slot back instead of running
+    fresh = manager.submit({"prompt": "fresh"})
+    assert stale.status == EXPIRED and fresh.status == QUEUED
+
+    runner.release.set()
+    wait_for(lambda: fresh.finished)
+    assert running.status == SUCCEEDED and fresh.status == SUCCEEDED
+    time.sleep(0.3)
+    assert manager.get(stale.id) is None
+    assert manager.get(running.id) is None and manager.get(fresh.id) is None
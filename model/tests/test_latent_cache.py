@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from latent_cache import (
+    CacheMismatchError, ShardWriter, check_header, load_latent_cache, read_manifest, read_strings, write_strings,
+)
+
+HEADER = {
+    "vae": {"model": "tiny-sd", "fingerprint": "vae0", "scaling_factor": 0.18215},
+    "resolution": 32,
+    "dataset": {"name": "clothes", "fingerprint": "data0"},
+    "num_items": 23,
+}
+
+
+def latents_for(start, count):
+    return torch.arange(start, start + count, dtype=torch.float32).view(-1, 1, 1, 1).expand(-1, 4, 4, 4).clone()
+
+
+def write(cache_dir, header=HEADER, start=0, stop=23, close=True, dtype="float32", batch=3):
+    writer = ShardWriter(cache_dir, header, shard_size=5, dtype=dtype)
+    start = max(start, writer.completed)
+    for i in range(start, stop, batch):
+        count = min(batch, stop - i)
+        writer.add(latents_for(i, count), [f"item {j}" for j in range(i, i + count)])
+    if close:
+        writer.close()
+    return writer
+
+
+def test_strings_round_trip(tmp_path):
+    strings = ["a shirt", "", "ünïcode — dress", "x" * 1000]
+    write_strings(str(tmp_path / "t.strings"), strings)
+    assert read_strings(str(tmp_path / "t.strings")) == strings
+
+
+def test_truncated_strings_rejected(tmp_path):
+    path = str(tmp_path / "t.strings")
+    write_strings(path, ["one", "two"])
+    with open(path, "rb+") as f:
+        f.truncate(os.path.getsize(path) - 1)
+    with pytest.raises(CacheMismatchError):
+        read_strings(path)
+
+
+def test_resume_after_interruption(tmp_path):
+    cache_dir = str(tmp_path)
+    # Interrupted at item 13: only the two full shards (10 items) were written
+    write(cache_dir, stop=13, close=False)
+    assert read_manifest(cache_dir)["num_items"] == 10
+    with pytest.raises(CacheMismatchError, match="incomplete"):
+        load_latent_cache(cache_dir)
+
+    writer = write(cache_dir)
+    assert writer.complete
+    latents, texts = load_latent_cache(cache_dir, expected=HEADER)
+    assert texts == [f"item {j}" for j in range(23)]
+    assert len(latents) == 23 and latents.shape == (23, 4, 4, 4)
+    assert [float(latents[j][0, 0, 0]) for j in range(23)] == list(range(23))
+
+
+def test_changed_header_starts_over(tmp_path):
+    cache_dir = str(tmp_path)
+    write(cache_dir, stop=13, close=False)
+    writer = ShardWriter(cache_dir, {**HEADER, "resolution": 64}, shard_size=5)
+    assert writer.completed == 0
+    assert not any(name.startswith("shard-") for name in os.listdir(cache_dir))
+
+
+@pytest.mark.parametrize("change, message", [
+    ({"resolution": 64}, "resolution"),
+    ({"num_items": 24}, "items"),
+    ({"vae": {"model": "other", "fingerprint": "vae1", "scaling_factor": 0.18215}}, "VAE weights"),
+    ({"vae": {**HEADER["vae"], "scaling_factor": 0.13025}}, "scaling factor"),
+    ({"dataset": {"name": "clothes", "fingerprint": "data1"}}, "dataset revision"),
+    ({"dataset": {"name": "shoes", "fingerprint": "data0"}}, "dataset clothes"),
+])
+def test_mismatch_fails_fast(tmp_path, change, message):
+    write(str(tmp_path))
+    with pytest.raises(CacheMismatchError, match=message):
+        load_latent_cache(str(tmp_path), expected={**HEADER, **change})
+
+
+def test_unknown_fingerprints_compare_names():
+    unknown = {**HEADER, "vae": {"model": "tiny-sd", "fingerprint": None, "scaling_factor": None}}
+    check_header(HEADER, unknown)
+    with pytest.raises(CacheMismatchError):
+        check_header(HEADER, {**unknown, "vae": {**unknown["vae"], "model": "other"}})
+
+
+def test_corrupt_shard_fails_checksum(tmp_path):
+    cache_dir = str(tmp_path)
+    write(cache_dir)
+    path = os.path.join(cache_dir, "shard-00001.npy")
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 1]))
+    with pytest.raises(CacheMismatchError, match="checksum"):
+        load_latent_cache(cache_dir)
+    # Sizes still match, so a size-only check passes
+    assert load_latent_cache(cache_dir, verify=False) is not None
+
+
+def test_fp16_halves_latents(tmp_path):
+    write(str(tmp_path / "fp32"))
+    write(str(tmp_path / "fp16"), dtype="float16")
+    latents, _ = load_latent_cache(str(tmp_path / "fp16"))
+    assert latents[0].dtype == torch.float16
+    size = lambda d: sum(os.path.getsize(os.path.join(d, n)) - 128 for n in os.listdir(d) if n.endswith(".npy"))
+    assert size(str(tmp_path / "fp16")) * 2 == size(str(tmp_path / "fp32"))
+
+
+def test_legacy_and_missing_caches(tmp_path):
+    assert load_latent_cache(str(tmp_path)) is None
+    np.save(str(tmp_path / "unused.npy"), np.zeros(1))
+    open(tmp_path / "latents.pt", "wb").close()
+    with pytest.raises(CacheMismatchError, match="latents.pt"):
+        load_latent_cache(str(tmp_path))
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from memory_planner import (
+    _attention_options, apply_plan, estimate_unet_bytes, ff_chunk_size, plan_memory, sdpa_available,
+)
+from tiny_pipeline import build_tiny_pipeline
+
+SD15_UNET = SimpleNamespace(
+    block_out_channels=(320, 640, 1280, 1280),
+    num_attention_heads=None,
+    attention_head_dim=8,
+    down_block_types=("CrossAttnDownBlock2D",) * 3 + ("DownBlock2D",),
+    up_block_types=("UpBlock2D",) + ("CrossAttnUpBlock2D",) * 3,
+    mid_block_type="UNetMidBlock2DCrossAttn",
+    layers_per_block=2,
+)
+
+
+@pytest.fixture(scope="module")
+def pipe():
+    return build_tiny_pipeline("small")
+
+
+def test_ff_chunk_divides_mid_block_tokens():
+    # 64x64 latents: transformers at 4096, 1024, 256 tokens and the 8x8 mid block at 64
+    assert ff_chunk_size(SD15_UNET, 512, 512) == 64
+    assert ff_chunk_size(SD15_UNET, 768, 512) == 96
+
+
+def test_sliced_attention_offered_alongside_sdpa():
+    kinds = [attention for attention, _, _ in _attention_options(SD15_UNET, None)]
+    assert kinds[0] == ("sdpa" if sdpa_available() else "full")
+    assert "sliced" in kinds
+
+
+def unet_forward(pipe, height, width):
+    generator = torch.Generator().manual_seed(0)
+    sample = torch.randn(2, 4, height // 8, width // 8, generator=generator)
+    context = torch.randn(2, 77, pipe.text_encoder.config.hidden_size, generator=generator)
+    with torch.no_grad():
+        return pipe.unet(sample, 10, encoder_hidden_states=context).sample
+
+
+def test_planned_forward_with_ff_chunking(pipe):
+    height = width = 64
+    config = pipe.unet.config
+    chunk = ff_chunk_size(config, height, width)
+    assert chunk is not None
+    element_size = torch.empty((), dtype=pipe.unet.dtype).element_size()
+    # Room for chunked feed-forward, not for the whole sequence at once
+    budget = estimate_unet_bytes(config, 2, height, width, element_size, "sdpa", None, chunk)
+    assert budget < estimate_unet_bytes(config, 2, height, width, element_size, "sdpa", None, None)
+
+    reference = unet_forward(pipe, height, width)
+    plan = plan_memory(pipe, 1, height, width, budget=budget)
+    assert plan.ff_chunk_size == chunk
+    try:
+        apply_plan(pipe, plan)
+        chunked = unet_forward(pipe, height, width)
+    finally:
+        apply_plan(pipe, plan_memory(pipe, 1, height, width, budget=2 ** 40))
+    torch.testing.assert_close(chunked, reference, rtol=1e-4, atol=1e-5)
+
+
+def test_roomy_budget_uses_fastest_settings(pipe):
+    plan = plan_memory(pipe, 1, 64, 64, budget=2 ** 40)
+    assert plan.fits
+    assert plan.ff_chunk_size is None and plan.attention_slice_size is None
+    assert not plan.vae_slicing
+
+
+def test_plan_over_budget_picks_smallest_estimate(pipe):
+    plan = plan_memory(pipe, 4, 64, 64, budget=1)
+    assert not plan.fits
+    apply_plan(pipe, plan)
+    try:
+        assert unet_forward(pipe, 64, 64).shape == (2, 4, 8, 8)
+    finally:
+        apply_plan(pipe, plan_memory(pipe, 1, 64, 64, budget=2 ** 40))
@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+from single_flight import SingleFlight, flight_key
+
+
+class Cancelled(Exception):
+    pass
+
+
+def run_batch(callbacks, steps, progress, started=None, release=None):
+    """Like inference_hf_model's batched step callback: stops once every output has failed"""
+    errors = [None] * len(callbacks)
+    for step in range(steps):
+        if step == 1 and started is not None:
+            started.set()
+            release.wait(5)
+        progress.append(step)
+        for index, callback in enumerate(callbacks):
+            if errors[index] is not None:
+                continue
+            try:
+                callback(step + 1, steps)
+            except Exception as e:
+                errors[index] = e
+        if all(error is not None for error in errors):
+            raise errors[0]
+    return ["image"] * len(callbacks)
+
+
+def cancel_at(step):
+    def callback(current, total, latents=None):
+        if current >= step:
+            raise Cancelled()
+    return callback
+
+
+def test_flight_key_requires_seed_unless_unseeded_allowed():
+    params = {"prompt": "a shirt", "steps": 10, "guidance_scale": 7.5, "height": 64, "width": 64, "seed": None}
+    assert flight_key(params, "model", "main") is None
+    assert flight_key(params, "model", "main", include_unseeded=True) is not None
+    seeded = dict(params, seed=1)
+    assert flight_key(seeded, "model", "main") == flight_key(dict(seeded, prompt=" a  shirt "), "model", "main")
+
+
+def test_single_waiter_cancel_stops_every_candidate():
+    flights = SingleFlight()
+    progress = []
+    callbacks = [cancel_at(3), None]
+    with pytest.raises(Cancelled):
+        flights.do("key", lambda fan_out: run_batch(fan_out, 10, progress), callbacks)
+    assert len(progress) == 3
+
+
+def test_single_waiter_cancel_stops_when_each_candidate_has_a_callback():
+    flights = SingleFlight()
+    progress = []
+    with pytest.raises(Cancelled):
+        flights.do("key", lambda fan_out: run_batch(fan_out, 10, progress), [cancel_at(3), cancel_at(3)])
+    assert len(progress) == 3
+
+
+def test_follower_keeps_flight_alive_and_shares_result():
+    flights = SingleFlight()
+    progress = []
+    started, release = threading.Event(), threading.Event()
+    outcome = {}
+
+    def leader():
+        try:
+            flights.do("key", lambda fan_out: run_batch(fan_out, 10, progress, started, release), [cancel_at(3), None])
+        except Cancelled:
+            outcome["leader"] = "cancelled"
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait(5)
+
+    follower = {}
+
+    def follow():
+        follower["result"] = flights.do("key", lambda fan_out: pytest.fail("follower ran"), [None, None])
+
+    follower_thread = threading.Thread(target=follow)
+    follower_thread.start()
+    while flights.stats()["followers"] == 0:
+        pass
+    release.set()
+    thread.join(5)
+    follower_thread.join(5)
+
+    assert outcome["leader"] == "cancelled"
+    assert follower["result"] == (["image", "image"], False)
+    assert len(progress) == 10
+
+
+def test_caller_after_abandonment_starts_a_new_flight():
+    flights = SingleFlight()
+    with pytest.raises(Cancelled):
+        flights.do("key", lambda fan_out: run_batch(fan_out, 4, []), [cancel_at(1)])
+    result, leader = flights.do("key", lambda fan_out: run_batch(fan_out, 4, []), [None])
+    assert leader and result == ["image"]
+    assert flights.stats()["in_flight"] == 0
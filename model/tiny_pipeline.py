@@ -0,0 +1,153 @@
+"""
+Small randomly initialised Stable Diffusion pipeline for offline benchmarks
+Builds the UNet, VAE, CLIP text encoder and a byte-level tokenizer locally,
+so nothing is downloaded. Images are noise; only the compute shape matters.
+"""
+import json
+import os
+import tempfile
+
+import torch
+from diffusers import AutoencoderKL, PNDMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+# Model size -> UNet/VAE channels and text-encoder width
+TINY_CONFIGS = {
+    "tiny": {
+        "block_out_channels": (32, 64),
+        "down_block_types": ("DownBlock2D", "CrossAttnDownBlock2D"),
+        "up_block_types": ("CrossAttnUpBlock2D", "UpBlock2D"),
+        "attention_head_dim": 4,
+        "vae_channels": (32, 64),
+        "hidden_size": 32,
+        "text_layers": 2,
+    },
+    "small": {
+        "block_out_channels": (64, 128, 256),
+        "down_block_types": ("CrossAttnDownBlock2D", "CrossAttnDownBlock2D", "DownBlock2D"),
+        "up_block_types": ("UpBlock2D", "CrossAttnUpBlock2D", "CrossAttnUpBlock2D"),
+        "attention_head_dim": 8,
+        "vae_channels": (32, 64, 128),
+        "hidden_size": 128,
+        "text_layers": 4,
+    },
+}
+
+
+def _bytes_to_unicode():
+    # Same byte -> printable character table the CLIP BPE tokenizer uses
+    printable = (
+        list(range(ord("!"), ord("~") + 1))
+        + list(range(ord("¡"), ord("¬") + 1))
+        + list(range(ord("®"), ord("ÿ") + 1))
+    )
+    chars = printable[:]
+    extra = 0
+    for byte in range(256):
+        if byte not in printable:
+            printable.append(byte)
+            chars.append(256 + extra)
+            extra += 1
+    return dict(zip(printable, [chr(c) for c in chars]))
+
+
+def build_tokenizer(directory):
+    """
+    Write a byte-level CLIP vocabulary (no merges) and load it
+
+    Every byte is its own token, so any prompt tokenizes without a download.
+    """
+    vocab = {}
+    for suffix in ("", "</w>"):
+        for char in _bytes_to_unicode().values():
+            vocab[char + suffix] = len(vocab)
+    vocab["<|startoftext|>"] = len(vocab)
+    vocab["<|endoftext|>"] = len(vocab)
+
+    os.makedirs(directory, exist_ok=True)
+    vocab_file = os.path.join(directory, "vocab.json")
+    merges_file = os.path.join(directory, "merges.txt")
+    with open(vocab_file, "w") as f:
+        json.dump(vocab, f)
+    with open(merges_file, "w") as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(vocab_file, merges_file, model_max_length=77)
+
+
+def build_tiny_pipeline(size="tiny", seed=0):
+    """
+    Build a randomly initialised StableDiffusionPipeline
+
+    Args:
+        size: Key of TINY_CONFIGS
+        seed: Seed for weight initialisation, so runs are comparable
+
+    Returns:
+        StableDiffusionPipeline on the CPU in float32
+    """
+    config = TINY_CONFIGS[size]
+    torch.manual_seed(seed)
+
+    unet = UNet2DConditionModel(
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        layers_per_block=1,
+        block_out_channels=config["block_out_channels"],
+        down_block_types=config["down_block_types"],
+        up_block_types=config["up_block_types"],
+        cross_attention_dim=config["hidden_size"],
+        attention_head_dim=config["attention_head_dim"],
+    )
+    vae = AutoencoderKL(
+        in_channels=3,
+        out_channels=3,
+        latent_channels=4,
+        block_out_channels=config["vae_channels"],
+        down_block_types=["DownEncoderBlock2D"] * len(config["vae_channels"]),
+        up_block_types=["UpDecoderBlock2D"] * len(config["vae_channels"]),
+    )
+    with tempfile.TemporaryDirectory() as tokenizer_dir:
+        tokenizer = build_tokenizer(tokenizer_dir)
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=config["hidden_size"],
+        intermediate_size=config["hidden_size"] * 4,
+        num_hidden_layers=config["text_layers"],
+        num_attention_heads=4,
+        max_position_embeddings=77,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    ))
+
+    return StableDiffusionPipeline(
+        unet=unet,
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        # Stable Diffusion v1.5's scheduler config
+        scheduler=PNDMScheduler(
+            beta_start=0.00085,
+            beta_end=0.012,
+            beta_schedule="scaled_linear",
+            set_alpha_to_one=False,
+            skip_prk_steps=True,
+            steps_offset=1,
+        ),
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+
+
+def save_tiny_pipeline(output_dir, size="tiny", seed=0):
+    """
+    Build a tiny pipeline and save it so it loads like a trained model
+    (generate_image(model_path=...), generate.py, MODEL_PATH for the API)
+
+    Returns:
+        output_dir
+    """
+    build_tiny_pipeline(size, seed).save_pretrained(output_dir)
+    return output_dir
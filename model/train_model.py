@@ -14,12 +14,14 @@ from tqdm.auto import tqdm
 import os
 from pathlib import Path
 import numpy as np
-import pickle
+from fast_loader import TRAINING_COMPONENTS, copy_component, load_components
+from latent_cache import cache_header, load_latent_cache, load_text_cache
 
 class ClothesDataset(Dataset):
     """Dataset class for clothes images and text descriptions"""
     
-    def __init__(self, dataset, tokenizer, vae=None, size=512, device="cpu", cached_latents=None, cached_texts=None):
+    def __init__(self, dataset, tokenizer, vae=None, size=512, device="cpu", cached_latents=None, cached_texts=None,
+                 cached_input_ids=None, cached_states=None):
         """
         Args:
             dataset: Hugging Face dataset (only used if cached_latents is None)
@@ -27,11 +29,17 @@ class ClothesDataset(Dataset):
             vae: VAE encoder (only needed if cached_latents is None)
             size: Image size
             device: Device for encoding (only needed if cached_latents is None)
-            cached_latents: Pre-encoded latents tensor (if available, much faster)
+            cached_latents: Pre-encoded latents, a tensor or latent_cache.LatentStore
+                (if available, much faster)
             cached_texts: List of text descriptions (if using cached_latents)
+            cached_input_ids: Pre-tokenized captions (skips the tokenizer)
+            cached_states: Pre-computed text-encoder hidden states (skips the
+                text encoder in the training loop)
         """
         self.tokenizer = tokenizer
         self.size = size
+        self.input_ids = cached_input_ids
+        self.states = cached_states
         
         # Use cached latents if available (much faster!)
         if cached_latents is not None and cached_texts is not None:
@@ -88,34 +96,36 @@ class ClothesDataset(Dataset):
                 # Remove batch dimension
                 latents = latents.squeeze(0)
         
-        # Tokenize text
-        text_inputs = self.tokenizer(
-            text,
-            padding="max_length",
-            max_length=self.tokenizer.model_max_length,
-            truncation=True,
-            return_tensors="pt"
-        )
-        
-        return {
-            "latents": latents.cpu() if not self.use_cache else latents,
-            "input_ids": text_inputs.input_ids.flatten(),
-        }
+        example = {"latents": latents.cpu() if not self.use_cache else latents}
+        if self.states is not None:
+            # Text encoder output cached by preprocess_dataset.py --text_states
+            example["encoder_hidden_states"] = self.states[idx]
+        elif self.input_ids is not None:
+            example["input_ids"] = self.input_ids[idx]
+        else:
+            # Tokenize text
+            text_inputs = self.tokenizer(
+                text,
+                padding="max_length",
+                max_length=self.tokenizer.model_max_length,
+                truncation=True,
+                return_tensors="pt"
+            )
+            example["input_ids"] = text_inputs.input_ids.flatten()
+        return example
 
 def collate_fn(examples):
     """Collate function for DataLoader"""
     latents = [example["latents"] for example in examples]
-    input_ids = [example["input_ids"] for example in examples]
     
     latents = torch.stack(latents)
     latents = latents.to(memory_format=torch.contiguous_format).float()
     
-    input_ids = torch.stack(input_ids)
-    
-    batch = {
-        "latents": latents,
-        "input_ids": input_ids,
-    }
+    batch = {"latents": latents}
+    if "encoder_hidden_states" in examples[0]:
+        batch["encoder_hidden_states"] = torch.stack([example["encoder_hidden_states"] for example in examples]).float()
+    else:
+        batch["input_ids"] = torch.stack([example["input_ids"] for example in examples])
     return batch
 
 def train(
@@ -131,8 +141,16 @@ def train(
     mixed_precision="fp16",
     seed=42,
     cache_dir=None,
+    verify_cache=True,
 ):
-    """Main training function"""
+    """
+    Main training function
+
+    A cache in cache_dir must have been made from this dataset with this
+    model's VAE at this resolution, and pass its checksums (only its file
+    sizes with verify_cache=False); otherwise training stops with
+    latent_cache.CacheMismatchError before any step is run.
+    """
     
     # Disable mixed precision on CPU (it doesn't help and can slow things down)
     use_cpu = not torch.cuda.is_available()
@@ -149,50 +167,21 @@ def train(
     # Set seed
     torch.manual_seed(seed)
     
-    # Load tokenizer and text encoder
-    tokenizer = CLIPTokenizer.from_pretrained(
-        pretrained_model_name_or_path, subfolder="tokenizer"
-    )
-    text_encoder = CLIPTextModel.from_pretrained(
-        pretrained_model_name_or_path, subfolder="text_encoder"
-    )
-    
-    # Load VAE for encoding images to latent space
-    vae = AutoencoderKL.from_pretrained(
-        pretrained_model_name_or_path, subfolder="vae"
-    )
-    
-    # Load scheduler and UNet
-    noise_scheduler = DDPMScheduler.from_pretrained(
-        pretrained_model_name_or_path, subfolder="scheduler"
-    )
-    unet = UNet2DConditionModel.from_pretrained(
-        pretrained_model_name_or_path, subfolder="unet"
-    )
-    
-    # Enable gradient checkpointing for memory efficiency
-    # On CPU, this can slow things down, so make it optional
-    if gradient_checkpointing:
-        if use_cpu:
-            print("CPU detected: Gradient checkpointing may slow training, but helps with memory")
-        unet.enable_gradient_checkpointing()
-    
     # Check if cached latents exist
     cached_latents = None
     cached_texts = None
+    dataset = None
     
     if cache_dir and os.path.exists(cache_dir):
-        latents_path = os.path.join(cache_dir, "latents.pt")
-        texts_path = os.path.join(cache_dir, "texts.pkl")
+        # The dataset is only opened (not decoded) here, for the fingerprint and length the cache must match
+        print(f"Loading pre-cached latents from {cache_dir}...")
+        dataset = load_dataset(dataset_name, split="train")
+        expected = cache_header(dataset_name, dataset, pretrained_model_name_or_path, resolution)
+        cache = load_latent_cache(cache_dir, expected=expected, verify=verify_cache)
         
-        if os.path.exists(latents_path) and os.path.exists(texts_path):
-            print(f"Loading pre-cached latents from {cache_dir}...")
-            cached_latents = torch.load(latents_path)
-            with open(texts_path, "rb") as f:
-                cached_texts = pickle.load(f)
-            print(f"Loaded {len(cached_texts)} pre-cached latents!")
-            # Don't need VAE if using cache
-            vae = None
+        if cache is not None:
+            cached_latents, cached_texts = cache
+            print(f"Loaded {len(cached_texts)} pre-cached latents ({cached_latents.dtype})!")
         else:
             print(f"Cache directory exists but cache files not found. Will encode on-the-fly.")
             print(f"To speed up training, run: python preprocess_dataset.py --cache_dir {cache_dir}")
@@ -204,13 +193,45 @@ def train(
             print("No cache directory specified. Will encode on-the-fly (slow).")
             print("To speed up training, run: python preprocess_dataset.py")
     
-    # Only load VAE if not using cache
-    if cached_latents is None:
+    # Load only what this run needs (no VAE with cached latents), concurrently,
+    # from memory-mapped safetensors; from_pretrained if that isn't possible
+    needed = TRAINING_COMPONENTS + (("vae",) if cached_latents is None else ())
+    try:
+        components = load_components(pretrained_model_name_or_path, needed)
+        tokenizer = components["tokenizer"]
+        text_encoder = components["text_encoder"]
+        unet = components["unet"]
+        vae = components.get("vae")
+    except Exception as e:
+        print(f"Fast load not possible ({e}); using from_pretrained")
+        tokenizer = CLIPTokenizer.from_pretrained(
+            pretrained_model_name_or_path, subfolder="tokenizer"
+        )
+        text_encoder = CLIPTextModel.from_pretrained(
+            pretrained_model_name_or_path, subfolder="text_encoder"
+        )
+        unet = UNet2DConditionModel.from_pretrained(
+            pretrained_model_name_or_path, subfolder="unet"
+        )
         # Load VAE for encoding images to latent space
         vae = AutoencoderKL.from_pretrained(
             pretrained_model_name_or_path, subfolder="vae"
-        )
-        
+        ) if cached_latents is None else None
+    
+    # Load scheduler
+    noise_scheduler = DDPMScheduler.from_pretrained(
+        pretrained_model_name_or_path, subfolder="scheduler"
+    )
+    
+    # Enable gradient checkpointing for memory efficiency
+    # On CPU, this can slow things down, so make it optional
+    if gradient_checkpointing:
+        if use_cpu:
+            print("CPU detected: Gradient checkpointing may slow training, but helps with memory")
+        unet.enable_gradient_checkpointing()
+    
+    # The VAE is only loaded when not using cache
+    if cached_latents is None:
         # Freeze VAE
         vae.requires_grad_(False)
         vae.eval()
@@ -229,8 +250,9 @@ def train(
         vae = vae.to(encoding_device)
         
         # Load dataset
-        print("Loading dataset...")
-        dataset = load_dataset(dataset_name, split="train")
+        if dataset is None:
+            print("Loading dataset...")
+            dataset = load_dataset(dataset_name, split="train")
         
         # Create dataset wrapper (will encode images to latents on-the-fly)
         print("Dataset ready. Images will be encoded to latent space during training...")
@@ -238,16 +260,21 @@ def train(
             dataset, tokenizer, vae=vae, size=resolution, device=encoding_device
         )
     else:
-        # Load dataset just for compatibility (not actually used)
-        dataset = load_dataset(dataset_name, split="train")
+        # Token ids and text-encoder states are used only if they match this tokenizer / text encoder
+        cached_input_ids, cached_states = load_text_cache(cache_dir, tokenizer, text_encoder)
+        if cached_states is not None:
+            print("Using cached text-encoder states (no tokenizer or text encoder per step)")
+        elif cached_input_ids is not None:
+            print("Using cached token ids")
         
-        # Create dataset wrapper using cached latents
+        # Create dataset wrapper using cached latents (memory-mapped, read per item)
         train_dataset = ClothesDataset(
-            dataset, tokenizer, cached_latents=cached_latents, cached_texts=cached_texts
+            None, tokenizer, cached_latents=cached_latents, cached_texts=cached_texts,
+            cached_input_ids=cached_input_ids, cached_states=cached_states,
         )
     
     # Create dataloader
-    # Can use more workers if using cached latents
+    # Can use more workers if using cached latents; they share the mapped cache files
     num_workers = 2 if cached_latents is not None else 0
     train_dataloader = DataLoader(
         train_dataset,
@@ -304,9 +331,12 @@ def train(
                 # Add noise to latents
                 noisy_latents = noise_scheduler.add_noise(latents, noise, timesteps)
                 
-                # Get text embeddings
-                with torch.no_grad():
-                    encoder_hidden_states = text_encoder(batch["input_ids"].to(accelerator.device))[0]
+                # Get text embeddings (precomputed when cached)
+                if "encoder_hidden_states" in batch:
+                    encoder_hidden_states = batch["encoder_hidden_states"].to(accelerator.device)
+                else:
+                    with torch.no_grad():
+                        encoder_hidden_states = text_encoder(batch["input_ids"].to(accelerator.device))[0]
                 
                 # Predict noise
                 model_pred = unet(noisy_latents, timesteps, encoder_hidden_states).sample
@@ -348,8 +378,8 @@ def train(
     # Only save VAE if we loaded it (not using cache)
     if cached_latents is None:
         vae.save_pretrained(os.path.join(output_dir, "vae"))
-    else:
-        # Load VAE just to save it
+    elif not copy_component(pretrained_model_name_or_path, "vae", output_dir):
+        # Not available locally: load VAE just to save it
         vae = AutoencoderKL.from_pretrained(pretrained_model_name_or_path, subfolder="vae")
         vae.save_pretrained(os.path.join(output_dir, "vae"))
     
@@ -370,6 +400,8 @@ if __name__ == "__main__":
     parser.add_argument("--resolution", type=int, default=512)
     parser.add_argument("--cache_dir", type=str, default="./data/cached_latents", 
                        help="Directory with pre-cached latents (run preprocess_dataset.py first)")
+    parser.add_argument("--no_verify_cache", dest="verify_cache", action="store_false",
+                        help="Check only the cache's file sizes, not their sha256 (faster start on large caches)")
     
     args = parser.parse_args()
     
@@ -381,5 +413,6 @@ if __name__ == "__main__":
         max_train_steps=args.max_steps,
         resolution=args.resolution,
         cache_dir=args.cache_dir,
+        verify_cache=args.verify_cache,
     )
 
@@ -0,0 +1,129 @@
+"""
+VAE decode modes for large outputs, previews and drafts
+"full" runs the normal decoder. "tiled" decodes (and encodes) in overlapping
+tiles blended at the seams, so peak memory depends on the tile size rather
+than the image size. "tiny" swaps in a TAESD-style tiny autoencoder: much
+faster and lighter, slightly softer images.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+import torch
+from diffusers import AutoencoderTiny
+
+VAE_MODES = ("auto", "full", "tiled", "tiny")
+
+# Tile side in output pixels and the fraction of each tile overlapping its neighbour
+VAE_TILE_SIZE = int(os.getenv("VAE_TILE_SIZE", "512"))
+VAE_TILE_OVERLAP = float(os.getenv("VAE_TILE_OVERLAP", "0.25"))
+# "auto" tiles outputs with more pixels than this and decodes smaller ones in one go
+VAE_AUTO_TILE_PIXELS = int(os.getenv("VAE_AUTO_TILE_PIXELS", str(640 * 640)))
+# Hugging Face ID or path of the tiny autoencoder (default: TAESD for the model family)
+TINY_VAE = os.getenv("TINY_VAE", None)
+
+TINY_VAE_DEFAULTS = {False: "madebyollin/taesd", True: "madebyollin/taesdxl"}
+
+_tiny_vaes = {}
+_tiny_lock = threading.Lock()
+
+
+def resolve_vae_mode(name):
+    """
+    Canonical VAE mode name
+
+    Raises:
+        ValueError: If the mode is unknown
+    """
+    mode = (name or "auto").lower()
+    if mode not in VAE_MODES:
+        raise ValueError(f"Unknown vae_mode '{name}' (choose from {', '.join(VAE_MODES)})")
+    return mode
+
+
+def effective_vae_mode(mode, height, width):
+    """The mode actually used for an output size ("auto" becomes full or tiled)"""
+    mode = resolve_vae_mode(mode)
+    if mode == "auto":
+        return "tiled" if height * width > VAE_AUTO_TILE_PIXELS else "full"
+    return mode
+
+
+def load_tiny_vae(sdxl=False, device="cpu", dtype=torch.float32, model_id=None):
+    """
+    Tiny autoencoder matching the model family, loaded once per device/dtype
+
+    Args:
+        sdxl: Use the SDXL latent space
+        device: Device to load onto
+        dtype: Weight dtype
+        model_id: Hugging Face ID or path (defaults to TINY_VAE, then TAESD)
+    """
+    model_id = model_id or TINY_VAE or TINY_VAE_DEFAULTS[bool(sdxl)]
+    key = (model_id, str(device), str(dtype))
+    with _tiny_lock:
+        if key not in _tiny_vaes:
+            print(f"Loading tiny autoencoder {model_id}...")
+            _tiny_vaes[key] = AutoencoderTiny.from_pretrained(model_id, torch_dtype=dtype).to(device).eval()
+        return _tiny_vaes[key]
+
+
+def configure_tiling(vae, tile_size=VAE_TILE_SIZE, overlap=VAE_TILE_OVERLAP):
+    """Set an AutoencoderKL's tile size (output pixels) and overlap, and turn tiling on"""
+    scale = 2 ** (len(vae.config.block_out_channels) - 1)
+    vae.tile_sample_min_size = tile_size
+    vae.tile_latent_min_size = tile_size // scale
+    vae.tile_overlap_factor = overlap
+    vae.enable_tiling()
+
+
+@contextmanager
+def use_vae(pipe, mode, height, width):
+    """
+    Decode with the given mode for the duration of the block
+
+    The pipeline's own VAE and tiling setting are restored afterwards, so
+    requests with different modes can share a resident pipeline.
+
+    Args:
+        pipe: Diffusers pipeline (exclusive use, as from get_pipeline)
+        mode: One of VAE_MODES (None = "auto")
+        height: Output height in pixels
+        width: Output width in pixels
+    """
+    mode = effective_vae_mode(mode, height, width)
+    vae = pipe.vae
+    was_tiling = getattr(vae, "use_tiling", False)
+    try:
+        if mode == "tiny":
+            pipe.vae = load_tiny_vae("XL" in type(pipe).__name__, device=vae.device, dtype=vae.dtype)
+        elif mode == "tiled":
+            configure_tiling(vae)
+        elif was_tiling:
+            vae.disable_tiling()
+        yield pipe
+    finally:
+        pipe.vae = vae
+        if was_tiling:
+            vae.enable_tiling()
+        elif hasattr(vae, "disable_tiling"):
+            vae.disable_tiling()
+
+
+@torch.inference_mode()
+def tiny_preview(latents, sdxl=False):
+    """
+    Decode latents with the tiny autoencoder for a preview
+
+    Args:
+        latents: Latents of shape (4, h, w) or (1, 4, h, w), as the pipeline
+            holds them (already scaled)
+
+    Returns:
+        Float tensor (3, 8h, 8w) in [0, 1]
+    """
+    if latents.dim() == 3:
+        latents = latents.unsqueeze(0)
+    vae = load_tiny_vae(sdxl)
+    image = vae.decode(latents.to(vae.device, vae.dtype) / vae.config.scaling_factor).sample[0]
+    return ((image.float() + 1.0) / 2.0).clamp(0, 1)
@@ -0,0 +1,125 @@
+"""
+Startup preloading and warm-up generations
+Tracks whether the server is loading, warming or ready to take traffic
+"""
+import threading
+import time
+
+LOADING = "loading"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+def parse_resolutions(spec):
+    """
+    Parse a resolution list such as "512x512,768x512" (or "512" for square)
+
+    Returns:
+        List of (height, width) tuples
+    """
+    resolutions = []
+    for part in (spec or "").split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        if "x" in part:
+            height, width = part.split("x", 1)
+        else:
+            height = width = part
+        resolutions.append((int(height), int(width)))
+    return resolutions
+
+
+class Readiness:
+    """
+    Preload state reported by /ready
+
+    The server is ready once the model is resident and every warm-up
+    generation has succeeded. A failed load or warm-up leaves it failed, so
+    orchestrators keep traffic away from a model that can't generate.
+    """
+
+    def __init__(self):
+        self.status = LOADING
+        self.error = None
+        self.load_seconds = None
+        self.warmups = []
+        self.started_at = time.time()
+        self.ready_at = None
+        self._lock = threading.Lock()
+
+    def start(self, load, warm, resolutions, steps):
+        """
+        Load and warm up on a background thread
+
+        Args:
+            load: Callable that makes the model resident
+            warm: Callable(height, width, steps) running one generation
+            resolutions: List of (height, width) to warm up
+            steps: Denoising steps per warm-up generation
+        """
+        thread = threading.Thread(
+            target=self.run, args=(load, warm, resolutions, steps), name="preload", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def run(self, load, warm, resolutions, steps):
+        """Load and warm up on the calling thread"""
+        start = time.perf_counter()
+        try:
+            load()
+        except Exception as e:
+            print(f"Preloading failed: {e}")
+            self._set(FAILED, error=str(e))
+            return
+        with self._lock:
+            self.load_seconds = round(time.perf_counter() - start, 3)
+            self.status = WARMING
+
+        failures = []
+        for height, width in resolutions:
+            warm_start = time.perf_counter()
+            record = {"height": height, "width": width, "steps": steps}
+            try:
+                warm(height, width, steps)
+                record["seconds"] = round(time.perf_counter() - warm_start, 3)
+                print(f"✅ Warm-up at {width}x{height} took {record['seconds']}s")
+            except Exception as e:
+                record["error"] = str(e)
+                failures.append(f"{width}x{height}: {e}")
+                print(f"Warm-up at {width}x{height} failed: {e}")
+            with self._lock:
+                self.warmups.append(record)
+
+        if failures:
+            self._set(FAILED, error="Warm-up failed at " + "; ".join(failures))
+            return
+        self._set(READY)
+        print(f"✅ Ready after {self.ready_at - self.started_at:.1f}s")
+
+    def mark_ready(self):
+        """Skip preloading (the model then loads on the first request)"""
+        self._set(READY)
+
+    def is_ready(self):
+        with self._lock:
+            return self.status == READY
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "status": self.status,
+                "error": self.error,
+                "load_seconds": self.load_seconds,
+                "warmup": list(self.warmups),
+                "seconds_to_ready": round(self.ready_at - self.started_at, 3) if self.ready_at else None,
+            }
+
+    def _set(self, status, error=None):
+        with self._lock:
+            self.status = status
+            self.error = error
+            if status == READY:
+                self.ready_at = time.time()
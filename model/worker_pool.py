@@ -0,0 +1,616 @@
+"""
+Multi-process generation workers with shared memory-mapped weights
+The API process dispatches each batch to an idle worker process. Workers are
+pinned to disjoint sets of physical cores and load the model with
+MMAP_WEIGHTS, so all of them read the same page-cache copy of the
+safetensors files instead of holding one copy each.
+
+Run as a script to measure throughput scaling from 1 to N workers:
+    python worker_pool.py --model_path ./models/clothes-diffusion --workers 1 2 4 --steps 10
+"""
+import argparse
+import itertools
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+
+from metrics import BATCH_SIZE, UNET_STEP_SECONDS, record_stage
+from shared_weights import memory_usage
+
+# torch is imported inside the worker, after its CPU affinity and thread
+# variables are set, so OpenMP sizes its pool for the pinned cores only
+
+
+class TaskCancelled(Exception):
+    """Raised in a worker once every request in its batch has gone away"""
+
+
+def physical_cores():
+    """
+    Logical CPUs this process may run on, grouped by physical core
+
+    Returns:
+        Sorted list of lists of CPU ids (hyper-thread siblings together)
+    """
+    groups = {}
+    for cpu in sorted(os.sched_getaffinity(0)):
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list") as f:
+                siblings = f.read().strip()
+        except OSError:
+            siblings = str(cpu)
+        groups.setdefault(siblings, []).append(cpu)
+    return sorted(groups.values())
+
+
+def cpu_sets(num_workers, cores_per_worker=None):
+    """
+    Split the available physical cores into one disjoint set per worker
+
+    Args:
+        num_workers: Number of worker processes
+        cores_per_worker: Physical cores per worker (default: an even split)
+
+    Returns:
+        List of (logical CPU ids, physical core count) per worker
+    """
+    cores = physical_cores()
+    per_worker = cores_per_worker or max(1, len(cores) // num_workers)
+    if per_worker * num_workers > len(cores):
+        print(f"Warning: {num_workers} workers x {per_worker} cores exceeds the {len(cores)} "
+              f"physical cores available; core sets will overlap")
+    sets = []
+    for index in range(num_workers):
+        assigned = [cores[(index * per_worker + offset) % len(cores)] for offset in range(per_worker)]
+        sets.append((sorted(cpu for core in assigned for cpu in core), per_worker))
+    return sets
+
+
+class _Worker:
+    """Front-side handle for one worker process"""
+
+    def __init__(self, index, cpus, threads):
+        self.index = index
+        self.cpus = cpus
+        self.threads = threads
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.alive = True
+        self.error = None
+        self.info = {}
+        self.task = None
+        self.tasks = 0
+        self.images = 0
+        self.busy_seconds = 0.0
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+
+class _Task:
+    """One batch in flight on a worker"""
+
+    def __init__(self, task_id, requests):
+        self.id = task_id
+        self.callbacks = [r.get("step_callback") for r in requests]
+        self.timers = [r.get("timer") for r in requests]
+        self.errors = [None] * len(requests)
+        self.future = Future()
+
+
+class WorkerPool:
+    """
+    Generation worker processes behind the same calls as inference_hf_model
+
+    generate_image / generate_images_batch block until a worker is idle, run
+    the batch there and return its images. Step callbacks and StageTimers
+    stay in the calling process; workers stream step events back to them.
+    """
+
+    def __init__(self, model_to_load, num_workers, cores_per_worker=None, load_concurrency=1,
+                 startup_timeout=1800):
+        """
+        Args:
+            model_to_load: Model path or Hugging Face ID every worker serves
+            num_workers: Number of worker processes
+            cores_per_worker: Physical cores pinned to each worker (default:
+                the available cores split evenly)
+            load_concurrency: Workers loading weights at the same time. Each
+                load holds a private copy until the weights are remapped, so
+                1 keeps the startup peak at about one extra model.
+            startup_timeout: Seconds to wait for every worker to load
+        """
+        self.model_to_load = model_to_load
+        self.load_concurrency = max(1, load_concurrency)
+        self.startup_timeout = startup_timeout
+        self._workers = [
+            _Worker(index, cpus, threads)
+            for index, (cpus, threads) in enumerate(cpu_sets(num_workers, cores_per_worker))
+        ]
+        self._idle = queue.Queue()
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._task_ids = itertools.count(1)
+
+    def start(self):
+        """Launch the workers and wait until every one has loaded the model"""
+        with self._start_lock:
+            if self._started:
+                return
+            authkey = os.urandom(16)
+            listener = Listener(authkey=authkey)
+            for worker in self._workers:
+                worker.process = self._launch(worker, listener.address, authkey)
+            self._accept(listener)
+            listener.close()
+
+            for worker in self._workers:
+                threading.Thread(target=self._read, args=(worker,), name=f"worker-{worker.index}", daemon=True).start()
+
+            # Load a few workers at a time; later loads hit the warm page cache
+            deadline = time.time() + self.startup_timeout
+            for start in range(0, len(self._workers), self.load_concurrency):
+                group = self._workers[start:start + self.load_concurrency]
+                for worker in group:
+                    worker.send(("load",))
+                for worker in group:
+                    if not worker.ready.wait(max(0, deadline - time.time())):
+                        self.stop()
+                        raise RuntimeError(f"Worker {worker.index} did not load within {self.startup_timeout}s")
+                    if worker.error:
+                        self.stop()
+                        raise RuntimeError(f"Worker {worker.index} failed to load: {worker.error}")
+                    print(f"✅ Worker {worker.index} ready on CPUs {worker.cpus} "
+                          f"({worker.info.get('load_seconds', 0):.1f}s)")
+            for worker in self._workers:
+                self._idle.put(worker)
+            self._started = True
+
+    def _launch(self, worker, address, authkey):
+        env = dict(
+            os.environ,
+            MMAP_WEIGHTS=os.getenv("MMAP_WEIGHTS", "True"),
+            OMP_NUM_THREADS=str(worker.threads),
+            MKL_NUM_THREADS=str(worker.threads),
+            CPU_THREADS=str(worker.threads),
+            WORKER_AUTHKEY=authkey.hex(),
+        )
+        return subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve", address,
+             "--index", str(worker.index), "--cpus", ",".join(map(str, worker.cpus)),
+             "--model", self.model_to_load],
+            env=env,
+        )
+
+    def _accept(self, listener):
+        # accept() blocks, so run it aside and watch for workers dying on startup
+        connections = queue.Queue()
+
+        def accept():
+            for _ in self._workers:
+                try:
+                    conn = listener.accept()
+                except OSError:
+                    return
+                connections.put(conn)
+
+        threading.Thread(target=accept, daemon=True).start()
+        pending = len(self._workers)
+        while pending:
+            try:
+                conn = connections.get(timeout=0.5)
+            except queue.Empty:
+                if any(worker.process.poll() is not None for worker in self._workers):
+                    self.stop()
+                    raise RuntimeError("A worker process exited during startup")
+                continue
+            _, index = conn.recv()
+            self._workers[index].conn = conn
+            pending -= 1
+
+    def _read(self, worker):
+        """Handle messages from one worker until it exits"""
+        while True:
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == "ready":
+                worker.info = message[1]
+                worker.ready.set()
+            elif kind == "load_failed":
+                worker.error = message[1]
+                worker.ready.set()
+            elif kind == "step":
+                self._on_step(worker, *message[1:])
+            elif kind == "done":
+                self._on_done(*message[1:])
+            elif kind == "failed":
+                self._on_failed(*message[1:])
+
+        worker.alive = False
+        worker.error = worker.error or "worker exited"
+        worker.ready.set()
+        task = worker.task
+        if task is not None and not task.future.done():
+            task.future.set_exception(RuntimeError(f"Worker {worker.index} exited during generation"))
+
+    def _on_step(self, worker, task_id, index, step, total_steps, latents):
+        task = self._tasks.get(task_id)
+        if task is None or task.callbacks[index] is None or task.errors[index] is not None:
+            return
+        if latents is not None:
+            import torch
+            latents = torch.from_numpy(latents)
+        try:
+            task.callbacks[index](step, total_steps, latents)
+        except Exception as e:
+            task.errors[index] = e
+            # Same rule as in-process batches: stop once nobody is waiting
+            if all(error is not None for error in task.errors):
+                worker.send(("cancel", task_id))
+
+    def _on_done(self, task_id, images, stages, step_seconds):
+        task = self._tasks.get(task_id)
+        if task is None:
+            return
+        BATCH_SIZE.observe(len(images))
+        for stage, seconds in stages.items():
+            record_stage(stage, seconds, task.timers)
+        for seconds in step_seconds:
+            UNET_STEP_SECONDS.observe(seconds)
+            for timer in task.timers:
+                if timer is not None:
+                    timer.add_step(seconds)
+        task.future.set_result([
+            error if error is not None else image for image, error in zip(images, task.errors)
+        ])
+
+    def _on_failed(self, task_id, message):
+        task = self._tasks.get(task_id)
+        if task is None:
+            return
+        if all(error is not None for error in task.errors):
+            task.future.set_result(list(task.errors))
+        else:
+            task.future.set_exception(RuntimeError(message))
+
+    def _acquire(self):
+        self.start()
+        while True:
+            try:
+                worker = self._idle.get(timeout=1.0)
+            except queue.Empty:
+                if not any(worker.alive for worker in self._workers):
+                    raise RuntimeError("All worker processes have exited")
+                continue
+            if worker.alive:
+                return worker
+
+    def _run_on(self, worker, requests, num_inference_steps, height, width, scheduler, vae_mode=None,
+                refine=None):
+        task = _Task(next(self._task_ids), requests)
+        with self._lock:
+            self._tasks[task.id] = task
+        worker.task = task
+        start = time.perf_counter()
+        try:
+            worker.send(("run", task.id, {
+                "requests": [
+                    {
+                        "prompt": r["prompt"],
+                        "negative_prompt": r.get("negative_prompt"),
+                        "guidance_scale": r.get("guidance_scale", 7.5),
+                        "seed": r.get("seed"),
+                        "progress": r.get("step_callback") is not None,
+                    }
+                    for r in requests
+                ],
+                "num_inference_steps": num_inference_steps,
+                "height": height,
+                "width": width,
+                "scheduler": scheduler,
+                "vae_mode": vae_mode,
+                "refine": refine,
+            }))
+            return task.future.result()
+        finally:
+            worker.task = None
+            worker.tasks += 1
+            worker.images += len(requests)
+            worker.busy_seconds += time.perf_counter() - start
+            with self._lock:
+                del self._tasks[task.id]
+
+    def generate_images_batch(self, requests, model_id=None, model_path=None, output_path=None,
+                              num_inference_steps=50, height=512, width=512, scheduler=None, vae_mode=None,
+                              refine=None):
+        """
+        Drop-in for inference_hf_model.generate_images_batch on an idle worker
+
+        The pool always serves the model it was started with, so model_id and
+        model_path are ignored, and images are never saved (output_path).
+
+        Returns:
+            List of PIL Images, or the exception raised by a request's step_callback
+        """
+        timers = [r.get("timer") for r in requests]
+        wait_start = time.perf_counter()
+        worker = self._acquire()
+        record_stage("worker_wait", time.perf_counter() - wait_start, timers)
+        try:
+            return self._run_on(worker, requests, num_inference_steps, height, width, scheduler, vae_mode, refine)
+        finally:
+            if worker.alive:
+                self._idle.put(worker)
+
+    def generate_image(self, prompt, model_id=None, model_path=None, output_path=None, num_inference_steps=50,
+                       guidance_scale=7.5, height=512, width=512, seed=None, negative_prompt=None,
+                       step_callback=None, scheduler=None, timer=None, vae_mode=None, refine=None):
+        """Drop-in for inference_hf_model.generate_image on an idle worker"""
+        result = self.generate_images_batch(
+            [{
+                "prompt": prompt,
+                "negative_prompt": negative_prompt,
+                "guidance_scale": guidance_scale,
+                "seed": seed,
+                "step_callback": step_callback,
+                "timer": timer,
+            }],
+            num_inference_steps=num_inference_steps,
+            height=height,
+            width=width,
+            scheduler=scheduler,
+            vae_mode=vae_mode,
+            refine=refine,
+        )[0]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def warm_up(self, height, width, steps):
+        """Run one throwaway generation on every worker at once"""
+        workers = [self._acquire() for _ in self._workers]
+        request = [{"prompt": "warm-up", "seed": 0}]
+        try:
+            with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+                list(pool.map(lambda w: self._run_on(w, request, steps, height, width, None), workers))
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+
+    def stats(self):
+        """Per-worker CPU sets, task counts, utilisation and memory"""
+        workers = []
+        for worker in self._workers:
+            pid = worker.process.pid if worker.process else None
+            workers.append({
+                "index": worker.index,
+                "pid": pid,
+                "cpus": worker.cpus,
+                "alive": worker.alive and worker.process is not None,
+                "busy": worker.task is not None,
+                "tasks": worker.tasks,
+                "images": worker.images,
+                "busy_seconds": round(worker.busy_seconds, 2),
+                "load_seconds": worker.info.get("load_seconds"),
+                "memory": memory_usage(pid) if pid else {},
+            })
+        return {
+            "model": self.model_to_load,
+            "workers": workers,
+            "idle": self._idle.qsize(),
+            # PSS splits shared pages, so this is the workers' real combined footprint
+            "total_pss_bytes": sum(w["memory"].get("pss", 0) for w in workers),
+            "total_rss_bytes": sum(w["memory"].get("rss", 0) for w in workers),
+        }
+
+    def stop(self):
+        for worker in self._workers:
+            if worker.conn is not None and worker.alive:
+                try:
+                    worker.send(("stop",))
+                except OSError:
+                    pass
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+        self._started = False
+
+
+def serve(address, index, cpus, model_to_load):
+    """Worker process main loop: load the model, then run batches until told to stop"""
+    os.sched_setaffinity(0, cpus)
+    conn = Client(address, authkey=bytes.fromhex(os.environ["WORKER_AUTHKEY"]))
+    conn.send(("hello", index))
+
+    import torch
+    from inference_hf_model import generate_images_batch, get_device_and_dtype, get_pipeline
+    from metrics import StageTimer
+    torch.set_num_threads(int(os.environ["OMP_NUM_THREADS"]))
+
+    commands = queue.Queue()
+    cancelled = set()
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def read():
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                # The API process is gone; nobody is left to return images to
+                os._exit(0)
+            if message[0] == "cancel":
+                cancelled.add(message[1])
+            else:
+                commands.put(message)
+
+    threading.Thread(target=read, daemon=True).start()
+
+    if commands.get()[0] != "load":
+        return
+    start = time.perf_counter()
+    try:
+        device, dtype = get_device_and_dtype()
+        with get_pipeline(model_to_load, device=device, dtype=dtype):
+            pass
+    except Exception as e:
+        send(("load_failed", str(e)))
+        return
+    send(("ready", {"load_seconds": time.perf_counter() - start, "memory": memory_usage()}))
+
+    def progress(task_id, index):
+        def on_step(step, total_steps, latents):
+            if task_id in cancelled:
+                raise TaskCancelled()
+            if latents is not None:
+                latents = latents.float().cpu().numpy()
+            send(("step", task_id, index, step, total_steps, latents))
+        return on_step
+
+    while True:
+        message = commands.get()
+        if message[0] == "stop":
+            return
+        _, task_id, params = message
+        timer = StageTimer()
+        requests = params["requests"]
+        for index, request in enumerate(requests):
+            if request.pop("progress"):
+                request["step_callback"] = progress(task_id, index)
+        # Batch-level stages are the same for every request; time them once
+        requests[0]["timer"] = timer
+        try:
+            images = generate_images_batch(
+                requests,
+                model_id=model_to_load,
+                model_path=model_to_load,
+                output_path=None,
+                num_inference_steps=params["num_inference_steps"],
+                height=params["height"],
+                width=params["width"],
+                scheduler=params["scheduler"],
+                vae_mode=params["vae_mode"],
+                refine=params["refine"],
+            )
+        except TaskCancelled:
+            send(("failed", task_id, "cancelled"))
+            continue
+        except Exception as e:
+            send(("failed", task_id, f"{type(e).__name__}: {e}"))
+            continue
+        finally:
+            cancelled.discard(task_id)
+        images = [None if isinstance(image, BaseException) else image for image in images]
+        send(("done", task_id, images, dict(timer.stages), list(timer.step_seconds)))
+
+
+def benchmark(model_to_load, worker_counts, cores_per_worker, steps, size, requests_per_worker, batch_size):
+    """
+    Throughput with 1..N workers under a saturating closed-loop load
+
+    Returns:
+        List of result dicts (images/s, speedup and efficiency vs the first
+        worker count, combined worker RSS and PSS)
+    """
+    results = []
+    for num_workers in worker_counts:
+        pool = WorkerPool(model_to_load, num_workers, cores_per_worker)
+        pool.start()
+        try:
+            pool.warm_up(size, size, steps)
+            batches = num_workers * requests_per_worker
+
+            def run(index):
+                pool.generate_images_batch(
+                    [{"prompt": f"a red cotton shirt, variant {index}-{i}", "seed": index * batch_size + i}
+                     for i in range(batch_size)],
+                    num_inference_steps=steps, height=size, width=size,
+                )
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=num_workers) as clients:
+                list(clients.map(run, range(batches)))
+            elapsed = time.perf_counter() - start
+            stats = pool.stats()
+        finally:
+            pool.stop()
+
+        result = {
+            "workers": num_workers,
+            "cpus_per_worker": len(stats["workers"][0]["cpus"]),
+            "images": batches * batch_size,
+            "seconds": round(elapsed, 3),
+            "images_per_s": round(batches * batch_size / elapsed, 3),
+            "total_rss_mb": round(stats["total_rss_bytes"] / 1024 ** 2, 1),
+            "total_pss_mb": round(stats["total_pss_bytes"] / 1024 ** 2, 1),
+        }
+        baseline = results[0] if results else result
+        result["speedup"] = round(result["images_per_s"] / baseline["images_per_s"], 2)
+        result["efficiency"] = round(result["speedup"] * baseline["workers"] / num_workers, 2)
+        results.append(result)
+        print(f"{num_workers} worker(s): {result['images_per_s']} img/s, speedup {result['speedup']}x, "
+              f"RSS {result['total_rss_mb']} MB, PSS {result['total_pss_mb']} MB")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generation worker processes / throughput scaling benchmark")
+    parser.add_argument("--serve", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--index", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--cpus", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--model", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--model_id", type=str, default=None, help="Hugging Face model ID")
+    parser.add_argument("--model_path", type=str, default=None, help="Local model path")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to measure")
+    parser.add_argument("--cores-per-worker", type=int, default=None,
+                        help="Physical cores per worker (default: split the host evenly)")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=1, help="Images per dispatched batch")
+    parser.add_argument("--requests-per-worker", type=int, default=4, help="Batches per worker per measurement")
+    parser.add_argument("--json", type=str, default=None, help="Write results to this JSON file")
+
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.index, [int(cpu) for cpu in args.cpus.split(",")], args.model)
+        sys.exit(0)
+
+    from inference_hf_model import resolve_model
+    model_to_load = resolve_model(args.model_id, args.model_path)
+    cores_per_worker = args.cores_per_worker or max(1, len(physical_cores()) // max(args.workers))
+    print(f"Measuring {args.workers} workers x {cores_per_worker} physical cores on {model_to_load}")
+    results = benchmark(
+        model_to_load, args.workers, cores_per_worker, args.steps, args.size,
+        args.requests_per_worker, args.batch_size,
+    )
+
+    print(f"\n{'workers':>7s} {'img/s':>8s} {'speedup':>8s} {'eff.':>6s} {'RSS MB':>9s} {'PSS MB':>9s}")
+    for row in results:
+        print(f"{row['workers']:7d} {row['images_per_s']:8.3f} {row['speedup']:7.2f}x {row['efficiency']:6.2f} "
+              f"{row['total_rss_mb']:9.1f} {row['total_pss_mb']:9.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.json}")